@@ -0,0 +1,47 @@
+import time
+from collections import Counter, OrderedDict
+from typing import Generic, Hashable, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+class LRUCache(Generic[T]):
+    """Bounded in-process cache, evicts the least recently used entries, and the ones older than `ttl` seconds"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[Hashable, tuple[float, T]] = OrderedDict()
+        self.stats = Counter()  # hits, misses, evictions
+
+    def get(self, key: Hashable) -> Optional[T]:
+        entry = self.entries.get(key)
+        if entry and time.monotonic() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.stats['evictions'] += 1
+            entry = None
+        if not entry:
+            return None
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: Hashable, value: T):
+        self.entries[key] = time.monotonic(), value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def pop(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def hit(self):
+        self.stats['hits'] += 1
+
+    def miss(self):
+        self.stats['misses'] += 1
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / total if total else 0.
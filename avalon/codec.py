@@ -0,0 +1,221 @@
+"""
+Compact, schema-versioned binary format of games and listeners (msgpack based).
+
+Enums are stored as small ints, participants of a game are referenced by their index (votes and quest actions
+are bitmasks over the indexes) and datetimes as utc timestamps. Blobs which are not started by `MAGIC` are
+legacy pickles.
+
+The game history is a log of action records (`[action-code, *args]`), with a keyframe
+(`[0, encoded-game]`) every `GAME_HISTORY_KEYFRAME_INTERVAL` records.
+"""
+import pickle
+from array import array
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+import msgpack
+
+# avalon.game imports this module, so its members are only looked up at call time
+from avalon import game as g
+
+MAGIC = b'AV'
+SCHEMA_VERSION = 4
+EXT_PARTICIPANT = 1
+EPOCH = datetime(1970, 1, 1)
+KEYFRAME = 0
+ACTIONS = ['join', 'leave', 'play', 'proceed', 'select', 'confirm', 'vote', 'vote_result', 'quest', 'quest_result',
+           'lady', 'guess', 'restart']
+ACTION_CODES = {action: i + 1 for i, action in enumerate(ACTIONS)}
+
+
+class UnknownListenerKind(Exception):
+    """The listener is of a kind whose module is not imported by this process, e.g. SSH listeners in the bot"""
+
+
+@lru_cache()
+def phases() -> tuple[list['g.GamePhase'], dict['g.GamePhase', int]]:
+    values = list(g.GamePhase)
+    return values, {phase: i for i, phase in enumerate(values)}
+
+
+@lru_cache()
+def roles() -> tuple[list['g.Role'], dict['g.Role', int]]:
+    values = list(g.Role)
+    return values, {role: i for i, role in enumerate(values)}
+
+
+def is_legacy(data: bytes) -> bool:
+    return not data.startswith(MAGIC)
+
+
+def _ts(value: datetime) -> float:
+    return (value - EPOCH).total_seconds()
+
+
+def _dt(value: float) -> datetime:
+    return EPOCH + timedelta(seconds=value)
+
+
+def _pack(version, payload) -> bytes:
+    return MAGIC + bytes([version]) + msgpack.packb(payload, default=_default, use_bin_type=True)
+
+
+def _unpack(data: bytes):
+    version = data[len(MAGIC)]
+    if version > SCHEMA_VERSION:
+        raise ValueError(f'Unsupported schema version: {version}')
+    return msgpack.unpackb(data[len(MAGIC) + 1:], ext_hook=_ext_hook, strict_map_key=False, raw=False)
+
+
+def _default(obj):
+    if isinstance(obj, g.Participant):
+        return msgpack.ExtType(EXT_PARTICIPANT, msgpack.packb(encode_participant(obj), use_bin_type=True))
+    if isinstance(obj, datetime):
+        return _ts(obj)
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+def _ext_hook(code, data):
+    if code == EXT_PARTICIPANT:
+        return decode_participant(msgpack.unpackb(data, raw=False))
+    return msgpack.ExtType(code, data)
+
+
+def encode_participant(p: 'g.Participant') -> list:
+    return [p.codec_kind, p.identity, None if p.role is None else roles()[1][p.role],
+            [getattr(p, field, None) for field in p.codec_fields]]
+
+
+def decode_participant(value: list) -> 'g.Participant':
+    # Before schema 4: [kind, identity, role, vote, quest_action, extra]
+    kind, identity, role, *_, extra = value
+    cls = g.Participant.kinds[kind]
+    p = cls.__new__(cls)
+    p.identity = identity
+    p.role = None if role is None else roles()[0][role]
+    for field, field_value in zip(cls.codec_fields, extra):
+        setattr(p, field, field_value)
+    return p
+
+
+def encode_game(game: 'g.Game') -> bytes:
+    ps = game.participants
+    index = {p.identity: i for i, p in enumerate(ps)}
+
+    def ref(p):
+        return None if p is None else index[p.identity]
+
+    return _pack(SCHEMA_VERSION, [
+        game.game_id,
+        _ts(game.created),
+        _ts(game.last_save),
+        game.game_result,
+        getattr(game, 'failed_voting_count', 0),
+        phases()[1][game.phase],
+        phases()[1][game._last_phase],
+        [encode_participant(p) for p in ps],
+        [ref(p) for p in game.current_team],
+        list(game.round_result),
+        ref(game.king),
+        ref(game.lady),
+        [ref(p) for p in game.past_ladies],
+        # schema 2
+        game.history_size,
+        game.history_keyframe,
+        # schema 3
+        game.version,
+        # schema 4
+        [game.votes_cast, game.votes_approved, game.quest_actions_cast, game.quest_actions_succeeded],
+    ])
+
+
+def decode_game(data: bytes) -> 'g.Game':
+    if is_legacy(data):
+        game = pickle.loads(data)
+        game.history_size = game.history_keyframe = game.version = 0
+        return game
+    fields = _unpack(data)
+    fields += [0, 0, 0, None][len(fields) - 13:]  # Fields added in later schemas
+    (game_id, created, last_save, game_result, failed_voting_count, phase, last_phase, participants, current_team,
+     round_result, king, lady, past_ladies, history_size, history_keyframe, version, actions) = fields
+    game = g.Game.__new__(g.Game)
+    ps = [decode_participant(p) for p in participants]
+
+    def deref(i):
+        return None if i is None else ps[i]
+
+    game.game_id = game_id
+    game.created = _dt(created)
+    game.last_save = _dt(last_save)
+    game.game_result = game_result
+    game.failed_voting_count = failed_voting_count
+    game.phase = phases()[0][phase]
+    game._last_phase = phases()[0][last_phase]
+    game.participants = ps
+    game.current_team = [deref(i) for i in current_team]
+    game.round_result = array('B', round_result)
+    game.king = deref(king)
+    game.lady = deref(lady)
+    game.past_ladies = [deref(i) for i in past_ladies]
+    game.history_size = history_size
+    game.history_keyframe = history_keyframe
+    game.version = version
+    if actions is None:  # Before schema 4, votes and quest actions are stored by the participants
+        game.set_legacy_actions([(p[3], p[4]) for p in participants])
+    else:
+        game.votes_cast, game.votes_approved, game.quest_actions_cast, game.quest_actions_succeeded = actions
+    return game
+
+
+def encode_action(action: str, args) -> bytes:
+    return msgpack.packb([ACTION_CODES[action], *args], default=_default, use_bin_type=True)
+
+
+def encode_keyframe(game_data: bytes) -> bytes:
+    return msgpack.packb([KEYFRAME, game_data], use_bin_type=True)
+
+
+def decode_record(record: bytes):
+    """:return: the game of a keyframe, or (action, args) of an action record"""
+    code, *args = msgpack.unpackb(record, ext_hook=_ext_hook, raw=False)
+    if code == KEYFRAME:
+        return decode_game(args[0])
+    return ACTIONS[code - 1], args
+
+
+def encode_listener(listener: 'g.EventListener') -> bytes:
+    state = listener.__getstate__()
+    head = [state.pop(k) for k in ('id', 'game_id', 'created', 'last_save')]
+    return _pack(SCHEMA_VERSION, [listener.codec_kind, *head, state])
+
+
+def decode_listener(data: bytes) -> 'g.EventListener':
+    if is_legacy(data):
+        return pickle.loads(data)
+    kind, listener_id, game_id, created, last_save, state = _unpack(data)
+    cls = g.EventListener.kinds.get(kind)
+    if cls is None:
+        raise UnknownListenerKind(kind)
+    listener = cls.__new__(cls)
+    state.update(id=listener_id, game_id=game_id, created=_dt(created), last_save=_dt(last_save))
+    listener.__setstate__(state)
+    return listener
+
+
+def encode_event(game_id: str, event: 'g.GameEvent', game_data: Optional[bytes] = None) -> bytes:
+    """`game_data` is the encoded game at the version of the event (if it's carried by the event)"""
+    fields = [game_id, type(event).__name__, event.__dict__]
+    if game_data is not None:
+        fields.append(game_data)
+    return msgpack.packb(fields, default=_default, use_bin_type=True)
+
+
+def decode_event(data: bytes) -> tuple[str, 'g.GameEvent']:
+    game_id, kind, state, *game_data = msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+    cls = g.GameEvent.kinds[kind]
+    event = cls.__new__(cls)
+    event.__dict__.update(state)
+    if game_data:
+        event.data = game_data[0]
+    return game_id, event
@@ -14,13 +14,51 @@ def as_boolean(val) -> bool:
 REDIS_URL = env.get('REDIS_URL', 'redis://127.0.0.1:6379/0')
 BOT_TOKEN = env.get('BOT_TOKEN')
 BOT_PROXY = env.get('BOT_PROXY')
+BOT_API_URL = env.get('BOT_API_URL', 'https://api.telegram.org/bot')
+TG_EDIT_WINDOW = float(env.get('TG_EDIT_WINDOW', 0.5))  # Seconds to coalesce message edits of a chat
+# Outbound rate limits of the bot API (calls per second)
+TG_GLOBAL_RATE = float(env.get('TG_GLOBAL_RATE', 30))
+TG_CHAT_RATE = float(env.get('TG_CHAT_RATE', 1))
+TG_CHAT_BURST = float(env.get('TG_CHAT_BURST', 3))
+TG_RETRY_AFTER_LIMIT = int(env.get('TG_RETRY_AFTER_LIMIT', 3))  # Retries of a call on flood-control errors
+TG_RESTORE_BATCH = int(env.get('TG_RESTORE_BATCH', 200))  # Listeners loaded per round-trip on startup
+# Public base URL of the webhook (Telegram should reach the TG_WEBHOOK_PORT), polling is used if not set
+TG_WEBHOOK_URL = env.get('TG_WEBHOOK_URL')
+TG_WEBHOOK_PORT = int(env.get('TG_WEBHOOK_PORT', 8443))
+TG_WEBHOOK_WORKERS = int(env.get('TG_WEBHOOK_WORKERS', 16))  # Updates processed concurrently
+TG_WEBHOOK_BACKLOG = int(env.get('TG_WEBHOOK_BACKLOG', 1000))  # Received updates waiting for a worker
+TG_DISPATCH_WORKERS = int(env.get('TG_DISPATCH_WORKERS', 64))  # Chats are hashed onto them, to keep the order
 GAME_DEBUG = as_boolean(env.get('GAME_DEBUG'))
+LOG_LEVEL = env.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = env.get('LOG_FORMAT', 'json')  # json, or text
 
 REDIS_PREFIX_GAME = 'game_'
-REDIS_PREFIX_GAME_HISTORY = 'history_game_'
+REDIS_PREFIX_GAME_HISTORY = 'history_log_game_'
 REDIS_PREFIX_LISTENER = 'listener_'
 GAME_RETENTION = 7 * 24 * 3600  # 7days
-REDIS_PREFIX_GAME_LOCK = 'lock_game_'
-REDIS_PREFIX_LISTENER_LOCK = 'lock_listener_'
+GAME_HISTORY_RETENTION = 24 * 3600  # 1day
+GAME_CACHE_SIZE = int(env.get('GAME_CACHE_SIZE', 1000))
+GAME_CACHE_TTL = float(env.get('GAME_CACHE_TTL', 600))  # Seconds
+RENDER_CACHE_SIZE = int(env.get('RENDER_CACHE_SIZE', 5000))  # Rendered messages, see `EventListener.rendered`
+GAME_SAVE_RETRIES = 8  # On concurrent modifications
+GAME_SAVE_BACKOFF = 0.005  # Seconds, doubled on each retry
+GAME_HISTORY_KEYFRAME_INTERVAL = int(env.get('GAME_HISTORY_KEYFRAME_INTERVAL', 50))
+REDIS_EVENT_STREAM = 'stream:game_events'  # Out of the key prefixes above, ids can't have ':'
+REDIS_EVENT_STREAM_LENGTH = 10000
+
+EVENT_BUS = env.get('EVENT_BUS', 'memory')  # memory: single process, redis: shared between processes
+
+# Local endpoint of the metrics (Prometheus text format, on /metrics), 0: disabled.
+# In the supervisor mode each process gets its own port, counting up from METRICS_PORT
+METRICS_HOST = env.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(env.get('METRICS_PORT', 0))
+
+# Profiling of the hot paths (see avalon.profiling): '' (disabled), 'sample' or 'cprofile', dumped on SIGUSR1
+PROFILING = env.get('PROFILING', '')
+PROFILING_INTERVAL = float(env.get('PROFILING_INTERVAL', 0.005))  # Seconds between the samples
+PROFILING_DIR = env.get('PROFILING_DIR', '/tmp')
 
 SSH_HOST_KEY = env.get('SSH_HOST_KEY')
+SSH_PORT = int(env.get('SSH_PORT', 8022))
+# Number of SSH worker processes (sharing the port), the Telegram bot runs in its own process. 0: all in one process
+SSH_WORKERS = int(env.get('SSH_WORKERS', 0))
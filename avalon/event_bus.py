@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import weakref
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from avalon import config, metrics
+
+logger = logging.getLogger(__name__)
+GAME_EVENTS = metrics.counter('avalon_game_events_total', 'Game events delivered to the listeners', ('event',))
+
+
+class EventBus:
+    """
+    Delivers game events to the listeners (anything with a `queue`) subscribed to the game.
+    Events of a save are `stage`d on its redis transaction (or XADDed to `stream` by its script),
+    and `dispatch`ed after it is committed.
+    """
+    stream: Optional[str] = None
+
+    def __init__(self):
+        self.listeners: dict[str, set] = defaultdict(weakref.WeakSet)
+
+    @staticmethod
+    def create(backend: str, redis_client) -> 'EventBus':
+        if backend == 'memory':
+            return InMemoryEventBus()
+        if backend == 'redis':
+            return RedisEventBus(redis_client)
+        raise ValueError('Invalid event bus: ' + backend)
+
+    def subscribe(self, game_id: str, listener):
+        self.listeners[game_id].add(listener)
+
+    def unsubscribe(self, game_id: str, listener):
+        self.listeners[game_id].discard(listener)
+        if not self.listeners[game_id]:
+            del self.listeners[game_id]
+
+    def deliver(self, game_id: str, event):
+        logger.info('Publish game event: %s: %s', game_id, type(event).__name__, extra={'game_id': game_id})
+        GAME_EVENTS.labels(type(event).__name__).inc()
+        for listener in self.listeners.get(game_id, ()):
+            listener.queue.put_nowait(event)
+
+    def encode(self, game_id: str, events: Iterable, game_data: Optional[bytes] = None) -> list[bytes]:
+        """:return: entries to be added to `stream`, `game_data` is the encoded game which published the events"""
+        return []
+
+    def stage(self, pipe, game_id: str, events: Iterable):
+        for entry in self.encode(game_id, events):
+            pipe.xadd(self.stream, {'e': entry}, maxlen=config.REDIS_EVENT_STREAM_LENGTH, approximate=True)
+
+    def dispatch(self, game_id: str, events: Iterable):
+        pass
+
+
+class InMemoryEventBus(EventBus):
+    """Only listeners of the current process are notified"""
+
+    def dispatch(self, game_id: str, events: Iterable):
+        for event in events:
+            self.deliver(game_id, event)
+
+
+class RedisEventBus(EventBus):
+    """
+    Events are appended to a redis stream (atomically with the game save) which is read by every process.
+    A single stream keeps the events of a game in order, and reading resumes from the last delivered entry
+    after connection errors.
+    """
+
+    def __init__(self, redis_client):
+        super().__init__()
+        self.redis_client = redis_client
+        self.stream = config.REDIS_EVENT_STREAM
+        self.last_id = '$'
+        self.reader: Optional[asyncio.Task] = None
+
+    def subscribe(self, game_id: str, listener):
+        super().subscribe(game_id, listener)
+        if not self.reader or self.reader.done():
+            self.reader = asyncio.create_task(self.read())
+
+    def encode(self, game_id: str, events: Iterable, game_data: Optional[bytes] = None) -> list[bytes]:
+        from avalon import codec  # codec depends on avalon.game, which depends on this module
+        # The first event carries the game, so the listeners of other processes need no round-trip to load it
+        return [codec.encode_event(game_id, event, None if i else game_data) for i, event in enumerate(events)]
+
+    async def read(self):
+        from avalon import codec
+        while True:
+            try:
+                if self.last_id == '$':
+                    # Start from the current end of the stream, and keep the exact position from then on
+                    entries = await self.redis_client.xrevrange(self.stream, count=1)
+                    self.last_id = entries[0][0] if entries else '0-0'
+                response = await self.redis_client.xread({self.stream: self.last_id}, count=100, block=5000)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Error on reading game events, retrying')
+                await asyncio.sleep(1)
+                continue
+            for _stream, entries in response:
+                for entry_id, fields in entries:
+                    self.last_id = entry_id
+                    try:
+                        self.deliver(*codec.decode_event(fields[b'e']))
+                    except Exception:
+                        logger.exception('Invalid game event: %s', entry_id)
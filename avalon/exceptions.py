@@ -31,3 +31,7 @@ class OnlyAssassinCanDo(InvalidActionException):
 
 class InvalidParticipant(InvalidActionException):
     msg = 'Not a game participant'
+
+
+class ConcurrentModification(InvalidActionException):
+    msg = 'Game has been changed meanwhile, please retry'
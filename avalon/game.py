@@ -1,24 +1,108 @@
 import asyncio
 import enum
 import logging
-import pickle
 import random
 import re
-import weakref
-from collections import defaultdict
+import time
+from array import array
 from contextlib import asynccontextmanager
 from datetime import datetime
 from random import sample
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional, TypeVar
 
 import aioredis
 
-from avalon import config, exceptions
+from avalon import config, exceptions, codec, metrics, profiling
+from avalon.cache import LRUCache
+from avalon.event_bus import EventBus
 from avalon.exceptions import InvalidActionException, OnlyKingCanDo, OnlyLadyCanDo, InvalidParticipant, \
-    OnlyAssassinCanDo
+    OnlyAssassinCanDo, ConcurrentModification
 
 logger = logging.getLogger(__name__)
 redis_client = aioredis.from_url(config.REDIS_URL)
+event_bus = EventBus.create(config.EVENT_BUS, redis_client)
+# Games are stored as {version, data} hashes, older games as plain strings of data.
+# Returns [version] if the version is equal to ARGV[1] (the cached one), otherwise [version, data]
+load_game_script = redis_client.register_script("""
+local key_type = redis.call('TYPE', KEYS[1]).ok
+if key_type == 'none' then
+    return {}
+elseif key_type ~= 'hash' then
+    return {'', redis.call('GET', KEYS[1])}
+end
+local version = redis.call('HGET', KEYS[1], 'version')
+if version == ARGV[1] then
+    return {version}
+end
+return {version, redis.call('HGET', KEYS[1], 'data')}
+""")
+# KEYS: game, history, event-stream
+# ARGV: expected-version (empty for new games), version, data, retention, history-retention, stream-length,
+#       history size (before the records, 0 starts a new history), number of history records, history records...,
+#       events...
+# Returns 1 if saved, 0 on a version conflict, -1 if the history is not at the size (e.g. expired)
+save_game_script = redis_client.register_script("""
+local key_type = redis.call('TYPE', KEYS[1]).ok
+if ARGV[1] ~= '' and key_type == 'hash' and redis.call('HGET', KEYS[1], 'version') ~= ARGV[1] then
+    return 0
+end
+local history_size = tonumber(ARGV[7])
+if history_size == 0 then
+    redis.call('DEL', KEYS[2])
+elseif redis.call('LLEN', KEYS[2]) ~= history_size then
+    return -1
+end
+if key_type == 'string' then
+    redis.call('DEL', KEYS[1])
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[2], 'data', ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local records = tonumber(ARGV[8])
+if records > 0 then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, 9, 8 + records))
+end
+redis.call('EXPIRE', KEYS[2], ARGV[5])
+for i = 9 + records, #ARGV do
+    redis.call('XADD', KEYS[3], 'MAXLEN', '~', ARGV[6], '*', 'e', ARGV[i])
+end
+return 1
+""")
+# Listeners are stored as {game_id, data} hashes, older listeners as plain strings of data.
+# KEYS: listener; ARGV: game key prefix.
+# Returns [listener-data, game_id, game-version, game-data], without the game part if the game doesn't exist,
+# and [listener-data] for the older listeners.
+# The game key is built here (not passed in KEYS), so this requires all the keys on a single redis node
+load_listener_script = redis_client.register_script("""
+local key_type = redis.call('TYPE', KEYS[1]).ok
+if key_type == 'none' then
+    return {}
+elseif key_type ~= 'hash' then
+    return {redis.call('GET', KEYS[1])}
+end
+local listener = redis.call('HMGET', KEYS[1], 'data', 'game_id')
+local game_key = ARGV[1] .. listener[2]
+local game_type = redis.call('TYPE', game_key).ok
+if game_type == 'hash' then
+    local game = redis.call('HMGET', game_key, 'version', 'data')
+    return {listener[1], listener[2], game[1], game[2]}
+elseif game_type ~= 'none' then
+    return {listener[1], listener[2], '', redis.call('GET', game_key)}
+end
+return {listener[1], listener[2]}
+""")
+# Committed (version, data) of the loaded and saved games, validated by the version on each load. Every load decodes
+# its own game, since the callers change them
+game_cache: LRUCache[tuple[int, bytes]] = LRUCache(config.GAME_CACHE_SIZE, config.GAME_CACHE_TTL)
+# Messages rendered by the listeners, by the game version and the view state of the listener
+render_cache: LRUCache = LRUCache(config.RENDER_CACHE_SIZE, config.GAME_CACHE_TTL)
+T = TypeVar('T')
+GAME_ACTIONS = metrics.counter('avalon_game_actions_total', 'Saved actions of the games', ('action',))
+GAME_SAVE_SECONDS = metrics.histogram('avalon_game_save_seconds', 'Duration of the game saves', ('result',))
+GAME_SAVE_BYTES = metrics.histogram('avalon_game_save_bytes', 'Size of the saved games', buckets=metrics.SIZE_BUCKETS)
+GAME_LOAD_SECONDS = metrics.histogram('avalon_game_load_seconds', 'Duration of the game loads (by id)',
+                                      ('result',))
+GAME_LOAD_BYTES = metrics.histogram('avalon_game_load_bytes', 'Size of the loaded (not cached) games',
+                                    buckets=metrics.SIZE_BUCKETS)
 SUCCESS_EMOJI = "🏆"
 FAIL_EMOJI = "☠"
 KING_EMOJI = "👑"
@@ -30,25 +114,42 @@ def verify_identity(identity):
         raise ValueError('Invalid identity: ' + str(identity))
 
 
+async def conflict_backoff(attempt: int):
+    """Randomized exponential backoff, before retrying an action which its save is failed by ConcurrentModification"""
+    await asyncio.sleep(random.uniform(0, config.GAME_SAVE_BACKOFF * 2 ** min(attempt, 6)))
+
+
 class Participant:
+    """Votes and quest actions of the participants are kept by the game, see `Game.get_vote`"""
+    __slots__ = ('identity', 'role', '_legacy_actions')
+    codec_kind = 'p'
+    codec_fields: tuple[str, ...] = ()  # Extra attributes of subclasses to be stored (and slots of them)
+    kinds: dict[str, type['Participant']] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        Participant.kinds[cls.codec_kind] = cls
+
     def __init__(self, identity: str):
         verify_identity(identity)
         self.identity = identity
         self.role: Optional[Role] = None
-        self.vote: Optional[bool] = None
-        self.quest_action: Optional[bool] = None
 
-    @property
-    def current_vote_text(self):
-        if self.vote is None:
-            return 'Not voted'
-        return 'Approved' if self.vote else 'Rejected'
-
-    @property
-    def current_quest_action_text(self):
-        if self.vote is None:
-            return 'Nothing'
-        return 'Success' if self.quest_action else 'Fail'
+    def __setstate__(self, state):
+        if isinstance(state, tuple):  # (__dict__, __slots__) of pickled slotted objects
+            state = {**(state[0] or {}), **state[1]}
+        if 'vote' in state:  # Legacy pickle, the actions are kept until they are taken by `Game.__setstate__`
+            self._legacy_actions = state.pop('vote'), state.pop('quest_action', None)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def pop_legacy_actions(self) -> tuple[Optional[bool], Optional[bool]]:
+        """:return: (vote, quest_action) of a legacy pickle"""
+        actions = getattr(self, '_legacy_actions', None)
+        if actions is None:
+            return None, None
+        del self._legacy_actions
+        return actions
 
     def __eq__(self, other):
         return isinstance(other, Participant) and self.identity == other.identity
@@ -57,6 +158,9 @@ class Participant:
         return self.identity
 
 
+Participant.kinds[Participant.codec_kind] = Participant
+
+
 class GamePhase(enum.Enum):
     Joining = 'Joining'
     Started = 'Started'
@@ -132,7 +236,29 @@ if config.GAME_DEBUG:
     GAME_PLANS[3] = GamePlan('1/1 1/1 1/1 1/1 1/1', 'Servant,Merlin,Assassin')
 
 
+class GameIndex:
+    """Lookup tables of the participants of a game, by identity and role, and what each role can see"""
+
+    def __init__(self, ps: list[Participant]):
+        self.positions = {p.identity: i for i, p in enumerate(ps)}
+        self.by_role: dict[Role, list[Participant]] = {}
+        for p in ps:
+            if p.role is not None:
+                self.by_role.setdefault(p.role, []).append(p)
+        self.merlin_info = [p for p in ps if p.role in MERLIN_INFO]
+        self.percival_info = [p for p in ps if p.role in PERCIVAL_INFO]
+        self.evil_info = [p for p in ps if p.role in EVIL_INFO]
+        self.merlin_candidates = [p for p in ps if p.role is not None and not p.role.is_evil]
+        evils = [p for p in ps if p.role is not None and p.role.is_evil]
+        self.assassin = (self.by_role.get(Role.Assassin) or evils or [None])[0]
+
+
 class Game:
+    # Derived from the state of the game, built lazily and reset where the state is changed
+    _index: Optional[GameIndex] = None
+    _team_ids: Optional[set[str]] = None
+    _lady_candidates: Optional[list[Participant]] = None
+
     def __init__(self, game_id='', participants: Optional[list[Participant]] = None,
                  _last_phase=GamePhase.Joining):
         verify_identity(game_id)
@@ -146,10 +272,17 @@ class Game:
         self.current_team: list[Participant] = []
         self.phase = GamePhase.Joining
         self._last_phase = _last_phase
-        self.round_result: list[bool] = []  # True: servant-won, False: evil-won
+        self.round_result = array('B')  # 1: servant-won, 0: evil-won
         self.king: Optional[Participant] = None
         self.lady: Optional[Participant] = None
         self.past_ladies: list[Participant] = []
+        # Bitmasks over the indexes of the participants
+        self.votes_cast = self.votes_approved = 0
+        self.quest_actions_cast = self.quest_actions_succeeded = 0
+        self.version = 0  # Incremented on every change
+        self.history_size = 0  # Number of records in the history log
+        self.history_keyframe = 0  # Index of the last keyframe in the history log
+        self._index = self._team_ids = self._lady_candidates = None
 
     def add_participant(self, participant: Participant):
         self.require_game_phase(GamePhase.Joining)
@@ -158,7 +291,9 @@ class Game:
             raise exceptions.AlreadyJoined
         except InvalidParticipant:
             self.participants.append(participant)
+            self._index = self._lady_candidates = None
             self.publish_event(GameParticipantsChanged())
+            self._record('join', participant)
 
     def remove_participant(self, participant: Participant):
         self.require_game_phase(GamePhase.Joining)
@@ -167,7 +302,9 @@ class Game:
         except InvalidParticipant:
             raise exceptions.NotJoined from None
         self.participants = [p for p in self.participants if p.identity != participant.identity]
+        self._index = self._lady_candidates = None
         self.publish_event(GameParticipantsChanged())
+        self._record('leave', participant.identity)
 
     @property
     def plan(self) -> GamePlan:
@@ -181,41 +318,89 @@ class Game:
     def max_reject_rounds(self) -> int:
         return 5
 
+    @property
+    def index(self) -> GameIndex:
+        """Lookup tables of the participants, rebuilt (lazily) after the participants or their roles are changed"""
+        if self._index is None:
+            self._index = GameIndex(self.participants)
+        return self._index
+
+    def _bit(self, participant: Participant) -> int:
+        return 1 << self.index.positions[participant.identity]
+
+    def get_vote(self, participant: Participant) -> Optional[bool]:
+        bit = self._bit(participant)
+        return bool(self.votes_approved & bit) if self.votes_cast & bit else None
+
+    def get_quest_action(self, participant: Participant) -> Optional[bool]:
+        bit = self._bit(participant)
+        return bool(self.quest_actions_succeeded & bit) if self.quest_actions_cast & bit else None
+
+    def vote_text(self, participant: Participant) -> str:
+        vote = self.get_vote(participant)
+        if vote is None:
+            return 'Not voted'
+        return 'Approved' if vote else 'Rejected'
+
+    def quest_action_text(self, participant: Participant) -> str:
+        action = self.get_quest_action(participant)
+        if action is None:
+            return 'Nothing'
+        return 'Success' if action else 'Fail'
+
+    def in_team(self, participant: Participant) -> bool:
+        if self._team_ids is None:
+            self._team_ids = {p.identity for p in self.current_team}
+        return participant.identity in self._team_ids
+
     def play(self):
         self.require_game_phase(GamePhase.Joining)
         if len(self.participants) not in GAME_PLANS:
             raise InvalidActionException('Game should have 5 to 10 participants')
-        for role, p in zip(sample(self.plan.roles, len(self.participants)), self.participants):
-            p.role = role
-        self.king, self.lady = sample(self.participants, 2)
+        king, lady = sample(self.participants, 2)
+        self.assign_roles([r.value for r in sample(self.plan.roles, len(self.participants))],
+                          king.identity, lady.identity)
+
+    def assign_roles(self, roles: list[str], king_identity: str, lady_identity: str):
+        for role, p in zip(roles, self.participants):
+            p.role = Role(role)
+        self._index = None
+        self.king = self.get_participant_by_id(king_identity)
+        self.lady = self.get_participant_by_id(lady_identity)
+        self._lady_candidates = None
         self.phase = GamePhase.Started
+        self._record('play', roles, king_identity, lady_identity)
 
     def get_user_info(self, pr: Participant):
+        index = self.index
         msg = f'You role: {pr.role.value}'
         if pr.role == Role.Merlin:
-            msg += ', Evil: {}'.format(', '.join(str(p) for p in self.participants if p.role in MERLIN_INFO))
+            msg += ', Evil: {}'.format(', '.join(str(p) for p in index.merlin_info))
         if pr.role == Role.Percival:
-            msg += ', Morgana/Merlin: {}'.format(
-                ', '.join(str(p) for p in self.participants if p.role in PERCIVAL_INFO))
+            msg += ', Morgana/Merlin: {}'.format(', '.join(str(p) for p in index.percival_info))
         if pr.role.is_evil and pr.role != Role.Oberon:
             msg += ', Teammates: {}'.format(
-                '\n'.join('{}:{}'.format(p.role.value, p) for p in self.participants if p.role in EVIL_INFO and pr != p))
+                '\n'.join('{}:{}'.format(p.role.value, p) for p in index.evil_info if pr != p))
         return msg
 
     def proceed_to_game(self):
         self.require_game_phase(GamePhase.Started)
         self.phase = GamePhase.TeamBuilding
+        self._record('proceed')
 
     def select_for_team(self, participant: Participant, identity: str):
         self.require_game_phase(GamePhase.TeamBuilding)
         if self.king != participant:
             raise OnlyKingCanDo
         p = self.get_participant_by_id(identity)
-        if p in self.current_team:
+        if self.in_team(p):
             self.current_team.remove(p)
+            self._team_ids.remove(p.identity)
         else:
             self.current_team.append(p)
+            self._team_ids.add(p.identity)
         self.publish_event(QuestTeamChanged())
+        self._record('select', identity)
 
     def confirm_team(self, participant: Participant):
         self.require_game_phase(GamePhase.TeamBuilding)
@@ -224,15 +409,18 @@ class Game:
         if len(self.current_team) != self.step[1]:
             raise InvalidActionException('Please select correct number of team members')
         self.phase = GamePhase.TeamVote
-        for p in self.participants:
-            p.vote = None
-        participant.vote = True
+        self.votes_cast = self.votes_approved = self._bit(participant)
+        self._record('confirm')
 
     def vote(self, participant: Participant, vote: bool):
         self.require_game_phase(GamePhase.TeamVote)
-        if participant.vote != vote:
-            participant.vote = vote
+        bit = self._bit(participant)
+        approved = self.votes_approved | bit if vote else self.votes_approved & ~bit
+        if not self.votes_cast & bit or approved != self.votes_approved:
+            self.votes_cast |= bit
+            self.votes_approved = approved
             self.publish_event(VotesChanged())
+            self._record('vote', participant.identity, vote)
 
     def process_vote_results(self) -> Optional[bool]:
         """
@@ -241,9 +429,10 @@ class Game:
         :return: voting_result (bool) or None if voting is not completed
         """
         self.require_game_phase(GamePhase.TeamVote)
-        if not all(p.vote is not None for p in self.participants):  # all-voted
+        if self.votes_cast != (1 << len(self.participants)) - 1:  # all-voted
             return
-        is_voting_succeeded = sum(p.vote for p in self.participants) > (len(self.participants) / 2)
+        self._record('vote_result')
+        is_voting_succeeded = bin(self.votes_approved).count('1') > (len(self.participants) / 2)
         self.publish_event(VotingCompleted(is_voting_succeeded))
         if is_voting_succeeded:
             self.start_quest()
@@ -251,10 +440,10 @@ class Game:
             return True
         self.failed_voting_count = getattr(self, 'failed_voting_count', 0) + 1
         if self.failed_voting_count >= self.max_reject_rounds:
-            self.round_result.append(False)
+            self.round_result.append(0)
             self.failed_voting_count = 0
             self.publish_event(QuestFailedByTooManyRejections())
-            if sum(not res for res in self.round_result) == 3:  # evil won
+            if self.round_result.count(0) == 3:  # evil won
                 self.finish(False)
             else:
                 self.move_to_next_team_building()
@@ -265,21 +454,25 @@ class Game:
     def move_to_next_team_building(self):
         self.phase = GamePhase.TeamBuilding
         self.current_team = []
+        self._team_ids = set()
         ps = self.participants
         self.king = ps[(ps.index(self.king) + 1) % len(ps)]
 
     def start_quest(self):
         self.phase = GamePhase.Quest
-        for p in self.participants:
-            p.quest_action = None
+        self.quest_actions_cast = self.quest_actions_succeeded = 0
 
     def quest_action(self, participant: Participant, success: bool):
         self.require_game_phase(GamePhase.Quest)
-        if participant not in self.current_team:
+        if not self.in_team(participant):
             raise InvalidActionException('You are not a member of this quest')
-        if participant.quest_action != success:
-            participant.quest_action = success
+        bit = self._bit(participant)
+        succeeded = self.quest_actions_succeeded | bit if success else self.quest_actions_succeeded & ~bit
+        if not self.quest_actions_cast & bit or succeeded != self.quest_actions_succeeded:
+            self.quest_actions_cast |= bit
+            self.quest_actions_succeeded = succeeded
             self.publish_event(QuestActionsChanged())
+            self._record('quest', participant.identity, success)
 
     def process_quest_result(self) -> Optional[tuple[bool, int]]:
         """
@@ -289,15 +482,17 @@ class Game:
                 is_quest_succeeded (bool), and number failed votes (int)
         """
         self.require_game_phase(GamePhase.Quest)
-        if not all(p.quest_action is not None for p in self.current_team):  # all-voted
+        team = sum(self._bit(p) for p in self.current_team)
+        if self.quest_actions_cast & team != team:  # all-voted
             return
-        failed_votes = sum(not p.quest_action for p in self.current_team)
+        self._record('quest_result')
+        failed_votes = len(self.current_team) - bin(self.quest_actions_succeeded & team).count('1')
         is_quest_succeeded = failed_votes < self.step[0]
         self.round_result.append(is_quest_succeeded)
         self.publish_event(QuestCompleted(is_quest_succeeded, failed_votes, len(self.current_team) - failed_votes))
-        if sum(not res for res in self.round_result) == 3:  # evil won
+        if self.round_result.count(0) == 3:  # evil won
             self.finish(False)
-        elif sum(res for res in self.round_result) == 3:  # servant won
+        elif self.round_result.count(1) == 3:  # servant won
             self.phase = GamePhase.GuessMerlin
         elif len(self.round_result) >= self.plan.lady_step and self.next_lady_candidates():
             self.phase = self.phase.Lady
@@ -305,11 +500,14 @@ class Game:
             self.move_to_next_team_building()
         return is_quest_succeeded, failed_votes
 
-    def next_lady_candidates(self):
-        return [p for p in self.participants if p != self.lady and p not in self.past_ladies]
+    def next_lady_candidates(self) -> list[Participant]:
+        if self._lady_candidates is None:
+            past_ladies = {p.identity for p in self.past_ladies}
+            self._lady_candidates = [p for p in self.participants if p != self.lady and p.identity not in past_ladies]
+        return self._lady_candidates
 
-    def merlin_candidates(self):
-        return [p for p in self.participants if not p.role.is_evil]
+    def merlin_candidates(self) -> list[Participant]:
+        return self.index.merlin_candidates
 
     def set_next_lady(self, participant: Participant, next_identity: str, dry_run=False) -> Participant:
         self.require_game_phase(GamePhase.Lady)
@@ -321,7 +519,9 @@ class Game:
         if not dry_run:
             self.past_ladies.append(self.lady)
             self.lady = next_lady
+            self._lady_candidates = None
             self.move_to_next_team_building()
+            self._record('lady', next_identity)
         return next_lady
 
     def guess_merlin(self, participant: Participant, identity: str, dry_run=False) -> Participant:
@@ -333,15 +533,11 @@ class Game:
             raise InvalidActionException('Evils cannot be merlin!')
         if not dry_run:
             self.finish(p.role is not Role.Merlin)
+            self._record('guess', identity)
         return p
 
-    def get_assassin(self):
-        for p in self.participants:
-            if p.role is Role.Assassin:
-                return p
-        for p in self.participants:
-            if p.role.is_evil:
-                return p
+    def get_assassin(self) -> Optional[Participant]:
+        return self.index.assassin
 
     def require_game_phase(self, phase: GamePhase):
         if self.phase != phase:
@@ -351,12 +547,74 @@ class Game:
         self.phase = GamePhase.Finished
         self.game_result = servant_won
 
-    @staticmethod
-    def lock(game_id):
-        return redis_client.lock(config.REDIS_PREFIX_GAME_LOCK + game_id, timeout=120)
-
     def restart(self):
+        history = self.version, self.history_size, self.history_keyframe
         self.__init__(self.game_id, participants=self.participants, _last_phase=self.phase)
+        self.version, self.history_size, self.history_keyframe = history
+        self._record('restart')
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'votes_cast' not in state:  # Legacy pickle, votes and quest actions are kept by the participants
+            self.round_result = array('B', self.round_result)
+            self.set_legacy_actions([p.pop_legacy_actions() for p in self.participants])
+
+    def set_legacy_actions(self, actions: list[tuple[Optional[bool], Optional[bool]]]):
+        """Sets the bitmasks from the (vote, quest_action) of each participant"""
+        self.votes_cast = self.votes_approved = self.quest_actions_cast = self.quest_actions_succeeded = 0
+        for i, (vote, quest_action) in enumerate(actions):
+            if vote is not None:
+                self.votes_cast |= 1 << i
+                self.votes_approved |= bool(vote) << i
+            if quest_action is not None:
+                self.quest_actions_cast |= 1 << i
+                self.quest_actions_succeeded |= bool(quest_action) << i
+
+    def _record(self, action: str, *args):
+        """
+        Mark the game as changed, and keep the action (with msgpack-able or Participant arguments) to be appended
+        to the history log
+        """
+        self.version += 1
+        if not hasattr(self, '_pending_actions'):
+            # noinspection PyAttributeOutsideInit
+            self._pending_actions = []
+        self._pending_actions.append((action, args))
+
+    @property
+    def is_changed(self):
+        return self.version != getattr(self, '_saved_version', None)
+
+    def apply_action(self, action: str, *args):
+        """Replay an action recorded by `_record`"""
+        if action == 'join':
+            self.add_participant(args[0])
+        elif action == 'leave':
+            self.remove_participant(self.get_participant_by_id(args[0]))
+        elif action == 'play':
+            self.assign_roles(*args)
+        elif action == 'proceed':
+            self.proceed_to_game()
+        elif action == 'select':
+            self.select_for_team(self.king, args[0])
+        elif action == 'confirm':
+            self.confirm_team(self.king)
+        elif action == 'vote':
+            self.vote(self.get_participant_by_id(args[0]), args[1])
+        elif action == 'vote_result':
+            self.process_vote_results()
+        elif action == 'quest':
+            self.quest_action(self.get_participant_by_id(args[0]), args[1])
+        elif action == 'quest_result':
+            self.process_quest_result()
+        elif action == 'lady':
+            self.set_next_lady(self.lady, args[0])
+        elif action == 'guess':
+            self.guess_merlin(self.get_assassin(), args[0])
+        elif action == 'restart':
+            self.restart()
+        else:
+            raise ValueError('Unknown action: ' + action)
 
     def publish_event(self, event: 'GameEvent'):
         if not hasattr(self, '_pending_events'):
@@ -368,48 +626,178 @@ class Game:
                 return
         self._pending_events.append(event)
 
+    @profiling.hook('Game.save')
     async def save(self):
-        old_pickle = getattr(self, '_old_pickle', None)
-        if old_pickle:
-            # noinspection PyUnresolvedReferences
-            del self._old_pickle
-            if pickle.dumps(self) == old_pickle:
-                return
+        """
+        Optimistic save, raises ConcurrentModification if the game is changed (by someone else) since it is loaded
+        """
+        if not self.is_changed:
+            return
 
+        start = time.perf_counter()
         self.last_save = datetime.utcnow()
         if self._last_phase != self.phase:
             self.publish_event(GamePhaseChanged())
         self._last_phase = self.phase
-        pending_events = getattr(self, '_pending_events', ())
-        if isinstance(pending_events, list):
-            del self._pending_events
-        await redis_client.setex(config.REDIS_PREFIX_GAME + self.game_id, config.GAME_RETENTION, pickle.dumps(self))
-        await redis_client.lpush(config.REDIS_PREFIX_GAME_HISTORY + self.game_id, pickle.dumps(self))
-        await redis_client.expire(config.REDIS_PREFIX_GAME_HISTORY + self.game_id, 24 * 3600)
+        pending_events = getattr(self, '_pending_events', [])
+        self._pending_events = []
         for event in pending_events:
-            InMemoryPubSub.publish(self, event)
+            event.version = self.version
+        actions = getattr(self, '_pending_actions', [])
+        self._pending_actions = []
+        history = self.history_size, self.history_keyframe
+        version = self.version
+        result = 0
+        try:
+            result, data = await self._save_script(actions, pending_events)
+            if result == -1:  # The history is expired (it's kept for less time than the game), restarted by a keyframe
+                self.history_size = self.history_keyframe = 0
+                result, data = await self._save_script(actions, pending_events)
+        finally:
+            saved = result == 1
+            if not saved:  # Nothing is committed, the game is left unsaved as it was
+                self.history_size, self.history_keyframe = history
+                self._pending_actions[:0] = actions
+                self._pending_events[:0] = pending_events
+        GAME_SAVE_SECONDS.labels('saved' if saved else 'conflict').observe(time.perf_counter() - start)
+        if not saved:
+            raise ConcurrentModification
+        GAME_SAVE_BYTES.observe(len(data))
+        for action, _args in actions:
+            GAME_ACTIONS.labels(action).inc()
+        # noinspection PyAttributeOutsideInit
+        self._saved_version = version
+        game_cache.put(self.game_id, (version, data))
+        event_bus.dispatch(self.game_id, pending_events)
+
+    async def _save_script(self, actions: list, events: list) -> tuple[int, bytes]:
+        """Appends the actions to the history (and a keyframe, if due), :return: the result and the encoded game"""
+        records = [codec.encode_action(action, args) for action, args in actions]
+        history_size = self.history_size
+        is_keyframe = not self.history_size or \
+            self.history_size + len(records) - self.history_keyframe >= config.GAME_HISTORY_KEYFRAME_INTERVAL
+        self.history_size += len(records)
+        if is_keyframe:
+            self.history_keyframe = self.history_size
+            self.history_size += 1
+        data = codec.encode_game(self)
+        if is_keyframe:
+            records.append(codec.encode_keyframe(data))
+        saved_version = getattr(self, '_saved_version', None)
+        # Version check, snapshot, history and events are committed atomically, in a single round-trip
+        result = await save_game_script(
+            keys=[config.REDIS_PREFIX_GAME + self.game_id, config.REDIS_PREFIX_GAME_HISTORY + self.game_id,
+                  event_bus.stream or config.REDIS_EVENT_STREAM],
+            args=['' if saved_version is None else saved_version, self.version, data, config.GAME_RETENTION,
+                  config.GAME_HISTORY_RETENTION, config.REDIS_EVENT_STREAM_LENGTH, history_size, len(records),
+                  *records, *event_bus.encode(self.game_id, events, data)])
+        return result, data
+
+    @staticmethod
+    def _decode(data: bytes) -> 'Game':
+        game = codec.decode_game(data)
+        game._saved_version = game.version
+        return game
+
+    @staticmethod
+    def get_cached_at(game_id: str, version: int, data: Optional[bytes] = None) -> Optional['Game']:
+        """
+        Returns the game at the version, decoded from the cache if it's at the version, otherwise from `data` (the
+        state of the game at the version, if it's given). A later cached version isn't returned, the game id may be
+        deleted and created again (with lower versions) meanwhile
+        """
+        cached = game_cache.get(game_id)
+        if cached and cached[0] == version:
+            game_cache.hit()
+            return Game._decode(cached[1])
+        if data is None:
+            return
+        game_cache.miss()
+        game = Game._decode(data)
+        if not cached or cached[0] < game.version:
+            game_cache.put(game_id, (game.version, data))
+        return game
+
+    @staticmethod
+    def _from_stored(game_id: str, cached: Optional[tuple[int, bytes]],
+                     version: Optional[bytes] = None, data: Optional[bytes] = None) -> Optional['Game']:
+        """
+        Decodes the cached data if it's still at the stored version, otherwise the stored data (which is cached).
+        `cached` is taken before the round-trip, a later version may be cached (e.g. saved) meanwhile
+        """
+        if version is None:
+            game_cache.pop(game_id)
+            return
+        if cached and version == str(cached[0]).encode():
+            game_cache.hit()
+            return Game._decode(cached[1])
+        game_cache.miss()
+        game = Game._decode(data)
+        current = game_cache.get(game_id)
+        if current is cached or not current or current[0] < game.version:
+            game_cache.put(game_id, (game.version, data))
+        return game
 
     @classmethod
+    @profiling.hook('Game.load_by_id')
     async def load_by_id(cls, game_id: str) -> 'Game':
-        value = await redis_client.get(config.REDIS_PREFIX_GAME + game_id)
-        if value:
-            game = pickle.loads(value)
-            game._old_pickle = value
-            return game
+        start = time.perf_counter()
+        cached = game_cache.get(game_id)
+        response = await load_game_script(keys=[config.REDIS_PREFIX_GAME + game_id],
+                                          args=['' if cached is None else cached[0]])
+        game = cls._from_stored(game_id, cached, *response)
+        GAME_LOAD_SECONDS.labels('missing' if not response else 'decoded' if len(response) > 1 else 'cached') \
+            .observe(time.perf_counter() - start)
+        if len(response) > 1:
+            GAME_LOAD_BYTES.observe(len(response[1]))
+        return game
+
+    @classmethod
+    async def load_from_history(cls, game_id: str, index: int = -1) -> Optional['Game']:
+        """
+        Rebuild the game as it was right after the history record at `index` (negative indexes count from the end)
+        """
+        records = [codec.decode_record(r) for r in
+                   await redis_client.lrange(config.REDIS_PREFIX_GAME_HISTORY + game_id, 0, index)]
+        for start in range(len(records) - 1, -1, -1):
+            if isinstance(records[start], Game):
+                break
+        else:
+            return
+        game = records[start]
+        for action, args in records[start + 1:]:
+            game.apply_action(action, *args)
+        game._pending_actions = []
+        return game
+
+    @staticmethod
+    async def history_length(game_id: str) -> int:
+        return await redis_client.llen(config.REDIS_PREFIX_GAME_HISTORY + game_id)
 
     async def delete(self):
-        await redis_client.delete(config.REDIS_PREFIX_GAME + self.game_id)
-        InMemoryPubSub.publish(self, GameDeleted())
+        game_cache.pop(self.game_id)
+        events = [GameDeleted()]
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(config.REDIS_PREFIX_GAME + self.game_id)
+            event_bus.stage(pipe, self.game_id, events)
+            await pipe.execute()
+        event_bus.dispatch(self.game_id, events)
 
-    def get_participant_by_id(self, identity):
-        for p in self.participants:
-            if p.identity == identity:
-                return p
-        raise InvalidParticipant
+    def get_participant_by_id(self, identity) -> Participant:
+        i = self.index.positions.get(identity)
+        if i is None:
+            raise InvalidParticipant
+        return self.participants[i]
 
 
 class GameEvent:
-    pass
+    kinds: dict[str, type['GameEvent']] = {}
+    version: Optional[int] = None  # Of the saved game which published the event
+    data: Optional[bytes] = None  # Encoded game at the version, carried by the first event of a save on the stream
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        GameEvent.kinds[cls.__name__] = cls
 
 
 class GamePhaseChanged(GameEvent):
@@ -454,6 +842,13 @@ class GameDeleted(GameEvent):
 
 
 class EventListener:
+    codec_kind = 'e'
+    kinds: dict[str, type['EventListener']] = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        EventListener.kinds[cls.codec_kind] = cls
+
     def __init__(self, listener_id, game: Game):
         self.game = game
         self.game_id = game.game_id
@@ -463,7 +858,12 @@ class EventListener:
 
     async def save(self):
         self.last_save = datetime.utcnow()
-        await redis_client.setex(config.REDIS_PREFIX_LISTENER + self.id, config.GAME_RETENTION, pickle.dumps(self))
+        key = config.REDIS_PREFIX_LISTENER + self.id
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)  # Older listeners are stored as strings
+            pipe.hset(key, mapping={'game_id': self.game_id, 'data': codec.encode_listener(self)})
+            pipe.expire(key, config.GAME_RETENTION)
+            await pipe.execute()
 
     async def delete(self):
         await redis_client.delete(config.REDIS_PREFIX_LISTENER + self.id)
@@ -473,29 +873,111 @@ class EventListener:
         assert self.game
         return self.game
 
+    async def sync_game(self, event: 'GameEvent') -> Game:
+        """Brings the game up to the version of the event, without a round-trip if it is cached or carried by it"""
+        game = event.version is not None and Game.get_cached_at(self.game_id, event.version, event.data)
+        if not game:
+            return await self.reload_game()
+        self.game = game
+        return game
+
+    def view_state(self) -> tuple:
+        """State of the listener (besides the game) which its messages depend on"""
+        return ()
+
+    def rendered(self, render: Callable[[], T]) -> T:
+        """
+        Returns the message built by `render` (a message builder of this listener, without arguments), memoized for
+        the saved version of the game and the view state. The returned message must not be modified.
+        """
+        game = self.game
+        if game.is_changed:  # Not saved (yet), the same version may end up with another state
+            return render()
+        key = (self.codec_kind, game.game_id, game.created, game.version, game.phase, render.__name__,
+               *self.view_state())
+        message = render_cache.get(key)
+        if message is None:
+            render_cache.miss()
+            message = render()
+            render_cache.put(key, message)
+        else:
+            render_cache.hit()
+        return message
+
+    def log_context(self) -> dict:
+        """`extra` of the log records about the listener, see `avalon.log`"""
+        return {'game_id': self.game_id, 'listener_id': self.id, 'phase': self.game and self.game.phase.name}
+
     @asynccontextmanager
     async def listen(self):
-        logger.info(f'Started game {self.game_id} listener: {self.id} {id(self)}')
-        InMemoryPubSub.listeners[self.game_id].add(self)
+        logger.info('Started game %s listener: %s %s', self.game_id, self.id, id(self), extra=self.log_context())
+        event_bus.subscribe(self.game_id, self)
         try:
             yield self
         finally:
-            logger.info(f'Stopped game {self.game_id} listener: {self.id} {id(self)}')
+            logger.info('Stopped game %s listener: %s %s', self.game_id, self.id, id(self), extra=self.log_context())
             # Not really needed, since we are using weak-references
-            InMemoryPubSub.listeners[self.game_id].discard(self)
+            event_bus.unsubscribe(self.game_id, self)
 
-    @staticmethod
-    def lock(identity):
-        return redis_client.lock(config.REDIS_PREFIX_LISTENER_LOCK + identity, timeout=120)
+    @classmethod
+    async def load_by_id(cls, listener_id: str) -> Optional['EventListener']:
+        """Loads the listener together with its game, in a single round-trip"""
+        response = await load_listener_script(keys=[config.REDIS_PREFIX_LISTENER + listener_id],
+                                              args=[config.REDIS_PREFIX_GAME])
+        return await cls._from_stored(response)
 
     @classmethod
-    async def load_by_id(cls, listener_id: str) -> 'EventListener':
-        value = await redis_client.get(config.REDIS_PREFIX_LISTENER + listener_id)
-        if value:
-            listener = pickle.loads(value)
-            listener.game = await Game.load_by_id(listener.game_id)
-            if listener and listener.game:
-                return listener
+    async def load_many(cls, listener_ids: list[str]) -> list[Optional['EventListener']]:
+        """
+        Loads the listeners together with their games, all in a single pipeline. Listeners of the kinds unknown to
+        this process, and the ones which can't be loaded, are None
+        """
+        if not listener_ids:
+            return []
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for listener_id in listener_ids:
+                await load_listener_script(keys=[config.REDIS_PREFIX_LISTENER + listener_id],
+                                           args=[config.REDIS_PREFIX_GAME], client=pipe)
+            responses = await pipe.execute()
+        listeners = []
+        for listener_id, response in zip(listener_ids, responses):
+            listener = None
+            try:
+                listener = await cls._from_stored(response)
+            except codec.UnknownListenerKind:
+                pass
+            except Exception:
+                logger.exception('Invalid stored listener: %s', listener_id, extra={'listener_id': listener_id})
+            listeners.append(listener)
+        return listeners
+
+    @classmethod
+    async def load_all(cls, batch_size: int) -> AsyncIterator[list['EventListener']]:
+        """
+        Scans the stored listeners of this class (with existing games), yields them in batches of at most
+        `batch_size`
+        """
+        prefix = config.REDIS_PREFIX_LISTENER
+        listener_ids = []
+        async for key in redis_client.scan_iter(match=prefix + '*', count=batch_size):
+            listener_ids.append(key.decode()[len(prefix):])
+            if len(listener_ids) >= batch_size:
+                yield [listener for listener in await cls.load_many(listener_ids) if isinstance(listener, cls)]
+                listener_ids = []
+        if listener_ids:
+            yield [listener for listener in await cls.load_many(listener_ids) if isinstance(listener, cls)]
+
+    @staticmethod
+    async def _from_stored(response: list) -> Optional['EventListener']:
+        if not response:
+            return
+        listener = codec.decode_listener(response[0])
+        if len(response) == 1:
+            listener.game = await Game.load_by_id(listener.game_id)  # Older listener, load its game separately
+        else:
+            listener.game = Game._from_stored(listener.game_id, game_cache.get(listener.game_id), *response[2:])
+        if listener.game:
+            return listener
 
     def __getstate__(self):
         state = self.__dict__.copy()
@@ -510,11 +992,5 @@ class EventListener:
             self.queue = asyncio.Queue()
 
 
-class InMemoryPubSub:
-    listeners: dict[str, set[EventListener]] = defaultdict(weakref.WeakSet)
+EventListener.kinds[EventListener.codec_kind] = EventListener
 
-    @staticmethod
-    def publish(game, event: GameEvent):
-        logger.info(f'Publish game event: {game.game_id}: {event}')
-        for listener in InMemoryPubSub.listeners[game.game_id]:
-            listener.queue.put_nowait(event)
@@ -0,0 +1,117 @@
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Optional
+from urllib.parse import urlsplit, parse_qsl
+
+logger = logging.getLogger(__name__)
+
+
+class HttpError(Exception):
+    def __init__(self, status: int):
+        self.status = status
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: dict[str, str], body: bytes):
+        self.method = method
+        url = urlsplit(target)
+        self.path = url.path
+        self.query = dict(parse_qsl(url.query))
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body or b'null')
+
+
+class Response:
+    def __init__(self, body: bytes = b'', status: int = 200, content_type='text/plain; charset=utf-8',
+                 headers: dict[str, str] = None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, value, status: int = 200) -> 'Response':
+        return cls(json.dumps(value).encode(), status, 'application/json')
+
+    def encode(self, keep_alive: bool) -> bytes:
+        headers = {'Content-Type': self.content_type, 'Content-Length': str(len(self.body)),
+                   'Connection': 'keep-alive' if keep_alive else 'close', **self.headers}
+        head = f'HTTP/1.1 {self.status} {HTTPStatus(self.status).phrase}\r\n' + \
+            ''.join(f'{k}: {v}\r\n' for k, v in headers.items()) + '\r\n'
+        return head.encode('latin-1') + self.body
+
+
+class HttpServer:
+    """
+    A minimal HTTP/1.1 server (keep-alive, Content-Length bodies) for the internal endpoints, e.g. webhooks and
+    metrics. The handler is called for every request, and may raise HttpError.
+    """
+
+    def __init__(self, handler: Callable[[Request], Awaitable[Response]], host: str, port: int,
+                 max_body_size: int = 1 << 20):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body_size = max_body_size
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info('HTTP server is listening on %s:%s', self.host or '*', self.port)
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def read_request(self, reader: asyncio.StreamReader) -> Optional[Request]:
+        line = await reader.readline()
+        if not line:
+            return
+        try:
+            method, target, version = line.decode('latin-1').split()
+        except ValueError:
+            raise HttpError(400)
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if version == 'HTTP/1.0' and 'keep-alive' not in headers.get('connection', '').lower():
+            headers.setdefault('connection', 'close')
+        size = int(headers.get('content-length') or 0)
+        if size > self.max_body_size:
+            raise HttpError(413)
+        return Request(method, target, headers, await reader.readexactly(size) if size else b'')
+
+    async def respond(self, request: Request) -> Response:
+        try:
+            return await self.handler(request)
+        except HttpError as e:
+            return Response(status=e.status)
+        except Exception:
+            logger.exception('Unhandled exception on HTTP request: %s %s', request.method, request.path)
+            return Response(status=500)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    request = await self.read_request(reader)
+                except (HttpError, ValueError) as e:  # Malformed request, the rest of the stream is not usable
+                    writer.write(Response(status=getattr(e, 'status', 400)).encode(keep_alive=False))
+                    break
+                if not request:
+                    break
+                keep_alive = request.headers.get('connection', '').lower() != 'close'
+                writer.write((await self.respond(request)).encode(keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,69 @@
+"""
+Logging of the processes: records are put on an in-memory queue by the logging calls (which never block the event
+loop), and are formatted and written to stderr by a thread. Records are JSON objects (LOG_FORMAT=json) with the
+context fields of the games, given by `extra`, e.g.
+
+    logger.info('Publish game event: %s', event, extra={'game_id': game_id})
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime
+from typing import Optional, TextIO
+
+from avalon import config
+
+CONTEXT_FIELDS = ('game_id', 'chat_id', 'phase', 'listener_id')
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class QueueHandler(logging.handlers.QueueHandler):
+    """Leaves the formatting of the records to the thread of the listener, only the message is merged here"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()  # The arguments may be changed after the call
+        record.args = None
+        return record
+
+
+def setup(level: Optional[str] = None, stream: Optional[TextIO] = None):
+    """
+    Replaces the handlers of the root logger by the queue (whose records are written to `stream`, stderr by default),
+    once per process, later calls only set the level
+    """
+    global listener
+    root = logging.getLogger()
+    root.setLevel((level or config.LOG_LEVEL).upper())
+    if listener:
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT))
+    records = queue.SimpleQueue()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(QueueHandler(records))
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Writes the queued records
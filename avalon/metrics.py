@@ -0,0 +1,197 @@
+"""
+In-process metrics: counters, gauges and histograms (optionally labeled), exposed in the Prometheus text format
+on a local HTTP endpoint (`/metrics` on METRICS_PORT), e.g.
+
+    GAME_SAVES = metrics.counter('avalon_game_saves_total', 'Saved games', ('result',))
+    GAME_SAVES.labels('ok').inc()
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from avalon import config
+from avalon.http_server import HttpServer, Request, Response, HttpError
+
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)  # Seconds
+SIZE_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 65536)  # Bytes
+
+
+class CounterValue:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def samples(self, name: str, labels: str) -> list[str]:
+        return [f'{name}{labels} {self.value:g}']
+
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum')
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Not cumulative, the last one is +Inf
+        self.sum = 0.
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        """Observes the seconds spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name: str, labels: str) -> list[str]:
+        lines, total = [], 0
+        separator = labels[:-1] + ',' if labels else '{'
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            total += count
+            lines.append(f'{name}_bucket{separator}le="{bound}"}} {total}')
+        lines.append(f'{name}_sum{labels} {self.sum:g}')
+        lines.append(f'{name}_count{labels} {total}')
+        return lines
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, label_names: tuple[str, ...] = (), **options):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.options = options
+        self.children: dict[tuple[str, ...], object] = {}
+        self.unlabeled = None if label_names else self.labels()  # Updated by the methods of the metric itself
+
+    def new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """:return: the value of the labels, to be updated (kept by the hot paths, to skip the lookup)"""
+        values = tuple(map(str, values))
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f'Labels of {self.name} are {self.label_names}, got {values}')
+            child = self.children[values] = self.new_value()
+        return child
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for values, child in self.children.items():
+            labels = ','.join(f'{k}="{escape(v)}"' for k, v in zip(self.label_names, values))
+            lines += child.samples(self.name, labels and '{' + labels + '}')
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def new_value(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1):
+        self.unlabeled.inc(amount)
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def new_value(self):
+        return GaugeValue()
+
+    def inc(self, amount: float = 1):
+        self.unlabeled.inc(amount)
+
+    def dec(self, amount: float = 1):
+        self.unlabeled.dec(amount)
+
+    def set(self, value: float):
+        self.unlabeled.set(value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def new_value(self):
+        return HistogramValue(self.options.get('buckets', LATENCY_BUCKETS))
+
+    def observe(self, value: float):
+        self.unlabeled.observe(value)
+
+    def time(self):
+        return self.unlabeled.time()
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+        self.server: Optional[HttpServer] = None
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError('Duplicate metric: ' + metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return ''.join(line + '\n' for metric in self.metrics.values() for line in metric.render())
+
+    async def handle_request(self, request: Request) -> Response:
+        if request.path != '/metrics':
+            raise HttpError(404)
+        if request.method != 'GET':
+            raise HttpError(405)
+        return Response(self.render().encode(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    async def start_server(self, host: str, port: int):
+        """Serves the metrics on the port, once per process"""
+        if self.server:
+            return
+        self.server = HttpServer(self.handle_request, host, port)
+        await self.server.start()
+
+
+registry = Registry()
+
+
+def counter(name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Counter:
+    return registry.register(Counter(name, help_text, label_names))
+
+
+def gauge(name: str, help_text: str, label_names: tuple[str, ...] = ()) -> Gauge:
+    return registry.register(Gauge(name, help_text, label_names))
+
+
+def histogram(name: str, help_text: str, label_names: tuple[str, ...] = (), buckets=LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help_text, label_names, buckets=buckets))
+
+
+async def start_server():
+    """Starts the endpoint of the default registry if METRICS_PORT is set"""
+    if config.METRICS_PORT:
+        await registry.start_server(config.METRICS_HOST, config.METRICS_PORT)
@@ -0,0 +1,152 @@
+"""
+Opt-in profiling of the hot paths, enabled by PROFILING (disabled by default, then `hook` returns the functions
+as they are):
+
+- sample: the stacks of the main thread are sampled every PROFILING_INTERVAL seconds (by a thread)
+- cprofile: everything is profiled by cProfile
+
+The functions decorated by `hook` are timed too (wall time, including the awaits of the coroutines).
+On SIGUSR1 the collected data is written to PROFILING_DIR and reset: the sampled stacks in the folded format of the
+flamegraph tools (`avalon-<pid>-<time>.folded`) or the cProfile stats (`.pstats`), and the hook timings (`.hooks`).
+"""
+import asyncio
+import cProfile
+import functools
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Callable, Optional
+
+from avalon import config
+
+logger = logging.getLogger(__name__)
+
+
+class HookTiming:
+    __slots__ = ('count', 'total', 'max')
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = self.max = 0.
+
+    def add(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+hook_timings: dict[str, HookTiming] = {}
+
+
+def hook(name: str) -> Callable[[Callable], Callable]:
+    """Decorator of the (sync or async) functions to be timed, when profiling is enabled"""
+
+    def decorator(f: Callable) -> Callable:
+        if not config.PROFILING:
+            return f
+        timing = hook_timings.setdefault(name, HookTiming())
+        if asyncio.iscoroutinefunction(f):
+            @functools.wraps(f)
+            async def wrapped(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await f(*args, **kwargs)
+                finally:
+                    timing.add(time.perf_counter() - start)
+        else:
+            @functools.wraps(f)
+            def wrapped(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    timing.add(time.perf_counter() - start)
+        return wrapped
+
+    return decorator
+
+
+class Sampler:
+    """Samples the stacks of a thread (the event loop), counted by their folded form"""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self.run, name='profiling-sampler', daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames:
+                stack = ';'.join(reversed(frames))
+                with self.lock:
+                    self.stacks[stack] += 1
+
+    def dump(self, path: str):
+        with self.lock:
+            stacks, self.stacks = self.stacks, Counter()
+        with open(path, 'w') as f:
+            for stack, count in stacks.items():
+                f.write(f'{stack} {count}\n')
+
+
+sampler: Optional[Sampler] = None
+profiler: Optional[cProfile.Profile] = None
+
+
+def install():
+    """Starts the profiling (if enabled), once per process. Must be called on the main thread"""
+    global sampler, profiler
+    if not config.PROFILING or sampler or profiler:
+        return
+    if config.PROFILING == 'sample':
+        sampler = Sampler(threading.get_ident(), config.PROFILING_INTERVAL)
+        sampler.start()
+    elif config.PROFILING == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    else:
+        raise ValueError('Invalid profiling mode: ' + config.PROFILING)
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, lambda *_args: dump())
+    logger.warning('Profiling (%s) is enabled, dumped to %s on SIGUSR1', config.PROFILING, config.PROFILING_DIR)
+
+
+def dump() -> str:
+    """Writes (and resets) the collected data, :return: the common prefix of the written files"""
+    global profiler
+    prefix = os.path.join(config.PROFILING_DIR, f'avalon-{os.getpid()}-{time.strftime("%Y%m%d-%H%M%S")}')
+    if sampler:
+        sampler.dump(prefix + '.folded')
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(prefix + '.pstats')
+        profiler = cProfile.Profile()
+        profiler.enable()
+    with open(prefix + '.hooks', 'w') as f:
+        f.write(f'{"hook":40} {"count":>8} {"total(s)":>10} {"mean(ms)":>10} {"max(ms)":>10}\n')
+        for name, timing in sorted(hook_timings.items(), key=lambda item: -item[1].total):
+            if timing.count:
+                f.write(f'{name:40} {timing.count:8d} {timing.total:10.3f} '
+                        f'{timing.total / timing.count * 1000:10.3f} {timing.max * 1000:10.3f}\n')
+            timing.reset()
+    logger.warning('Profiling data is written to %s.*', prefix)
+    return prefix
@@ -0,0 +1,165 @@
+"""
+Plays full games (in memory, nothing is saved) by scripted agents, to exercise the game model and to compare
+the win-rates of the game plans.
+
+    python -m avalon.simulation [games-per-plan] [agents] [processes]
+
+e.g. `python -m avalon.simulation 10000 saboteur,random 4`, agents are assigned to the seats in turn.
+"""
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from avalon.game import Game, GamePhase, Participant, GAME_PLANS
+
+
+class Agent:
+    """Plays a participant of the game, knows only what the participant knows"""
+
+    def __init__(self, participant: Participant, game: Game, rng: random.Random):
+        self.participant = participant
+        self.game = game
+        self.rng = rng
+
+    @property
+    def is_evil(self) -> bool:
+        return self.participant.role.is_evil
+
+    def select_team(self, size: int) -> list[Participant]:
+        return self.rng.sample(self.game.participants, size)
+
+    def vote(self) -> bool:
+        return self.rng.random() < .5
+
+    def quest_action(self) -> bool:
+        return not self.is_evil or self.rng.random() < .5
+
+    def next_lady(self, candidates: list[Participant]) -> Participant:
+        return self.rng.choice(candidates)
+
+    def guess_merlin(self, candidates: list[Participant]) -> Participant:
+        return self.rng.choice(candidates)
+
+
+class RandomAgent(Agent):
+    pass
+
+
+class ApproveAgent(Agent):
+    """Approves every team, and plays the quests by its side"""
+
+    def vote(self) -> bool:
+        return True
+
+    def quest_action(self) -> bool:
+        return not self.is_evil
+
+
+class SaboteurAgent(Agent):
+    """Evil ones put themselves on the teams, approve only the teams with an evil, and fail every quest"""
+
+    def select_team(self, size: int) -> list[Participant]:
+        if not self.is_evil:
+            return super().select_team(size)
+        others = [p for p in self.game.participants if p != self.participant]
+        return [self.participant] + self.rng.sample(others, size - 1)
+
+    def vote(self) -> bool:
+        if not self.is_evil:
+            return super().vote()
+        return any(p.role.is_evil for p in self.game.current_team)
+
+    def quest_action(self) -> bool:
+        return not self.is_evil
+
+
+AGENTS: dict[str, type[Agent]] = {
+    'random': RandomAgent,
+    'approve': ApproveAgent,
+    'saboteur': SaboteurAgent,
+}
+
+
+def play_game(players: int, agent_kinds: list[str], rng: random.Random) -> Game:
+    game = Game()
+    for i in range(players):
+        game.add_participant(Participant(f'sim-{i}'))
+    game.play()
+    game.proceed_to_game()
+    agents = {p.identity: AGENTS[agent_kinds[i % len(agent_kinds)]](p, game, rng)
+              for i, p in enumerate(game.participants)}
+    while game.phase != GamePhase.Finished:
+        if game.phase == GamePhase.TeamBuilding:
+            for p in agents[game.king.identity].select_team(game.step[1]):
+                game.select_for_team(game.king, p.identity)
+            game.confirm_team(game.king)
+        elif game.phase == GamePhase.TeamVote:
+            for p in game.participants:
+                game.vote(p, agents[p.identity].vote())
+            game.process_vote_results()
+        elif game.phase == GamePhase.Quest:
+            for p in game.current_team:
+                game.quest_action(p, agents[p.identity].quest_action())
+            game.process_quest_result()
+        elif game.phase == GamePhase.Lady:
+            next_lady = agents[game.lady.identity].next_lady(game.next_lady_candidates())
+            game.set_next_lady(game.lady, next_lady.identity)
+        elif game.phase == GamePhase.GuessMerlin:
+            assassin = game.get_assassin()
+            guess = agents[assassin.identity].guess_merlin(game.merlin_candidates())
+            game.guess_merlin(assassin, guess.identity)
+    return game
+
+
+def play_games(players: int, agent_kinds: list[str], games: int, seed: int) -> Counter:
+    """:return: number of the games, by their result"""
+    rng = random.Random(seed)
+    random.seed(seed)  # Roles, king and lady are chosen by the game itself
+    results = Counter()
+    for _ in range(games):
+        game = play_game(players, agent_kinds, rng)
+        if game.game_result:
+            results['servants'] += 1
+        elif sum(game.round_result) == 3:
+            results['merlin_killed'] += 1
+        else:
+            results['evil_quests'] += 1
+        results['rounds'] += len(game.round_result)
+        results['actions'] += game.version
+    return results
+
+
+def run(games_per_plan: int, agent_kinds: list[str], processes: Optional[int] = None, chunk_size: int = 500) \
+        -> tuple[dict[int, Counter], float]:
+    """:return: results of each game plan (by number of the players), and the elapsed seconds"""
+    start = time.perf_counter()
+    results: dict[int, Counter] = defaultdict(Counter)
+    with ProcessPoolExecutor(processes) as executor:
+        futures = {}
+        for players in sorted(GAME_PLANS):
+            for i, chunk_start in enumerate(range(0, games_per_plan, chunk_size)):
+                games = min(chunk_size, games_per_plan - chunk_start)
+                futures[executor.submit(play_games, players, agent_kinds, games, players * 100003 + i)] = players
+        for future, players in futures.items():
+            results[players] += future.result()
+    return results, time.perf_counter() - start
+
+
+def main(games_per_plan: int, agent_kinds: list[str], processes: Optional[int] = None):
+    results, elapsed = run(games_per_plan, agent_kinds, processes)
+    total = games_per_plan * len(results)
+    print(f'{total} games of {",".join(agent_kinds)} agents in {elapsed:.2f}s: {total / elapsed:.0f} games/s')
+    for players, result in sorted(results.items()):
+        print(f'{players:3} players: servants won {result["servants"] / games_per_plan:6.1%}, '
+              f'evil won by quests {result["evil_quests"] / games_per_plan:6.1%}, '
+              f'by killing merlin {result["merlin_killed"] / games_per_plan:6.1%}, '
+              f'{result["rounds"] / games_per_plan:.2f} rounds, {result["actions"] / games_per_plan:.1f} actions')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+         sys.argv[2].split(',') if len(sys.argv) > 2 else ['random'],
+         int(sys.argv[3]) if len(sys.argv) > 3 else None)
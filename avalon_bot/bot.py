@@ -1,23 +1,32 @@
 import asyncio
 import functools
 import logging
+import signal
+import time
+from typing import Awaitable, Callable, Optional
 
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, Bot, Message
 from telegram.error import TelegramError
 from telegram.ext import CallbackContext, CallbackQueryHandler, Application, CommandHandler
 
-from avalon import config
-from avalon.exceptions import InvalidActionException, OnlyLadyCanDo
-from avalon.game import GamePhase, FAIL_EMOJI, Game, GameDeleted, GameEvent, VotingCompleted, \
-    QuestFailedByTooManyRejections, GamePhaseChanged, VotesChanged, QuestCompleted
+from avalon import config, metrics, profiling, log
+from avalon.exceptions import InvalidActionException, OnlyLadyCanDo, ConcurrentModification
+from avalon.game import GamePhase, FAIL_EMOJI, Game, conflict_backoff, GameDeleted, GameEvent, VotingCompleted, \
+    QuestFailedByTooManyRejections, GamePhaseChanged, VotesChanged, QuestCompleted, render_cache
 from avalon_bot.common import COMMAND_NEW, COMMAND_FINISH, MSG_START, MSG_JOIN, MSG_LEAVE, MSG_PLAY, MSG_PROCEED, \
     MSG_SELECT, MSG_CONFIRM_TEAM, MSG_MY_ROLE, MSG_APPROVE, MSG_REJECT, MSG_SUCCESS, MSG_FAIL, MSG_NEXT_LADY, \
     MSG_TRUTH, MSG_GUESS_MERLIN, MSG_CONFIRM_MERLIN, COMMAND_RESTART
+from avalon_bot.dispatcher import chat_dispatcher, in_chat_order
+from avalon_bot.outbound import outbound_queue, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW, MeteredRequest
+from avalon_bot.render_scheduler import RenderScheduler, is_edit_event
 from avalon_bot.telegram_game import TgParticipant, send_ignore_400, TgListener
+from avalon_bot.webhook import WebhookIngestion, webhook_path
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    level=logging.DEBUG)
+TG_CHAT_WAIT_SECONDS = metrics.histogram('avalon_tg_chat_wait_seconds',
+                                         'Wait of the button actions for the preceding jobs of their chat')
+TG_ACTION_SECONDS = metrics.histogram('avalon_tg_action_seconds', 'Duration of the button actions (with retries)',
+                                      ('action',))
 
 Update.any_reply_text = lambda u, *a, **kw: \
     (u.message.reply_text if u.message else u.callback_query.answer)(*a, **kw)
@@ -25,13 +34,14 @@ Update.any_reply_text = lambda u, *a, **kw: \
 
 def later_edit(update: Update, **kwargs):
     msg = update.callback_query.message
-    asyncio.create_task(
-        send_ignore_400(msg.get_bot().edit_message_text(chat_id=msg.chat_id, message_id=msg.message_id, **kwargs)))
+    outbound_queue.send_later(msg.chat_id, lambda: send_ignore_400(
+        msg.get_bot().edit_message_text(chat_id=msg.chat_id, message_id=msg.message_id, **kwargs)))
 
 
 class ListenerManager:
     def __init__(self, bot: Bot):
         self.chat_tasks = {}
+        self.sends: set[asyncio.Task] = set()
         self.bot = bot
 
     async def load_listener(self, chat) -> TgListener:
@@ -40,77 +50,172 @@ class ListenerManager:
             self.chat_tasks[chat.id] = asyncio.create_task(self.listen(listener))
         return listener
 
+    async def restore_listeners(self):
+        """Re-arms the listeners of the unfinished games, e.g. after a restart"""
+        start = time.perf_counter()
+        scanned = restored = 0
+        async for listeners in TgListener.load_all(config.TG_RESTORE_BATCH):
+            scanned += len(listeners)
+            for listener in listeners:
+                if isinstance(listener, TgListener) and listener.game.phase != GamePhase.Finished and \
+                        listener.chat_id not in self.chat_tasks:
+                    self.chat_tasks[listener.chat_id] = asyncio.create_task(self.listen(listener))
+                    restored += 1
+        logger.info('Restored %s of %s Telegram listeners in %.2fs', restored, scanned, time.perf_counter() - start)
+
+    async def stop(self):
+        """Stops the listeners, the messages which are already being sent are still sent"""
+        tasks = list(self.chat_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.gather(*self.sends, return_exceptions=True)
+
     async def listen(self, listener: TgListener):
+        scheduler = RenderScheduler(config.TG_EDIT_WINDOW)
         try:
             async with listener.listen():
                 while True:
-                    event: GameEvent = await listener.queue.get()
-                    try:
-                        async with TgListener.lock(listener.id):
-                            tg_listener = await TgListener.load_by_id(listener.id)
-                            if isinstance(event, GameDeleted) or not tg_listener:
-                                break
-                            await send_ignore_400(self.process_game_event(event, tg_listener))
-                    except TelegramError:
-                        logger.exception('TelegramError on listener')
+                    events: list[GameEvent] = await scheduler.collect(listener.queue, await listener.queue.get())
+                    # Rendered in order with the updates of the chat, but sent after, not to hold them
+                    sends = await chat_dispatcher.run(listener.chat_id, functools.partial(
+                        self.handle_game_events, listener.id, events, scheduler))
+                    if sends is None:
+                        break
+                    for send in sends:
+                        await self.send(listener.chat_id, send)
         finally:
             self.chat_tasks.pop(listener.chat_id)
 
-    async def process_game_event(self, event, tg_listener):
-        if isinstance(event, VotesChanged):
-            await self.bot.edit_message_text(chat_id=tg_listener.chat_id, message_id=tg_listener.last_vote_message_id,
-                                             **tg_listener.get_voting_phase_message())
-        elif isinstance(event, VotingCompleted):
-            await self.bot.send_message(chat_id=tg_listener.chat_id,
-                                        **tg_listener.get_voting_result_message(event.result))
+    @staticmethod
+    async def send(chat_id: int, send: Callable[[], Awaitable]):
+        try:
+            await send_ignore_400(send())
+        except TelegramError:
+            logger.exception('TelegramError on listener', extra={'chat_id': chat_id})
+
+    def send_later(self, tg_listener: TgListener, params: dict):
+        """
+        Sends the phase message of the listener outside the job of its chat, not to hold the other chats of the
+        dispatcher worker while this one is throttled
+        """
+        task = asyncio.create_task(self.send(tg_listener.chat_id, functools.partial(
+            self.send_phase_message, tg_listener.id, tg_listener.game.phase, params)))
+        self.sends.add(task)
+        task.add_done_callback(self.sends.discard)
+
+    async def handle_game_events(self, listener_id: str, events: list[GameEvent], scheduler: RenderScheduler) \
+            -> Optional[list[Callable[[], Awaitable]]]:
+        """:return: the sending of the messages, None if the game is deleted"""
+        tg_listener = await TgListener.load_by_id(listener_id)
+        if isinstance(events[-1], GameDeleted) or not tg_listener:
+            return None
+        return self.process_game_events(events, tg_listener, scheduler)
+
+    @profiling.hook('ListenerManager.process_game_events')
+    def process_game_events(self, events: list[GameEvent], tg_listener: TgListener, scheduler: RenderScheduler) \
+            -> list[Callable[[], Awaitable]]:
+        # All edit events of the batch are rendered once per message, with the current state of the game
+        edits = {}
+        for event in filter(is_edit_event, events):
+            if isinstance(event, VotesChanged):
+                edits[tg_listener.last_vote_message_id] = \
+                    functools.partial(tg_listener.rendered, tg_listener.get_voting_phase_message)
+            else:  # GameParticipantsChanged, QuestTeamChanged, QuestActionsChanged
+                edits[tg_listener.active_message_id] = tg_listener.get_current_phase_message
+        # The game may be ahead of the sent messages (they are sent outside the jobs), e.g. no vote message is sent yet
+        edits.pop(None, None)
+        sends = []
+        for message_id, render in edits.items():
+            params = render()
+            if scheduler.should_edit(message_id, params):
+                sends.append(functools.partial(self.edit_message, tg_listener.chat_id, message_id, params, scheduler))
+        if edits and logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Telegram API calls saved by coalescing edits: %s, render cache hit ratio: %.2f',
+                         RenderScheduler.saved_calls(), render_cache.hit_ratio,
+                         extra={'chat_id': tg_listener.chat_id, 'phase': tg_listener.game.phase.name})
+        if not is_edit_event(events[-1]):
+            sends.append(self.process_game_event(events[-1], tg_listener, scheduler))
+        return [send for send in sends if send]
+
+    @profiling.hook('ListenerManager.process_game_event')
+    def process_game_event(self, event, tg_listener, scheduler: RenderScheduler) -> Optional[Callable[[], Awaitable]]:
+        chat_id = tg_listener.chat_id
+        if isinstance(event, VotingCompleted):
+            return functools.partial(self.send_message, chat_id, tg_listener.get_voting_result_message(event.result))
         elif isinstance(event, QuestFailedByTooManyRejections):
-            await self.bot.send_message(chat_id=tg_listener.chat_id,
-                                        text=f'{FAIL_EMOJI} Too many rejections, quest failed')
+            return functools.partial(self.send_message, chat_id,
+                                     dict(text=f'{FAIL_EMOJI} Too many rejections, quest failed'))
         elif isinstance(event, GamePhaseChanged):
-            msg = await self.bot.send_message(chat_id=tg_listener.chat_id, **tg_listener.get_current_phase_message())
-            tg_listener.message_sent(msg)
-            await tg_listener.save()
+            return functools.partial(self.send_phase_message, tg_listener.id, tg_listener.game.phase,
+                                     tg_listener.get_current_phase_message(), scheduler)
         elif isinstance(event, QuestCompleted):
             params = tg_listener.get_quest_result_message(event.result, event.failed_votes, event.success_votes)
-            await self.bot.send_message(chat_id=tg_listener.chat_id, **params)
-        else:  # GameParticipantsChanged, QuestTeamChanged, QuestActionsChanged
-            await self.bot.edit_message_text(chat_id=tg_listener.chat_id, message_id=tg_listener.active_message_id,
-                                             **tg_listener.get_current_phase_message())
+            return functools.partial(self.send_message, chat_id, params)
+
+    async def send_phase_message(self, listener_id: str, phase: GamePhase, params: dict,
+                                 scheduler: Optional[RenderScheduler] = None):
+        chat_id = int(listener_id)
+        msg = await self.send_message(chat_id, params)
+        if scheduler:
+            scheduler.mark_sent(msg.message_id, params)
+        # The listener is changed in order with the updates of the chat (e.g. pressed buttons of the message)
+        await chat_dispatcher.run(chat_id, functools.partial(self.phase_message_sent, listener_id, phase, msg))
+
+    @staticmethod
+    async def phase_message_sent(listener_id: str, phase: GamePhase, msg: Message):
+        tg_listener = await TgListener.load_by_id(listener_id)
+        if tg_listener:
+            tg_listener.message_sent(msg, phase)
+            await tg_listener.save()
+
+    def send_message(self, chat_id: int, params: dict) -> Awaitable[Message]:
+        return outbound_queue.call(chat_id, functools.partial(self.bot.send_message, chat_id=chat_id, **params),
+                                   PRIORITY_HIGH)
+
+    async def edit_message(self, chat_id: int, message_id: int, params: dict, scheduler: RenderScheduler):
+        await outbound_queue.call(chat_id, lambda: send_ignore_400(
+            self.bot.edit_message_text(chat_id=chat_id, message_id=message_id, **params)), PRIORITY_LOW)
+        scheduler.mark_sent(message_id, params)
 
 
 # noinspection PyTypeChecker
 listener_manager: ListenerManager = None
 
 
+@in_chat_order
 async def start_bot(update: Update, _context: CallbackContext.DEFAULT_TYPE):
     chat, user = update.effective_chat, update.effective_user
-    async with TgListener.lock(str(chat.id)):
-        tg_listener = await listener_manager.load_listener(chat)
-        if tg_listener:
-            await tg_listener.send_msg(update, tg_listener.get_current_phase_message())
-            await tg_listener.save()
-        else:
-            logger.debug(f'/start from user:{user.id} chat:{chat.id}')
-            # noinspection SpellCheckingInspection
-            await update.message.reply_photo(
-                'AgACAgQAAxUAAWKaFG4UiZG61Ypizt8emZo6lMGCAAICtjEbFIchUY9MUzdRt845AQADAgADcwADJAQ',
-                caption="Welcome To Avalon Bot", quote=False,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("Play now 💥", callback_data=MSG_START)],
-                    [InlineKeyboardButton("Add me to a Group", url=update.message.get_bot().link + '?startgroup=new')]
-                ])
-            )
-
-
+    tg_listener = await listener_manager.load_listener(chat)
+    if tg_listener:
+        listener_manager.send_later(tg_listener, tg_listener.get_current_phase_message())
+    else:
+        logger.debug('/start from user:%s chat:%s', user.id, chat.id, extra={'chat_id': chat.id})
+        # noinspection SpellCheckingInspection
+        outbound_queue.send_later(chat.id, functools.partial(
+            update.message.reply_photo,
+            'AgACAgQAAxUAAWKaFG4UiZG61Ypizt8emZo6lMGCAAICtjEbFIchUY9MUzdRt845AQADAgADcwADJAQ',
+            caption="Welcome To Avalon Bot", quote=False,
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton("Play now 💥", callback_data=MSG_START)],
+                [InlineKeyboardButton("Add me to a Group", url=update.message.get_bot().link + '?startgroup=new')]
+            ])
+        ), PRIORITY_NORMAL)
+
+
+@in_chat_order
 async def finish_game(update: Update, _context: CallbackContext.DEFAULT_TYPE):
     tg_listener = await TgListener.load_by_id(str(update.effective_chat.id))
     if tg_listener:
         await tg_listener.game.delete()
-        await update.message.reply_text(f'Game is finished, start a new one with /{COMMAND_NEW}')
+        text = f'Game is finished, start a new one with /{COMMAND_NEW}'
     else:
-        await update.message.reply_text(f'No game is in progress, start a one with /{COMMAND_NEW}')
+        text = f'No game is in progress, start a one with /{COMMAND_NEW}'
+    outbound_queue.send_later(update.effective_chat.id, functools.partial(update.message.reply_text, text),
+                              PRIORITY_NORMAL)
 
 
+@in_chat_order
 async def start_game(update: Update, _context: CallbackContext.DEFAULT_TYPE):
     tg_listener = await listener_manager.load_listener(update.effective_chat)
     if tg_listener and tg_listener.game.phase != GamePhase.Finished:
@@ -120,20 +225,22 @@ async def start_game(update: Update, _context: CallbackContext.DEFAULT_TYPE):
             asyncio.create_task(update.callback_query.answer())
         game = Game(participants=[TgParticipant(update.effective_user)])
         tg_listener = TgListener(str(update.effective_chat.id), game)
-        await tg_listener.send_msg(update, tg_listener.send_joining_message())
         await game.save()
         await tg_listener.save()
+        listener_manager.send_later(tg_listener, tg_listener.send_joining_message())
         await listener_manager.load_listener(update.effective_chat)
 
 
+@in_chat_order
 async def restart_game(update: Update, _context: CallbackContext.DEFAULT_TYPE):
     tg_listener = await TgListener.load_by_id(str(update.effective_chat.id))
     if not tg_listener:
         game = Game(participants=[TgParticipant(update.effective_user)])
         tg_listener = TgListener(str(update.effective_chat.id), game)
     tg_listener.game.restart()
-    await tg_listener.send_msg(update, tg_listener.send_joining_message())
     await tg_listener.game.save()
+    await tg_listener.save()
+    listener_manager.send_later(tg_listener, tg_listener.send_joining_message())
     await listener_manager.load_listener(update.effective_chat)
 
 
@@ -142,30 +249,50 @@ def game_query_callback(f=None, create_new_participant=False, check_for_active_m
         return functools.partial(game_query_callback, create_new_participant=create_new_participant,
                                  check_for_active_message=check_for_active_message)
 
+    async def run_action(update: Update, context: CallbackContext.DEFAULT_TYPE):
+        tg_listener = await listener_manager.load_listener(update.effective_chat)
+        if not tg_listener:
+            return f'No game is in progress, start a new one with /{COMMAND_NEW}'
+        if not update.callback_query or not update.callback_query.message:
+            return 'Unknown button pressed'
+        if check_for_active_message and update.callback_query.message.message_id != tg_listener.active_message_id:
+            return 'Button pressed on an old message'
+        actor = TgParticipant(update.effective_user) if create_new_participant else \
+            tg_listener.game.get_participant_by_id(str(update.effective_user.id))
+        answer = await f(tg_listener.game, actor, tg_listener, update, context)
+        await tg_listener.save()
+        return answer
+
+    async def run_with_retries(update: Update, context: CallbackContext.DEFAULT_TYPE, received: float):
+        start = time.perf_counter()
+        TG_CHAT_WAIT_SECONDS.observe(start - received)
+        try:
+            return await run_retrying(update, context)
+        finally:
+            TG_ACTION_SECONDS.labels(f.__name__).observe(time.perf_counter() - start)
+
+    async def run_retrying(update: Update, context: CallbackContext.DEFAULT_TYPE):
+        # Games are saved optimistically, the action is retried (on a reloaded game) if the game is changed
+        for attempt in range(config.GAME_SAVE_RETRIES + 1):
+            # noinspection PyBroadException
+            try:
+                return await run_action(update, context)
+            except ConcurrentModification as e:
+                if attempt < config.GAME_SAVE_RETRIES:
+                    await conflict_backoff(attempt)
+                    continue
+                return str(e)
+            except InvalidActionException as e:
+                return str(e)
+            except Exception:
+                logger.exception('Unhandled Error', extra={'chat_id': update.effective_chat.id})
+                return 'Unhandled Error'
+
+    @profiling.hook(f'game_query_callback.{f.__name__}')
     @functools.wraps(f)
     async def wrapped(update: Update, context: CallbackContext.DEFAULT_TYPE):
-        chat_id = str(update.effective_chat.id)
-        async with TgListener.lock(chat_id):
-            tg_listener = await listener_manager.load_listener(update.effective_chat)
-            if not tg_listener:
-                answer = f'No game is in progress, start a new one with /{COMMAND_NEW}'
-            elif not update.callback_query or not update.callback_query.message:
-                answer = 'Unknown button pressed'
-            elif check_for_active_message and update.callback_query.message.message_id != tg_listener.active_message_id:
-                answer = 'Button pressed on an old message'
-            else:
-                async with Game.lock(tg_listener.game.game_id):
-                    # noinspection PyBroadException
-                    try:
-                        actor = TgParticipant(update.effective_user) if create_new_participant else \
-                            tg_listener.game.get_participant_by_id(str(update.effective_user.id))
-                        answer = await f(tg_listener.game, actor, tg_listener, update, context)
-                        await tg_listener.save()
-                    except InvalidActionException as e:
-                        answer = str(e)
-                    except Exception:
-                        logger.exception('Unhandled Error')
-                        answer = 'Unhandled Error'
+        answer = await chat_dispatcher.run(update.effective_chat.id,
+                                           functools.partial(run_with_retries, update, context, time.perf_counter()))
         if isinstance(answer, dict):
             await update.callback_query.answer(**answer)
         else:
@@ -223,7 +350,7 @@ async def vote(game: Game, actor: TgParticipant, _tg_listener: TgListener, updat
     game.vote(actor, update.callback_query.data == MSG_APPROVE)
     game.process_vote_results()
     await game.save()
-    return 'Current vote: ' + actor.current_vote_text
+    return 'Current vote: ' + game.vote_text(actor)
 
 
 @game_query_callback
@@ -231,14 +358,14 @@ async def quest_action(game: Game, actor: TgParticipant, _tg_listener: TgListene
     game.quest_action(actor, update.callback_query.data == MSG_SUCCESS)
     game.process_quest_result()
     await game.save()
-    return 'Current action: ' + actor.current_vote_text
+    return 'Current action: ' + game.quest_action_text(actor)
 
 
 @game_query_callback
 async def select_next_lady(_game: Game, actor: TgParticipant, tg_listener: TgListener, update: Update, _context):
     identity = update.callback_query.data.replace(MSG_NEXT_LADY, '')
     next_lady = tg_listener.set_next_lady(actor, identity, dry_run=True)
-    await send_ignore_400(update.callback_query.message.edit_text(**tg_listener.get_lady_message()))
+    later_edit(update, **tg_listener.get_lady_message())
     return 'Next lady will be: ' + str(next_lady)
 
 
@@ -266,7 +393,7 @@ async def get_lady_truth(game: Game, actor: TgParticipant, tg_listener: TgListen
 async def guess_merlin(_game: Game, actor: TgParticipant, tg_listener: TgListener, update: Update, _context):
     identity = update.callback_query.data.replace(MSG_GUESS_MERLIN, '')
     tg_listener.guess_merlin(actor, identity, dry_run=True)
-    await send_ignore_400(update.callback_query.message.edit_text(**tg_listener.get_guess_merlin_message()))
+    later_edit(update, **tg_listener.get_guess_merlin_message())
 
 
 @game_query_callback
@@ -277,12 +404,47 @@ async def confirm_merlin(game: Game, actor: TgParticipant, tg_listener: TgListen
     await game.save()
 
 
-def main():
+async def start_webhook(app: Application) -> WebhookIngestion:
+    path = webhook_path(config.BOT_TOKEN)
+    ingestion = WebhookIngestion(app.bot, app.process_update, path, config.TG_WEBHOOK_WORKERS,
+                                 config.TG_WEBHOOK_BACKLOG)
+    await app.initialize()
+    await app.start()
+    await ingestion.start('', config.TG_WEBHOOK_PORT)
+    await app.bot.set_webhook(config.TG_WEBHOOK_URL.rstrip('/') + path)
+    return ingestion
+
+
+async def start_polling(app: Application):
+    await app.initialize()
+    await app.updater.start_polling()
+    await app.start()
+
+
+async def stop_application(app: Application, ingestion: Optional[WebhookIngestion] = None):
+    """
+    Stops receiving the updates, and drains the pending ones, the listeners and the outbound queue before the bot is
+    shut down
+    """
+    if app.updater.running:
+        await app.updater.stop()
+    if ingestion:
+        await ingestion.stop()
+    if app.running:
+        await app.stop()
+    await listener_manager.stop()
+    await outbound_queue.stop()
+    await app.shutdown()
+
+
+def create_application(token: str, base_url: str) -> Application:
     global listener_manager
     app = (Application.builder()
-           .token(config.BOT_TOKEN)
-           .proxy_url(config.BOT_PROXY)
-           .get_updates_proxy_url(config.BOT_PROXY)
+           .token(token)
+           .base_url(base_url)
+           .request(MeteredRequest(connection_pool_size=128, proxy_url=config.BOT_PROXY))
+           .get_updates_request(MeteredRequest(proxy_url=config.BOT_PROXY))
+           .concurrent_updates(True)  # Ordered per chat by the chat_dispatcher
            .build())
     listener_manager = ListenerManager(app.bot)
     app.add_handler(CommandHandler('start', start_bot))
@@ -305,7 +467,28 @@ def main():
     app.add_handler(CallbackQueryHandler(get_lady_truth, MSG_TRUTH))
     app.add_handler(CallbackQueryHandler(guess_merlin, MSG_GUESS_MERLIN))
     app.add_handler(CallbackQueryHandler(confirm_merlin, MSG_CONFIRM_MERLIN))
-    app.run_polling()
+    return app
+
+
+def main():
+    log.setup()
+    app = create_application(config.BOT_TOKEN, config.BOT_API_URL)
+    # Runs along with receiving the updates, as soon as the loop is started
+    loop = asyncio.get_event_loop()
+    loop.create_task(listener_manager.restore_listeners())
+    loop.create_task(metrics.start_server())
+    profiling.install()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
+    ingestion = None
+    try:
+        if config.TG_WEBHOOK_URL:
+            ingestion = loop.run_until_complete(start_webhook(app))
+        else:
+            loop.run_until_complete(start_polling(app))
+        loop.run_forever()
+    finally:
+        loop.run_until_complete(stop_application(app, ingestion))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,72 @@
+import asyncio
+import functools
+from typing import Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from avalon import config
+
+
+class ChatDispatcher:
+    """
+    Runs the jobs (handling of the updates, and the game events) of each chat strictly in order. Chats are hashed
+    onto a fixed number of worker queues, so the jobs of different chats run in parallel.
+    A job must not wait for another job of its own chat.
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.queues: list[asyncio.Queue] = []
+        self.tasks: list[Optional[asyncio.Task]] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(self, chat_id: int, factory: Callable[[], Awaitable]) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.loop = loop
+            self.queues = [asyncio.Queue() for _ in range(self.workers)]
+            self.tasks = [None] * self.workers
+        i = chat_id % self.workers
+        if not self.tasks[i] or self.tasks[i].done():  # Restarted with its queue, if it's died
+            self.tasks[i] = asyncio.create_task(self.work(self.queues[i]))
+        future = loop.create_future()
+        self.queues[i].put_nowait((factory, future))
+        return future
+
+    async def run(self, chat_id: int, factory: Callable[[], Awaitable]):
+        return await self.submit(chat_id, factory)
+
+    @staticmethod
+    async def work(queue: asyncio.Queue):
+        while True:
+            factory, future = await queue.get()
+            # The job runs by its own task, so a job cancelled by itself is told apart from the worker being cancelled
+            job = asyncio.ensure_future(factory())
+            try:
+                await asyncio.wait((job,))
+            except asyncio.CancelledError:
+                job.cancel()
+                future.cancel()
+                raise
+            if future.done():
+                continue
+            if job.cancelled():
+                future.cancel()
+            elif job.exception():
+                future.set_exception(job.exception())
+            else:
+                future.set_result(job.result())
+
+
+chat_dispatcher = ChatDispatcher(config.TG_DISPATCH_WORKERS)
+
+
+def in_chat_order(f: Callable):
+    """Decorator of the update handlers, to run them by the `chat_dispatcher`"""
+
+    @functools.wraps(f)
+    async def wrapped(update: Update, context: CallbackContext.DEFAULT_TYPE):
+        return await chat_dispatcher.run(update.effective_chat.id, functools.partial(f, update, context))
+
+    return wrapped
@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, Optional
+
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from avalon import config, metrics
+
+logger = logging.getLogger(__name__)
+TG_API_SECONDS = metrics.histogram('avalon_tg_api_seconds', 'Duration of the bot API calls', ('method',))
+TG_API_RESPONSES = metrics.counter('avalon_tg_api_responses_total', 'Responses of the bot API calls, by HTTP status '
+                                   '(error: no response)', ('method', 'code'))
+
+PRIORITY_HIGH = 0  # Messages of game progress (phase changes, results)
+PRIORITY_NORMAL = 1  # Replies to the user actions
+PRIORITY_LOW = 2  # Cosmetic edits of the already sent messages
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return max(self.paused_until - now, 0. if self.tokens >= 1 else (1 - self.tokens) / self.rate)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.paused_until <= now
+
+
+class MeteredRequest(HTTPXRequest):
+    """Records the latency and the status code of each bot API call"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> tuple[int, bytes]:
+        api_method = url.rsplit('/', 1)[-1]
+        start = time.perf_counter()
+        code = 'error'
+        try:
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            return code, payload
+        finally:
+            TG_API_SECONDS.labels(api_method).observe(time.perf_counter() - start)
+            TG_API_RESPONSES.labels(api_method, code).inc()
+
+
+class OutboundQueue:
+    """
+    Sends the bot API calls while respecting the global and per-chat rate limits of Telegram, and honouring the
+    `retry_after` of flood-control errors (at most `max_retries` times per call). Calls of a chat are executed one at
+    a time, highest priority first (calls with the same priority keep their order).
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets: dict[Optional[int], TokenBucket] = {}
+        self.max_retries = max_retries
+        self.pending: list = []  # heap of (priority, seq, chat_id, factory, future, retries)
+        self.busy_chats: set[Optional[int]] = set()
+        self.running: set[asyncio.Task] = set()
+        self.seq = itertools.count()
+        self.stats = Counter()
+        self.wakeup: Optional[asyncio.Event] = None
+        self.call_done: Optional[asyncio.Event] = None
+        self.worker: Optional[asyncio.Task] = None
+
+    def submit(self, chat_id: Optional[int], factory: Callable[[], Awaitable], priority=PRIORITY_NORMAL) \
+            -> asyncio.Future:
+        """:param factory: creates the coroutine of the API call, it's called again on retries"""
+        if not self.worker or self.worker.done():
+            self.wakeup = asyncio.Event()
+            self.call_done = asyncio.Event()
+            self.worker = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.pending, (priority, next(self.seq), chat_id, factory, future, 0))
+        self.stats['submitted'] += 1
+        self.wakeup.set()
+        return future
+
+    async def call(self, chat_id: Optional[int], factory: Callable[[], Awaitable], priority=PRIORITY_NORMAL):
+        return await self.submit(chat_id, factory, priority)
+
+    def send_later(self, chat_id: Optional[int], factory: Callable[[], Awaitable], priority=PRIORITY_LOW):
+        """Fire and forget, errors are only logged"""
+        self.submit(chat_id, factory, priority).add_done_callback(self._log_error)
+
+    @staticmethod
+    def _log_error(future: asyncio.Future):
+        if not future.cancelled() and future.exception():
+            logger.error('Outbound call failed', exc_info=future.exception())
+
+    def _chat_bucket(self, chat_id: Optional[int]) -> TokenBucket:
+        if chat_id not in self.chat_buckets:
+            self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return self.chat_buckets[chat_id]
+
+    def _start_ready_calls(self, now: float) -> Optional[float]:
+        """:return: seconds to wait until the next call can be started, None if nothing is pending"""
+        delay = None
+        started = []
+        for item in sorted(self.pending):
+            chat_id = item[2]
+            if chat_id in self.busy_chats:
+                continue  # Woken up when the running call of the chat is done
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                delay = global_wait if delay is None else min(delay, global_wait)
+                break
+            chat_wait = self._chat_bucket(chat_id).wait_time(now)
+            if chat_wait > 0:
+                delay = chat_wait if delay is None else min(delay, chat_wait)
+                continue
+            self.global_bucket.take(now)
+            self._chat_bucket(chat_id).take(now)
+            self.busy_chats.add(chat_id)
+            started.append(item)
+            task = asyncio.create_task(self._execute(item))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+        if started:
+            self.pending = [item for item in self.pending if item not in started]
+            heapq.heapify(self.pending)
+        return delay
+
+    async def _execute(self, item):
+        priority, seq, chat_id, factory, future, retries = item
+        try:
+            result = await factory()
+        except RetryAfter as e:
+            logger.warning('Flood control on chat %s, retry after %ss', chat_id, e.retry_after,
+                           extra={'chat_id': chat_id})
+            self.stats['retry_after'] += 1
+            bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+            bucket.pause(time.monotonic(), e.retry_after)
+            if retries < self.max_retries:
+                heapq.heappush(self.pending, (priority, seq, chat_id, factory, future, retries + 1))
+            else:
+                self.stats['failed'] += 1
+                if not future.done():
+                    future.set_exception(e)
+        except Exception as e:
+            self.stats['failed'] += 1
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.stats['sent'] += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self.busy_chats.discard(chat_id)
+            self.running.discard(asyncio.current_task())
+            self.wakeup.set()
+            self.call_done.set()
+
+    def _cleanup_buckets(self, now: float):
+        for chat_id in [c for c, b in self.chat_buckets.items() if c not in self.busy_chats and b.is_idle(now)]:
+            del self.chat_buckets[chat_id]
+
+    async def run(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            delay = self._start_ready_calls(now)
+            if len(self.chat_buckets) > 1000:
+                self._cleanup_buckets(now)
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Waits until the submitted calls are done (sent, or failed), then stops the worker"""
+        while self.pending or self.running:
+            self.call_done.clear()
+            await self.call_done.wait()
+        if self.worker:
+            self.worker.cancel()
+            self.worker = None
+
+
+outbound_queue = OutboundQueue(config.TG_GLOBAL_RATE, config.TG_CHAT_RATE, config.TG_CHAT_BURST,
+                               config.TG_RETRY_AFTER_LIMIT)
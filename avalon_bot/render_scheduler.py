@@ -0,0 +1,73 @@
+import asyncio
+import hashlib
+from collections import Counter, OrderedDict
+
+from telegram import TelegramObject
+
+from avalon.game import GameEvent, VotesChanged, GameParticipantsChanged, QuestTeamChanged, QuestActionsChanged
+
+# Events which only cause an edit of an already sent message
+EDIT_EVENTS = (VotesChanged, GameParticipantsChanged, QuestTeamChanged, QuestActionsChanged)
+
+
+def is_edit_event(event: GameEvent):
+    return isinstance(event, EDIT_EVENTS)
+
+
+def digest(params: dict) -> str:
+    h = hashlib.md5()
+    for key in sorted(params):
+        value = params[key]
+        h.update(f'{key}={value.to_json() if isinstance(value, TelegramObject) else value}\n'.encode())
+    return h.hexdigest()
+
+
+class RenderScheduler:
+    """
+    Coalesces edit events of a chat which are received within `window` seconds, and skips edits which would
+    not change the message (compared to the last text/markup sent to it)
+    """
+    stats = Counter()  # Of all chats: edit_events (received), edits (sent), unchanged (skipped)
+    max_messages = 16
+
+    def __init__(self, window: float):
+        self.window = window
+        self.sent: OrderedDict[int, str] = OrderedDict()  # {message_id: digest}
+
+    async def collect(self, queue: asyncio.Queue, event: GameEvent) -> list[GameEvent]:
+        """
+        Wait for the rest of the edit events of the window. The batch ends early on the first non-edit event,
+        so that the order of the messages is kept.
+        """
+        events = [event]
+        if not is_edit_event(event):
+            return events
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while is_edit_event(events[-1]):
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                events.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        self.stats['edit_events'] += sum(map(is_edit_event, events))
+        return events
+
+    def mark_sent(self, message_id: int, params: dict):
+        self.sent[message_id] = digest(params)
+        self.sent.move_to_end(message_id)
+        while len(self.sent) > self.max_messages:
+            self.sent.popitem(last=False)
+
+    def should_edit(self, message_id: int, params: dict) -> bool:
+        if self.sent.get(message_id) == digest(params):
+            self.stats['unchanged'] += 1
+            return False
+        self.stats['edits'] += 1
+        return True
+
+    @classmethod
+    def saved_calls(cls) -> int:
+        return cls.stats['edit_events'] - cls.stats['edits']
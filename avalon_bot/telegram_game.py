@@ -1,9 +1,9 @@
-import asyncio
+import functools
 import html
 from itertools import zip_longest
 from typing import TypeVar, Iterable, Optional
 
-from telegram import User, InlineKeyboardMarkup, InlineKeyboardButton, Update, Bot, Message
+from telegram import User, InlineKeyboardMarkup, InlineKeyboardButton, Bot, Message
 from telegram.constants import ParseMode
 from telegram.error import BadRequest
 
@@ -12,6 +12,7 @@ from avalon.game import Participant, KING_EMOJI, LADY_EMOJI, SUCCESS_EMOJI, FAIL
 from avalon_bot.common import MSG_JOIN, MSG_LEAVE, MSG_PLAY, MSG_SELECT, MSG_MY_ROLE, MSG_CONFIRM_TEAM, \
     MSG_PROCEED, MSG_REJECT, MSG_APPROVE, MSG_SUCCESS, MSG_FAIL, MSG_NEXT_LADY, MSG_TRUTH, MSG_GUESS_MERLIN, \
     MSG_CONFIRM_MERLIN
+from avalon_bot.outbound import outbound_queue
 
 T = TypeVar('T')
 
@@ -37,6 +38,10 @@ def grouper(iterable: Iterable[T], n) -> list[list[T]]:
 
 
 class TgParticipant(Participant):
+    __slots__ = ('username', 'full_name')
+    codec_kind = 'tg'
+    codec_fields = ('username', 'full_name')
+
     def __init__(self, user: User):
         super().__init__(str(user.id))
         self.username = user.username
@@ -53,6 +58,8 @@ def mention(p: Participant):
 
 
 class TgListener(EventListener):
+    codec_kind = 'tg'
+
     def __init__(self, listener_id: str, game: Game):
         super().__init__(listener_id, game)
         self.active_message_id = None
@@ -64,29 +71,26 @@ class TgListener(EventListener):
         self.chat_id = int(listener_id)
         self.lady_responses = {}  # {message_id: {identity: str, is_evil: bool}}
 
-    async def send_msg(self, update: Update, params: dict):
-        orig_msg = update.callback_query.message if update.callback_query else update.message
-        msg = await orig_msg.reply_text(**params, quote=False)
-        self.message_sent(msg)
-        return msg
-
-    def message_sent(self, msg: Message):
+    def message_sent(self, msg: Message, phase: Optional[GamePhase] = None):
+        """:param phase: of the game which the message is rendered for, the current one by default"""
+        phase = phase or self.game.phase
         self.active_message_id = msg.message_id
-        if self.game.phase == GamePhase.Started:
-            asyncio.create_task(msg.get_bot().pin_chat_message(chat_id=msg.chat_id, message_id=msg.message_id))
+        if phase == GamePhase.Started:
+            outbound_queue.send_later(msg.chat_id, functools.partial(
+                msg.get_bot().pin_chat_message, chat_id=msg.chat_id, message_id=msg.message_id))
             self.game_start_message_id = msg.message_id
         elif self.game_start_message_id:
             self.update_game_start_message(msg.get_bot())
 
-        if self.game.phase == GamePhase.TeamVote:
+        if phase == GamePhase.TeamVote:
             self.last_vote_message_id = msg.message_id
-        if self.game.phase == GamePhase.Quest:
+        if phase == GamePhase.Quest:
             self.last_quest_message_id = msg.message_id
 
     def update_game_start_message(self, bot: Bot):
-        asyncio.create_task(
-            send_ignore_400(bot.edit_message_text(chat_id=self.chat_id, message_id=self.game_start_message_id,
-                                                  **self.get_game_start_message())))
+        message_id, params = self.game_start_message_id, self.get_game_start_message()
+        outbound_queue.send_later(self.chat_id, lambda: send_ignore_400(
+            bot.edit_message_text(chat_id=self.chat_id, message_id=message_id, **params)))
 
     def set_next_lady(self, participant: T, next_identity: str, message=None, dry_run=False) -> T:
         lady = self.game.set_next_lady(participant, next_identity, dry_run)
@@ -101,6 +105,10 @@ class TgListener(EventListener):
         self.pending_merlin = merlin if dry_run else None
         return merlin
 
+    def view_state(self) -> tuple:
+        return (self.pending_next_lady and self.pending_next_lady.identity,
+                self.pending_merlin and self.pending_merlin.identity)
+
     def get_current_phase_message(self):
         phase_to_func = {
             GamePhase.Joining: self.send_joining_message,
@@ -112,7 +120,7 @@ class TgListener(EventListener):
             GamePhase.GuessMerlin: self.get_guess_merlin_message,
             GamePhase.Finished: self.get_finished_message,
         }
-        return phase_to_func[self.game.phase]()
+        return self.rendered(phase_to_func[self.game.phase])
 
     def send_joining_message(self):
         msg = f'<i>Press <b>Play</b> after all participants have joined … ' \
@@ -173,7 +181,7 @@ class TgListener(EventListener):
             msg += f'\n‎🏅 {mention(p)}'
         msg += "\n</b>"
         for p in self.game.participants:
-            msg += f'\n‎{"❔" if p.vote is None else "🗳"} {mention(p)}'
+            msg += f'\n‎{"❔" if self.game.get_vote(p) is None else "🗳"} {mention(p)}'
         return dict(
             text=msg,
             parse_mode=ParseMode.HTML,
@@ -186,13 +194,13 @@ class TgListener(EventListener):
     def get_voting_result_message(self, results):
         msg = f'<b>Selected team is {"APPROVED! ✅" if results else "REJECTED! ❌"}</b>\n'
         for p in self.game.participants:
-            msg += f'\n‎{"⚪" if p.vote else "⚫"} {mention(p)}'
+            msg += f'\n‎{"⚪" if self.game.get_vote(p) else "⚫"} {mention(p)}'
         return dict(text=msg, parse_mode=ParseMode.HTML)
 
     def get_quest_message(self):
         msg = f"<i><b>Choose the battle result:</b>\n(fail votes to fail quest: {self.game.step[0]})</i>\n"
         for p in self.game.current_team:
-            msg += f'\n‎{"❔" if p.quest_action is None else "🔱"} {mention(p)}'
+            msg += f'\n‎{"❔" if self.game.get_quest_action(p) is None else "🔱"} {mention(p)}'
         return dict(
             text=msg,
             parse_mode=ParseMode.HTML,
@@ -205,7 +213,7 @@ class TgListener(EventListener):
     def get_quest_result_message(self, succeeded: bool, failed_count: int, success_count: int):
         msg = ''
         for p in self.game.current_team:
-            msg += f'‎{"❔" if p.quest_action is None else "🔱"} {mention(p)}\n'
+            msg += f'‎{"❔" if self.game.get_quest_action(p) is None else "🔱"} {mention(p)}\n'
         msg += f'<b>The quest is {"SUCCEEDED! ✅" if succeeded else "FAILED! ❌"}</b>\n'
         msg += SUCCESS_EMOJI * success_count
         msg += FAIL_EMOJI * failed_count
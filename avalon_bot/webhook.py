@@ -0,0 +1,89 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import Counter, deque
+from typing import Awaitable, Callable, Optional
+
+from telegram import Bot, Update
+
+from avalon.http_server import HttpServer, Request, Response, HttpError
+
+logger = logging.getLogger(__name__)
+
+LATENCY_SAMPLES = 10000  # The latest ones are kept
+
+
+def webhook_path(token: str) -> str:
+    """Secret path of the webhook, derived from the bot token, so only Telegram knows it"""
+    return '/tg-' + hashlib.sha256(token.encode()).hexdigest()[:32]
+
+
+class WebhookIngestion:
+    """
+    Receives the updates on an HTTP endpoint, and processes them by a pool of workers. The backlog of the received
+    (not yet processed) updates is bounded, Telegram is answered with 503 when it's full, and retries later.
+    """
+
+    def __init__(self, bot: Bot, process_update: Callable[[Update], Awaitable], path: str, workers: int,
+                 backlog: int):
+        self.bot = bot
+        self.process_update = process_update
+        self.path = path
+        self.workers = workers
+        self.queue: asyncio.Queue[tuple[float, Update]] = asyncio.Queue(backlog)
+        self.stats = Counter()  # received, rejected, processed, failed
+        # Seconds from receiving to the end of processing, of the latest updates since last `reset`
+        self.latencies: deque[float] = deque(maxlen=LATENCY_SAMPLES)
+        self.tasks: list[asyncio.Task] = []
+        self.server: Optional[HttpServer] = None
+
+    async def handle_request(self, request: Request) -> Response:
+        if request.method != 'POST' or request.path != self.path:
+            raise HttpError(404)
+        try:
+            update = Update.de_json(request.json(), self.bot)
+        except ValueError:
+            raise HttpError(400)
+        try:
+            self.queue.put_nowait((time.perf_counter(), update))
+        except asyncio.QueueFull:
+            self.stats['rejected'] += 1
+            raise HttpError(503)
+        self.stats['received'] += 1
+        return Response()
+
+    async def work(self):
+        while True:
+            received, update = await self.queue.get()
+            try:
+                await self.process_update(update)
+                self.stats['processed'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logger.exception('Failed to process update %s', update.update_id,
+                                 extra={'chat_id': update.effective_chat and update.effective_chat.id})
+            finally:
+                self.latencies.append(time.perf_counter() - received)
+                self.queue.task_done()
+
+    async def start(self, host: str, port: int):
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        self.server = HttpServer(self.handle_request, host, port)
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+
+    def reset(self):
+        self.stats.clear()
+        self.latencies.clear()
+
+    def latency_percentile(self, percentile: float) -> float:
+        if not self.latencies:
+            return 0.
+        latencies = sorted(self.latencies)
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
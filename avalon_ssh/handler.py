@@ -1,23 +1,20 @@
 import asyncio
 import re
-import unicodedata
 from functools import partial
 from typing import Optional
 
 import colored
 from asyncssh import SSHServerProcess
 
-from avalon.exceptions import InvalidActionException
+from avalon import config, metrics, profiling
+from avalon.exceptions import InvalidActionException, ConcurrentModification
 from avalon.game import EventListener, Game, GamePhase, GameEvent, VotingCompleted, \
-    QuestFailedByTooManyRejections, FAIL_EMOJI, QuestCompleted, GameDeleted
+    QuestFailedByTooManyRejections, FAIL_EMOJI, QuestCompleted, GameDeleted, conflict_backoff
+from avalon_ssh.render import Screen, MAX_WIDTH
 from avalon_ssh.ssh_game import SshParticipant, SshListener
 
-NON_VISIBLE_CHARS = re.compile(r'[\u200c\u200e\ufe0f]')
-
-
-def visible_len(text):
-    # TODO: better implementation
-    return sum((2 if unicodedata.east_asian_width(ch) == 'W' else 1) for ch in re.sub(NON_VISIBLE_CHARS, '', text))
+SSH_ACTION_SECONDS = metrics.histogram('avalon_ssh_action_seconds', 'Duration of the entered actions, by the phase',
+                                       ('phase',))
 
 
 class SshGameHandler:
@@ -27,25 +24,31 @@ class SshGameHandler:
         self.new_actor = SshParticipant(process.get_extra_info('username'), user_identity)
         self.listener: Optional[SshListener] = None
         self.user_identity = user_identity
-        self.current_input: Optional[asyncio.Task] = None
+        # Lines entered by the user (read by a single task), None when the prompt is outdated by the game changes
+        self.inputs: asyncio.Queue[Optional[str]] = asyncio.Queue()
+        self.prompt_outdated = False
         self.listen_task: Optional[asyncio.Task] = None
         self.last_printed_step = ''
+        self.shown_turn: Optional[tuple] = None  # Turn of the game which the last prompt is for, see `turn`
+        self.screen = Screen(process.term_size[0] or MAX_WIDTH + 4)
         self.cursor = self.colored(self.new_actor.username + "> ", fg='green', attr='bold')
 
+    def terminal_resized(self, width: int):
+        self.screen.resize(width or MAX_WIDTH + 4)
+        if self.listener:  # The phase message is drawn again for the new width
+            self.last_printed_step = ''
+            self.reprompt()
+
     def colored(self, value, fg='', attr=''):
         return (fg and colored.fg(fg)) + (attr and colored.attr(attr)) + value + colored.attr(0)
 
-    def box(self, msg):
-        lines = msg.strip().split('\n')
-        width = min(120, self.process.term_size[0] - 4, max(visible_len(i) for i in lines))
-        out = ['┌─' + '─' * width + '─┐\n']
-        for line in lines:
-            for i in range(0, len(line) or 1, width):
-                part = line[i:i + width]
-                print(repr(part))
-                out.append('│ ' + part + ' ' * (width - visible_len(part)) + ' │\n')
-        out.append('└─' + '─' * width + '─┘\n')
-        return ''.join(out)
+    def write(self, text: str):
+        self.screen.wrote(text)
+        self.stdout.write(text)
+
+    def draw(self, msg: str, phase: Optional[GamePhase] = None):
+        """Writes the message in a box, `phase` is given for the phase messages (which can be updated in place)"""
+        self.stdout.write(self.screen.draw(msg, phase))
 
     async def process_command(self, command):
         if command in ('help', '?', '/help'):
@@ -57,65 +60,83 @@ class SshGameHandler:
             msg += f'{c("/delete")}     Stop and remove the current game.\n'
             msg += f'{c("/detach")}     Detach from game, keeping its state.\n'
             msg += f'{c("exit")} or ^C  Exit.\n'
-            self.stdout.write(msg)
+            self.write(msg)
             return
 
         if command in ('exit', 'quit'):
-            self.cancel_input()
             self.process.exit(0)
             return
 
         listener = await EventListener.load_by_id(self.user_identity)
         if not listener:
-            self.stdout.write('No game found\n')
+            self.write('No game found\n')
             return
 
         if command == '/detach':
             await listener.delete()
             self.listen_task.cancel()
-            self.cancel_input()
         elif command == '/delete':
             await listener.game.delete()
             self.listen_task.cancel()
-            self.cancel_input()
         elif command == '/restart':
             listener.game.restart()
             await listener.game.save()
-            self.cancel_input()
+            self.reprompt()
         elif command == '/my-info':
-            self.stdout.write(listener.game.get_user_info(self.actor) + '\n')
+            self.write(listener.game.get_user_info(self.actor) + '\n')
         elif command == '/game-info':
             if self.listener.game.phase not in (GamePhase.Joining, GamePhase.Started):
-                self.stdout.write(self.box(self.listener.get_game_start_message()))
+                self.draw(self.listener.get_game_start_message())
             self.last_printed_step = self.listener.get_current_phase_message()
-            self.stdout.write(self.box(self.last_printed_step))
+            self.draw(self.last_printed_step, self.listener.game.phase)
         else:
-            self.stdout.write('Invalid command\n')
+            self.write('Invalid command\n')
+
+    async def read_lines(self):
+        """The only reader of the input, an error (e.g. end of the input) is queued as the last item"""
+        try:
+            while True:
+                self.inputs.put_nowait(await self.process.stdin.readuntil('\n'))
+        except Exception as e:
+            self.inputs.put_nowait(e)
+
+    def reprompt(self):
+        """Interrupts the pending (interruptible) input, to prompt again for the changed game"""
+        if not self.prompt_outdated:
+            self.prompt_outdated = True
+            self.inputs.put_nowait(None)
 
-    async def read_input(self, *values, regex=None, to_lower=True, prompt=None, msg='Invalid input'):
+    async def read_input(self, *values, regex=None, to_lower=True, prompt=None, msg='Invalid input',
+                         interruptible=False) -> Optional[str]:
+        """:return: the valid input, or None if it's interruptible and the prompt is outdated"""
         cursor = self.cursor
         if prompt is not None:
-            self.stdout.write(f"{prompt}\n{cursor}")
+            self.write(f"{prompt}\n{cursor}")
         while True:
-            data = (await self.process.stdin.readuntil('\n')).strip()
+            data = await self.inputs.get()
+            if data is None:
+                outdated, self.prompt_outdated = self.prompt_outdated, False
+                if outdated and interruptible:
+                    return
+                continue
+            if isinstance(data, Exception):
+                raise data
+            data = data.strip()
+            self.screen.input_received()
             if to_lower:
                 data = data.lower()
             if data.startswith('/') or data in ('?', 'help', 'exit', 'quit'):
                 await self.process_command(data)
-                self.stdout.write(cursor)
+                self.write(cursor)
                 continue
             if regex and re.match(regex + r'\Z', data):
                 return data
             if values and data in values:
                 return data
             if data:
-                self.stdout.write(f"{self.colored(msg, fg='red')}\n{cursor}")
+                self.write(f"{self.colored(msg, fg='red')}\n{cursor}")
             else:
-                self.stdout.write(cursor)
-
-    def cancel_input(self):
-        if self.current_input:
-            self.current_input.cancel()
+                self.write(cursor)
 
     async def listen_for_changes(self):
         listener = self.listener
@@ -123,10 +144,10 @@ class SshGameHandler:
             async with listener.listen():
                 while True:
                     event: GameEvent = await listener.queue.get()
-                    await listener.reload_game()
                     if isinstance(event, GameDeleted):
-                        self.cancel_input()
                         break
+                    await listener.sync_game(event)
+                    phase = None
                     if isinstance(event, VotingCompleted):
                         msg = listener.get_voting_result_message(event.result)
                     elif isinstance(event, QuestFailedByTooManyRejections):
@@ -136,28 +157,42 @@ class SshGameHandler:
                     else:
                         # VotesChanged, GameParticipantsChanged, QuestTeamChanged, QuestActionsChanged, GamePhaseChanged
                         msg = listener.get_current_phase_message()
-                    if msg != self.last_printed_step:
-                        self.cancel_input()
-                        self.stdout.write('\n' + self.box(msg))
-                        self.last_printed_step = msg
+                        phase = listener.game.phase
+                    # Within the same phase (and prompt), only the changed lines are redrawn, keeping the input
+                    update = self.screen.update(msg, phase)
+                    if update is None:
+                        if msg != self.last_printed_step:
+                            self.write('\n')
+                            self.draw(msg, phase)
+                            self.reprompt()
+                    else:
+                        self.stdout.write(update)
+                    self.last_printed_step = msg
         finally:
             self.listener = None
+            self.reprompt()
 
     async def handle_connection(self):
-        self.stdout.write(f"Welcome to Avalon Bot, {self.new_actor}!\n\n")
+        self.write(f"Welcome to Avalon Bot, {self.new_actor}!\n\n")
+        reader = asyncio.create_task(self.read_lines())
+        try:
+            await self.handle_menu()
+        finally:
+            reader.cancel()
 
+    async def handle_menu(self):
         while True:
             listener = await EventListener.load_by_id(self.user_identity)
             if not listener:
-                self.stdout.write('Please choose an option (enter 1 or 2):\n  '
-                                  '1) Create a new game\n  2) Join an existing game\n' + self.cursor)
+                self.write('Please choose an option (enter 1 or 2):\n  '
+                       '1) Create a new game\n  2) Join an existing game\n' + self.cursor)
                 response = await self.read_input('1', '2')
                 if response == '1':  # new game
                     game = Game(participants=[self.new_actor])
                     await game.save()
                     listener = SshListener(self.user_identity, game)
                 if response == '2':  # join a game
-                    self.stdout.write('Enter join key (e.g 123-456), or (B)Back\n' + self.cursor)
+                    self.write('Enter join key (e.g 123-456), or (B)Back\n' + self.cursor)
                     while True:
                         response = await self.read_input(regex=r'[\w-]+')
                         if response == 'b':
@@ -175,89 +210,108 @@ class SshGameHandler:
                 try:
                     await self.handle_game()
                 except InvalidActionException as e:
-                    self.stdout.write(f"{self.colored(str(e), fg='red')}\n")
-                except asyncio.CancelledError:
-                    pass
+                    self.write(f"{self.colored(str(e), fg='red')}\n")
 
     @property
     def actor(self):
         return self.listener.game.get_participant_by_id(self.user_identity)
 
+    @profiling.hook('SshGameHandler.handle_game')
     async def handle_game(self):
         listener = self.listener
         game = listener.game
+        self.prompt_outdated = False  # Prompted below, for the current state of the game
         msg = listener.get_current_phase_message()
         if msg != self.last_printed_step:
-            self.stdout.write(self.box(msg))
+            self.draw(msg, game.phase)
             self.last_printed_step = msg
-        inp = self.read_input(prompt='')  # wait forever
+        self.shown_turn = self.turn(game)
+        values, regex, prompt = (), None, ''  # wait forever
         if game.phase == GamePhase.Joining:
-            inp = self.read_input('j', 'l', 'p', prompt='(J)Join (L)Leave (P)Play')
+            values, prompt = ('j', 'l', 'p'), '(J)Join (L)Leave (P)Play'
         if game.phase == GamePhase.Started:
-            inp = self.read_input('p', prompt='(P)Play')
+            values, prompt = ('p',), '(P)Play'
         if game.phase == GamePhase.TeamBuilding:
             if self.actor == game.king:
-                prompt = f'Comma separated numbers to toggle team, then (C)Confirm'
-                inp = self.read_input(prompt=prompt, regex='c|[0-9,]*')
+                regex, prompt = 'c|[0-9,]*', 'Comma separated numbers to toggle team, then (C)Confirm'
         if game.phase == GamePhase.TeamVote:
-            inp = self.read_input('a', 'r', prompt='(A)Approve (R)Reject')
+            values, prompt = ('a', 'r'), '(A)Approve (R)Reject'
         if game.phase == GamePhase.Quest:
-            if self.actor in game.current_team:
-                inp = self.read_input('s', 'f', prompt='(S)success (F)Fail')
+            if game.in_team(self.actor):
+                values, prompt = ('s', 'f'), '(S)success (F)Fail'
         if game.phase == GamePhase.Lady:
             if self.actor == game.lady:
-                inp = self.read_input(prompt=f'1-{len(game.next_lady_candidates())} to select next lady',
-                                      regex=f'[1-{len(game.next_lady_candidates())}]')
+                regex = f'[1-{len(game.next_lady_candidates())}]'
+                prompt = f'1-{len(game.next_lady_candidates())} to select next lady'
         if game.phase == GamePhase.GuessMerlin:
             if self.actor == game.get_assassin():
-                inp = self.read_input(prompt=f'1-{len(game.merlin_candidates())} to select merlin',
-                                      regex=f'[1-{len(game.merlin_candidates())}]')
+                regex = f'[1-{len(game.merlin_candidates())}]'
+                prompt = f'1-{len(game.merlin_candidates())} to select merlin'
 
         # ------------------
-        self.current_input = asyncio.create_task(inp)
-        last_save = game.last_save
-        response = await self.current_input
+        response = await self.read_input(*values, regex=regex, prompt=prompt, interruptible=True)
+        if response is None:  # The game is changed, prompt again
+            return
+
+        with SSH_ACTION_SECONDS.labels(game.phase.name).time():
+            await self.apply_input(response)
+
+    @staticmethod
+    def turn(game: Game) -> tuple:
+        """The inputs are valid as long as the game is in the same turn (the same phase of the same vote)"""
+        return game.phase, len(game.round_result), game.failed_voting_count
 
-        async with Game.lock(game.game_id):
-            game = await listener.reload_game()
-            if game.last_save != last_save:
-                self.stdout.write(
+    @profiling.hook('SshGameHandler.apply_input')
+    async def apply_input(self, response: str):
+        # The game is saved optimistically, the input is applied again on the reloaded game if it's changed meanwhile
+        for attempt in range(config.GAME_SAVE_RETRIES + 1):
+            game = await self.listener.reload_game()
+            if self.turn(game) != self.shown_turn:
+                self.write(
                     f"{self.colored('Game has been changed out of this context, Please Retry', fg='red')}\n")
                 return
+            try:
+                await self.apply_to(game, response)
+                return
+            except ConcurrentModification:
+                if attempt == config.GAME_SAVE_RETRIES:
+                    raise
+            await conflict_backoff(attempt)
 
-            if game.phase == GamePhase.Joining:
-                if response == 'j':
-                    game.add_participant(self.new_actor)
-                elif response == 'l':
-                    game.remove_participant(self.new_actor)
-                else:
-                    game.play()
-                await game.save()
-            elif game.phase == GamePhase.Started:
-                game.proceed_to_game()
-                await game.save()
-            elif game.phase == GamePhase.TeamBuilding:
-                if response == 'c':
-                    game.confirm_team(self.actor)
-                else:
-                    for num in response.split(','):
-                        if not num or int(num) < 1 or int(num) > len(game.participants):
-                            raise InvalidActionException('Invalid participant number: ' + num)
-                        game.select_for_team(self.actor, game.participants[int(num) - 1].identity)
-                await game.save()
-            elif game.phase == GamePhase.TeamVote:
-                game.vote(self.actor, response == 'a')
-                game.process_vote_results()
-                await game.save()
-            elif game.phase == GamePhase.Quest:
-                game.quest_action(self.actor, response == 's')
-                game.process_quest_result()
-                await game.save()
-            elif game.phase == GamePhase.Lady:
-                p = game.set_next_lady(self.actor, game.next_lady_candidates()[int(response) - 1].identity)
-                # TODO: add /lady to retry passing this message
-                self.stdout.write(f'{p} is {"" if p.role.is_evil else "NOT "}an evil\n')
-                await game.save()
-            elif game.phase == GamePhase.GuessMerlin:
-                game.guess_merlin(self.actor, game.merlin_candidates()[int(response) - 1].identity)
-                await game.save()
+    async def apply_to(self, game: Game, response: str):
+        if game.phase == GamePhase.Joining:
+            if response == 'j':
+                game.add_participant(self.new_actor)
+            elif response == 'l':
+                game.remove_participant(self.new_actor)
+            else:
+                game.play()
+            await game.save()
+        elif game.phase == GamePhase.Started:
+            game.proceed_to_game()
+            await game.save()
+        elif game.phase == GamePhase.TeamBuilding:
+            if response == 'c':
+                game.confirm_team(self.actor)
+            else:
+                for num in response.split(','):
+                    if not num or int(num) < 1 or int(num) > len(game.participants):
+                        raise InvalidActionException('Invalid participant number: ' + num)
+                    game.select_for_team(self.actor, game.participants[int(num) - 1].identity)
+            await game.save()
+        elif game.phase == GamePhase.TeamVote:
+            game.vote(self.actor, response == 'a')
+            game.process_vote_results()
+            await game.save()
+        elif game.phase == GamePhase.Quest:
+            game.quest_action(self.actor, response == 's')
+            game.process_quest_result()
+            await game.save()
+        elif game.phase == GamePhase.Lady:
+            p = game.set_next_lady(self.actor, game.next_lady_candidates()[int(response) - 1].identity)
+            await game.save()
+            # TODO: add /lady to retry passing this message
+            self.write(f'{p} is {"" if p.role.is_evil else "NOT "}an evil\n')
+        elif game.phase == GamePhase.GuessMerlin:
+            game.guess_merlin(self.actor, game.merlin_candidates()[int(response) - 1].identity)
+            await game.save()
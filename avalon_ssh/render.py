@@ -0,0 +1,159 @@
+"""
+Rendering of the boxed messages on the terminals of the SSH sessions: display widths of grapheme clusters (cached),
+wrapping of the lines, and redrawing of only the changed lines of the last box, by ANSI cursor movements.
+"""
+import time
+import unicodedata
+from collections import Counter
+from functools import lru_cache
+from typing import Optional
+
+from avalon import profiling
+
+ZWJ = '\u200d'
+MAX_WIDTH = 120
+# The line editor of asyncssh treats an escape sequence as zero-width output only up to an 'm', so each cursor
+# movement is followed by a (no-op) reset of the attributes
+RESET = '\x1b[0m'
+
+
+@lru_cache(maxsize=None)
+def char_width(ch: str) -> int:
+    if unicodedata.category(ch) in ('Mn', 'Me', 'Cf') or '\ufe00' <= ch <= '\ufe0f' or \
+            '\U0001f3fb' <= ch <= '\U0001f3ff':  # Combining marks, format chars, variation selectors, skin tones
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in ('W', 'F') else 1
+
+
+def graphemes(text: str) -> list[str]:
+    """Splits the text into (approximate) grapheme clusters, zero-width chars are kept with the preceding char"""
+    clusters = []
+    for ch in text:
+        if clusters and (not char_width(ch) or clusters[-1][-1] == ZWJ or
+                         (is_regional_indicator(ch) and len(clusters[-1]) == 1 and
+                          is_regional_indicator(clusters[-1]))):
+            clusters[-1] += ch
+        else:
+            clusters.append(ch)
+    return clusters
+
+
+def is_regional_indicator(ch: str) -> bool:
+    return '\U0001f1e6' <= ch <= '\U0001f1ff'
+
+
+@lru_cache(maxsize=4096)
+def cluster_width(cluster: str) -> int:
+    return max(map(char_width, cluster))
+
+
+@lru_cache(maxsize=4096)
+def visible_len(text: str) -> int:
+    return sum(map(cluster_width, graphemes(text)))
+
+
+@lru_cache(maxsize=4096)
+def wrap(line: str, width: int) -> tuple[str, ...]:
+    """Splits the line into parts of at most `width` columns, between the grapheme clusters"""
+    parts, part, part_width = [], '', 0
+    for cluster in graphemes(line):
+        w = cluster_width(cluster)
+        if part_width + w > width and part:
+            parts.append(part)
+            part, part_width = '', 0
+        part += cluster
+        part_width += w
+    parts.append(part)
+    return tuple(parts)
+
+
+def box_lines(msg: str, term_width: int) -> list[str]:
+    lines = msg.strip().split('\n')
+    width = max(1, min(MAX_WIDTH, term_width - 4, max(map(visible_len, lines))))
+    out = ['┌─' + '─' * width + '─┐']
+    for line in lines:
+        for part in wrap(line, width):
+            out.append('│ ' + part + ' ' * (width - visible_len(part)) + ' │')
+    out.append('└─' + '─' * width + '─┘')
+    return out
+
+
+class Screen:
+    """
+    Tracks what is on the terminal of a session below the last drawn box: `rows_below` is the number of rows
+    written after the box, up to the input line, or None if it's not known (e.g. a line is entered by the user),
+    and `tail` is the output written on the input line (the prompt).
+    """
+    stats = Counter()  # Of all sessions: full_draws, full_bytes, diff_draws, diff_bytes, render_ns
+
+    def __init__(self, term_width: int):
+        self.term_width = term_width
+        self.lines: list[str] = []
+        self.tag = None  # What the box shows, only boxes with the same tag are redrawn in place
+        self.rows_below: Optional[int] = None
+        self.tail = ''
+
+    @profiling.hook('Screen.render')
+    def render(self, msg: str) -> list[str]:
+        start = time.perf_counter_ns()
+        lines = box_lines(msg, self.term_width)
+        self.stats['render_ns'] += time.perf_counter_ns() - start
+        return lines
+
+    def draw(self, msg: str, tag=None) -> str:
+        """:return: the whole box, to be written at the start of a line"""
+        self.lines = self.render(msg)
+        self.tag = tag
+        self.rows_below = 0
+        self.tail = ''
+        out = '\n'.join(self.lines) + '\n'
+        self.stats['full_draws'] += 1
+        self.stats['full_bytes'] += len(out.encode())
+        return out
+
+    def update(self, msg: str, tag) -> Optional[str]:
+        """
+        :return: the output which redraws the changed lines of the last box in place (and then rewrites the prompt
+                 of the input line, where the cursor is expected), or None if the box should be drawn again
+        """
+        if tag is None or tag != self.tag or self.rows_below is None:
+            return
+        lines = self.render(msg)
+        if len(lines) != len(self.lines):
+            return
+        changed = [i for i, (old, new) in enumerate(zip(self.lines, lines)) if old != new]
+        self.lines = lines
+        if not changed:
+            return ''
+        # Rows of the lines, counted upwards from the input line
+        row, out = len(lines) - changed[0] + self.rows_below, []
+        out.append(f'\x1b[{row}A{RESET}')
+        for i in changed:
+            target = len(lines) - i + self.rows_below
+            if target < row:
+                out.append(f'\x1b[{row - target}B{RESET}')
+            out.append(f'\r{lines[i]}\x1b[K{RESET}')
+            row = target
+        if row > 1:
+            out.append(f'\x1b[{row - 1}B{RESET}')
+        out.append('\n' + self.tail)
+        out = ''.join(out)
+        self.stats['diff_draws'] += 1
+        self.stats['diff_bytes'] += len(out.encode())
+        return out
+
+    def wrote(self, text: str):
+        """Keeps track of the rows of the output written after the box (shorter than the terminal width)"""
+        if self.rows_below is not None:
+            self.rows_below += text.count('\n')
+        self.tail = text.rsplit('\n', 1)[-1] if '\n' in text else self.tail + text
+
+    def input_received(self):
+        self.rows_below = None
+
+    def resize(self, term_width: int):
+        """The terminal may have wrapped the drawn lines again, so the next box is drawn in full"""
+        if term_width != self.term_width:
+            self.term_width = term_width
+            self.lines = []
+            self.rows_below = None
@@ -3,37 +3,48 @@ import hashlib
 import logging
 import os
 import sys
+from typing import Optional
 
 import asyncssh
 from asyncssh import SSHKey, SSHServerConnectionOptions
 from asyncssh.misc import MaybeAwait
 from asyncssh.server import _NewSession
 
-from avalon import config
+from avalon import config, metrics, profiling, log
 from avalon_ssh.handler import SshGameHandler
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                    level=logging.DEBUG)
+SSH_SESSIONS = metrics.gauge('avalon_ssh_sessions', 'Open SSH sessions')
+SSH_SESSIONS_TOTAL = metrics.counter('avalon_ssh_sessions_total', 'Started SSH sessions')
 
 
 async def handle_client(process: asyncssh.SSHServerProcess):
+    SSH_SESSIONS.inc()
+    SSH_SESSIONS_TOTAL.inc()
+    handler = None
     # noinspection PyBroadException
     try:
         user_identity = hashlib.md5(process.get_extra_info('key_data')).hexdigest()[:16]
         handler = SshGameHandler(process, user_identity)
+        process.handler = handler
         await handler.handle_connection()
     except asyncssh.BreakReceived:
         process.stdout.write('\n Bye!\n')
         process.exit(0)
     except:
-        logger.exception('Unhandled exception')
+        logger.exception('Unhandled exception', extra=handler and handler.listener and handler.listener.log_context())
         process.exit(1)
+    finally:
+        SSH_SESSIONS.dec()
 
 
 class MySSHServerProcess(asyncssh.SSHServerProcess):
-    def terminal_size_changed(self, *a_args, **_kwargs) -> None:
-        pass
+    handler: Optional[SshGameHandler] = None
+
+    def terminal_size_changed(self, width: int, *_args, **_kwargs) -> None:
+        # Not raised as TerminalSizeChanged by the reads (like the default), the handler is told instead
+        if self.handler:
+            self.handler.terminal_resized(width)
 
 
 class MySSHServerConnection(asyncssh.SSHServerConnection):
@@ -66,13 +77,16 @@ async def start_server():
         return MySSHServerConnection(loop, options)
 
     options = SSHServerConnectionOptions(server_host_keys=[config.SSH_HOST_KEY], server_factory=MySSHServer)
-    await loop.create_server(conn_factory, host='', port=8022, reuse_port=True)
+    await loop.create_server(conn_factory, host='', port=config.SSH_PORT, reuse_port=True)
+    await metrics.start_server()
+    profiling.install()
 
 
 os.environ['FORCE_COLOR'] = '2'
 
 
 def main():
+    log.setup()
     loop = asyncio.get_event_loop()
     try:
         loop.run_until_complete(start_server())
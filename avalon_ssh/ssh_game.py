@@ -6,6 +6,10 @@ LADY_TEXT = 'LADY'
 
 
 class SshParticipant(Participant):
+    __slots__ = ('username',)
+    codec_kind = 'ssh'
+    codec_fields = ('username',)
+
     def __init__(self, username, identity):
         super().__init__(identity)
         self.username = username
@@ -15,6 +19,8 @@ class SshParticipant(Participant):
 
 
 class SshListener(EventListener):
+    codec_kind = 'ssh'
+
     def get_current_phase_message(self):
         phase_to_func = {
             GamePhase.Joining: self.get_joining_message,
@@ -26,12 +32,15 @@ class SshListener(EventListener):
             GamePhase.GuessMerlin: self.get_guess_merlin_message,
             GamePhase.Finished: self.get_finished_message,
         }
-        return phase_to_func[self.game.phase]()
+        return self.rendered(phase_to_func[self.game.phase])
 
     @property
     def actor_id(self):
         return self.id
 
+    def view_state(self) -> tuple:
+        return self.actor_id,
+
     def is_me(self, participant):
         return isinstance(participant, SshParticipant) and self.actor_id == participant.identity
 
@@ -62,7 +71,7 @@ class SshListener(EventListener):
             msg = f"‎{KING_EMOJI} {self.game.king}!\n" + \
                   f"Choose {self.game.step[1]} people for this quest!\n\n"
             for i, p in enumerate(self.game.participants):
-                msg += f'  {"@" if p in self.game.current_team else "."} ‎{i + 1}) {p}\n'
+                msg += f'  {"@" if self.game.in_team(p) else "."} ‎{i + 1}) {p}\n'
         else:
             msg = f"Wait for ‎{KING_EMOJI} {self.game.king} to choose the team!\n"
             msg += 'Current selection:\n' if self.game.current_team else ''
@@ -78,13 +87,13 @@ class SshListener(EventListener):
             msg += f'\n‎🏅 {p}'
         msg += "\n"
         for p in self.game.participants:
-            msg += f'\n ‎{"." if p.vote is None else "@"} {p}'
+            msg += f'\n ‎{"." if self.game.get_vote(p) is None else "@"} {p}'
         return msg + '\n'
 
     def get_voting_result_message(self, results):
         msg = f'Selected team is {"APPROVED! ✅" if results else "REJECTED! ❌"}\n'
         for p in self.game.participants:
-            msg += f'\n ‎{"+" if p.vote else "-"} {p}'
+            msg += f'\n ‎{"+" if self.game.get_vote(p) else "-"} {p}'
         return msg + '\n'
 
     def get_quest_message(self):
@@ -95,7 +104,7 @@ class SshListener(EventListener):
         else:
             msg = f"Wait for battle result.\n(fail votes to fail quest: {self.game.step[0]})\n"
         for p in self.game.current_team:
-            msg += f'  ‎{"?" if p.quest_action is None else "."} {p}\n'
+            msg += f'  ‎{"?" if self.game.get_quest_action(p) is None else "."} {p}\n'
         return msg
 
     def get_quest_result_message(self, succeeded: bool, failed_count: int, success_count: int):
@@ -0,0 +1,50 @@
+"""
+Size and speed of `avalon.codec` against pickle, for a 10 player game in the middle of play.
+
+    python -m benchmarks.codec_size [rounds]
+"""
+import pickle
+import sys
+import timeit
+
+from avalon import codec
+from avalon.game import Game, GamePhase
+from avalon_ssh.ssh_game import SshParticipant, SshListener
+
+
+def sample_game() -> Game:
+    game = Game(participants=[SshParticipant(f'player{i}', f'{i:016x}') for i in range(10)])
+    game.play()
+    game.proceed_to_game()
+    for p in game.participants[:game.step[1]]:
+        game.select_for_team(game.king, p.identity)
+    game.confirm_team(game.king)
+    for p in game.participants:
+        game.vote(p, True)
+    game.process_vote_results()
+    assert game.phase == GamePhase.Quest
+    return game
+
+
+def compare(name, obj, encode, decode, rounds):
+    pickled, encoded = pickle.dumps(obj), encode(obj)
+    results = [
+        ('pickle', len(pickled), timeit.timeit(lambda: pickle.dumps(obj), number=rounds),
+         timeit.timeit(lambda: pickle.loads(pickled), number=rounds)),
+        ('codec', len(encoded), timeit.timeit(lambda: encode(obj), number=rounds),
+         timeit.timeit(lambda: decode(encoded), number=rounds)),
+    ]
+    for fmt, size, dump_time, load_time in results:
+        print(f'{name:>8} {fmt:>6}: {size:5d} bytes, '
+              f'dump={dump_time / rounds * 1e6:7.2f}us load={load_time / rounds * 1e6:7.2f}us')
+
+
+def main(rounds):
+    game = sample_game()
+    compare('game', game, codec.encode_game, codec.decode_game, rounds)
+    listener = SshListener(game.participants[0].identity, game)
+    compare('listener', listener, codec.encode_listener, codec.decode_listener, rounds)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
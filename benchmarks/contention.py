@@ -0,0 +1,73 @@
+"""
+Throughput of concurrent voters on one game: redis lock around each action against optimistic saves.
+In each round all voters press their button at the same time.
+
+    python -m benchmarks.contention [voters] [rounds]
+"""
+import asyncio
+import sys
+import time
+from collections import Counter
+
+from avalon import config
+from avalon.exceptions import ConcurrentModification
+from avalon.game import Game, GamePhase, Participant, redis_client, conflict_backoff
+
+
+async def setup_game(voters) -> Game:
+    game = Game(participants=[Participant(f'voter-{i}') for i in range(voters)])
+    game.play()
+    game.proceed_to_game()
+    for p in game.participants[:game.step[1]]:
+        game.select_for_team(game.king, p.identity)
+    game.confirm_team(game.king)
+    await game.save()
+    return game
+
+
+async def vote(game_id, identity, value):
+    game = await Game.load_by_id(game_id)
+    game.vote(game.get_participant_by_id(identity), value)
+    await game.save()
+
+
+async def locked_vote(game_id, identity, value, stats):
+    async with redis_client.lock('benchmark_lock_' + game_id, timeout=120):
+        await vote(game_id, identity, value)
+
+
+async def optimistic_vote(game_id, identity, value, stats):
+    for attempt in range(config.GAME_SAVE_RETRIES + 1):
+        try:
+            return await vote(game_id, identity, value)
+        except ConcurrentModification:
+            stats['conflicts'] += 1
+            await conflict_backoff(attempt)
+    stats['failed'] += 1
+
+
+async def measure(voter, voters, rounds):
+    game = await setup_game(voters)
+    assert game.phase == GamePhase.TeamVote
+    stats = Counter()
+    timings = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        await asyncio.gather(*(voter(game.game_id, p.identity, bool(i % 2), stats) for p in game.participants))
+        timings.append(time.perf_counter() - start)
+    await redis_client.delete(config.REDIS_PREFIX_GAME + game.game_id,
+                              config.REDIS_PREFIX_GAME_HISTORY + game.game_id)
+    timings.sort()
+    return voters * rounds / sum(timings), timings[len(timings) // 2] * 1000, stats
+
+
+async def main(voters, rounds):
+    for name, voter in (('lock', locked_vote), ('optimistic', optimistic_vote)):
+        throughput, p50, stats = await measure(voter, voters, rounds)
+        print(f'{name:>10}: {throughput:8.1f} votes/s, round p50={p50:.1f}ms, '
+              f'{stats["conflicts"]} conflicts, {stats["failed"]} failed after retries '
+              f'({voters} voters x {rounds} rounds)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:3])) if len(sys.argv) > 2 else main(10, 20))
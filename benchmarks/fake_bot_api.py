@@ -0,0 +1,128 @@
+"""
+In-process fake of the Bot API endpoints used by the bot, with configurable latency and flood-control (429) errors.
+Updates are injected by `push_update`, and the bot receives them by getUpdates (long polling).
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from avalon.http_server import HttpServer, Request, Response
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'Avalon', 'username': 'fake_avalon_bot'}
+
+
+class FakeBotApi:
+    def __init__(self, port: int, latency: float = 0., rate_limit_ratio: float = 0., retry_after: int = 1):
+        """
+        :param latency: mean seconds added to each API call (uniformly distributed within 50%-150%)
+        :param rate_limit_ratio: ratio of the sent and edited messages answered by 429 (Too Many Requests)
+        """
+        self.port = port
+        self.latency = latency
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.server = HttpServer(self.handle_request, '127.0.0.1', port)
+        self.updates: list[dict] = []
+        self.new_update = asyncio.Event()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.messages: dict[int, dict[int, dict]] = defaultdict(dict)  # by chat_id and message_id
+        self.pending_answers: dict[str, tuple[float, asyncio.Future]] = {}  # by callback_query_id
+        self.stats = Counter()  # API calls by method, and rate_limited
+        self.rng = random.Random()
+        self.methods = {
+            'getMe': self.get_me,
+            'deleteWebhook': self.ok,
+            'getUpdates': self.get_updates,
+            'sendMessage': self.send_message,
+            'editMessageText': self.edit_message_text,
+            'pinChatMessage': self.ok,
+            'answerCallbackQuery': self.answer_callback_query,
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.port}/bot'
+
+    async def start(self):
+        await self.server.start()
+
+    async def stop(self):
+        await self.server.stop()
+
+    def push_update(self, update: dict) -> Optional[asyncio.Future]:
+        """:return: for callback queries, a future of the seconds until the query is answered"""
+        update['update_id'] = next(self.update_ids)
+        self.updates.append(update)
+        self.new_update.set()
+        if 'callback_query' in update:
+            future = asyncio.get_running_loop().create_future()
+            self.pending_answers[update['callback_query']['id']] = time.perf_counter(), future
+            return future
+
+    async def handle_request(self, request: Request) -> Response:
+        method = request.path.rsplit('/', 1)[-1]
+        params = {}
+        for key, value in parse_qsl(request.body.decode()):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        self.stats[method] += 1
+        if self.latency and method != 'getUpdates':
+            await asyncio.sleep(self.rng.uniform(.5, 1.5) * self.latency)
+        if method in ('sendMessage', 'editMessageText') and self.rng.random() < self.rate_limit_ratio:
+            self.stats['rate_limited'] += 1
+            return Response.json({'ok': False, 'error_code': 429,
+                                  'description': f'Too Many Requests: retry after {self.retry_after}',
+                                  'parameters': {'retry_after': self.retry_after}}, status=429)
+        if method not in self.methods:
+            return Response.json({'ok': False, 'error_code': 404, 'description': 'Not Found'}, status=404)
+        return Response.json({'ok': True, 'result': await self.methods[method](params)})
+
+    async def ok(self, _params):
+        return True
+
+    async def get_me(self, _params):
+        return BOT_USER
+
+    async def get_updates(self, params):
+        offset = params.get('offset') or 0
+        self.updates = [u for u in self.updates if u['update_id'] >= offset]
+        if not self.updates:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), params.get('timeout') or 0)
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:params.get('limit') or 100]
+
+    def message(self, chat_id: int, message_id: int) -> dict:
+        return {'message_id': message_id, 'date': int(time.time()), 'from': BOT_USER,
+                'chat': {'id': chat_id, 'type': 'group', 'title': f'group {chat_id}'},
+                **self.messages[chat_id][message_id]}
+
+    async def send_message(self, params):
+        chat_id, message_id = int(params['chat_id']), next(self.message_ids)
+        self.messages[chat_id][message_id] = {'text': params['text'], **self._markup(params)}
+        return self.message(chat_id, message_id)
+
+    async def edit_message_text(self, params):
+        chat_id, message_id = int(params['chat_id']), int(params['message_id'])
+        self.messages[chat_id][message_id] = {'text': params['text'], **self._markup(params)}
+        return self.message(chat_id, message_id)
+
+    @staticmethod
+    def _markup(params) -> dict:
+        return {'reply_markup': params['reply_markup']} if params.get('reply_markup') else {}
+
+    async def answer_callback_query(self, params):
+        sent, future = self.pending_answers.pop(params['callback_query_id'], (None, None))
+        if future and not future.done():
+            future.set_result(time.perf_counter() - sent)
+        return True
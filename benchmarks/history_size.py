@@ -0,0 +1,60 @@
+"""
+Redis memory of a game history: the action log against a full pickled snapshot per save.
+
+    python -m benchmarks.history_size [players]
+"""
+import asyncio
+import pickle
+import random
+import sys
+
+from avalon import config
+from avalon.game import Game, GamePhase, Participant, redis_client
+
+
+def next_move(game: Game):
+    if game.phase == GamePhase.Joining:
+        game.play()
+    elif game.phase == GamePhase.Started:
+        game.proceed_to_game()
+    elif game.phase == GamePhase.TeamBuilding:
+        for p in random.sample(game.participants, game.step[1]):
+            game.select_for_team(game.king, p.identity)
+        game.confirm_team(game.king)
+    elif game.phase == GamePhase.TeamVote:
+        for p in game.participants:
+            game.vote(p, random.random() < .6)
+            yield
+        game.process_vote_results()
+    elif game.phase == GamePhase.Quest:
+        for p in list(game.current_team):
+            game.quest_action(p, not p.role.is_evil or random.random() < .5)
+            yield
+        game.process_quest_result()
+    elif game.phase == GamePhase.Lady:
+        game.set_next_lady(game.lady, game.next_lady_candidates()[0].identity)
+    elif game.phase == GamePhase.GuessMerlin:
+        game.guess_merlin(game.get_assassin(), game.merlin_candidates()[0].identity)
+    yield
+
+
+async def main(players):
+    game = Game(participants=[Participant(f'player-{i}') for i in range(players)])
+    legacy_key = 'benchmark_legacy_' + config.REDIS_PREFIX_GAME_HISTORY + game.game_id
+    saves = 0
+    while game.phase != GamePhase.Finished:
+        for _ in next_move(game):
+            await game.save()
+            await redis_client.lpush(legacy_key, pickle.dumps(game))
+            saves += 1
+    log_key = config.REDIS_PREFIX_GAME_HISTORY + game.game_id
+    log_size = await redis_client.memory_usage(log_key)
+    legacy_size = await redis_client.memory_usage(legacy_key)
+    print(f'{saves} saves, {await Game.history_length(game.game_id)} history records')
+    print(f'snapshot per save: {legacy_size} bytes')
+    print(f'       action log: {log_size} bytes ({legacy_size / log_size:.1f}x smaller)')
+    await redis_client.delete(legacy_key, log_key, config.REDIS_PREFIX_GAME + game.game_id)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,89 @@
+"""
+Stalls of the event loop by logging, while game events are published (with an INFO and a filtered DEBUG record each)
+and stderr is slow (every write takes `write-ms`, e.g. a full pipe): records written by a `StreamHandler` on the
+event loop with eagerly formatted f-strings (as before), against the queue of `avalon.log` with lazy formatting.
+
+    python -m benchmarks.log_stall [events] [write-ms]
+"""
+import asyncio
+import io
+import logging
+import sys
+import time
+
+from avalon import log
+from benchmarks.telegram_load import percentile
+
+TICK = 0.001  # Seconds between the checks of the loop lag
+EVENTS_PER_TICK = 20
+
+logger = logging.getLogger('avalon.event_bus')
+
+
+class SlowStream(io.StringIO):
+    def __init__(self, delay: float):
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return len(text)
+
+
+class Event:
+    def __init__(self, i: int):
+        self.votes = list(range(i % 10))
+
+    def __repr__(self):
+        return f'Event({self.votes})'
+
+
+async def monitor(lags: list[float], done: asyncio.Event):
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def publish_eager(events: int):
+    for i in range(events):
+        event = Event(i)
+        logger.info(f'Publish game event: game-{i % 100}: {event}')
+        logger.debug(f'Delivered to listeners: {event!r}')
+        if i % EVENTS_PER_TICK == 0:
+            await asyncio.sleep(0)
+
+
+async def publish_lazy(events: int):
+    for i in range(events):
+        event = Event(i)
+        logger.info('Publish game event: %s: %s', f'game-{i % 100}', event, extra={'game_id': f'game-{i % 100}'})
+        logger.debug('Delivered to listeners: %r', event)
+        if i % EVENTS_PER_TICK == 0:
+            await asyncio.sleep(0)
+
+
+async def measure(name: str, publish, events: int):
+    lags, done = [], asyncio.Event()
+    task = asyncio.create_task(monitor(lags, done))
+    start = time.perf_counter()
+    await publish(events)
+    elapsed = time.perf_counter() - start
+    done.set()
+    await task
+    print(f'{name:>9}: {events / elapsed:8.0f} events/s, loop lag p50={percentile(lags, 50) * 1000:.2f}ms '
+          f'p99={percentile(lags, 99) * 1000:.2f}ms max={max(lags) * 1000:.2f}ms')
+
+
+def main(events: int, write_ms: float):
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(SlowStream(write_ms / 1000))]
+    root.setLevel(logging.INFO)
+    asyncio.run(measure('blocking', publish_eager, events))
+
+    log.setup('INFO', SlowStream(write_ms / 1000))
+    asyncio.run(measure('queued', publish_lazy, events))  # The queue is written at exit
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]), float(sys.argv[2])) if len(sys.argv) > 2 else main(5000, .2)
@@ -0,0 +1,54 @@
+"""
+Per-save latency of `Game.save` against the redis at REDIS_URL (use a local one).
+
+    python -m benchmarks.save_latency [rounds]
+"""
+import asyncio
+import pickle
+import statistics
+import sys
+import time
+
+from avalon import config
+from avalon.game import Game, Participant, redis_client
+
+
+async def legacy_save(game: Game):
+    # The save path before pipelining: three round-trips and three pickles
+    pickle.dumps(game)
+    await redis_client.setex(config.REDIS_PREFIX_GAME + game.game_id, config.GAME_RETENTION, pickle.dumps(game))
+    await redis_client.lpush(config.REDIS_PREFIX_GAME_HISTORY + game.game_id, pickle.dumps(game))
+    await redis_client.expire(config.REDIS_PREFIX_GAME_HISTORY + game.game_id, config.GAME_HISTORY_RETENTION)
+
+
+async def current_save(game: Game):
+    await game.save()
+
+
+async def measure(save, rounds):
+    game = Game(participants=[Participant(f'player-{i}') for i in range(9)])
+    extra = Participant('player-9')
+    timings = []
+    for i in range(rounds):
+        # A change is needed for each save to be written
+        if i % 2:
+            game.remove_participant(extra)
+        else:
+            game.add_participant(extra)
+        start = time.perf_counter()
+        await save(game)
+        timings.append((time.perf_counter() - start) * 1000)
+    await redis_client.delete(config.REDIS_PREFIX_GAME + game.game_id,
+                              config.REDIS_PREFIX_GAME_HISTORY + game.game_id)
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * .99)]
+
+
+async def main(rounds):
+    for name, save in (('legacy', legacy_save), ('current', current_save)):
+        mean, p50, p99 = await measure(save, rounds)
+        print(f'{name:>8}: mean={mean:.3f}ms p50={p50:.3f}ms p99={p99:.3f}ms ({rounds} saves)')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000))
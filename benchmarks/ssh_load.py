@@ -0,0 +1,206 @@
+"""
+Load test of the SSH frontend: opens many concurrent sessions (each with its own generated key) against a local
+server (`run.py` with SSH_WORKERS), groups them into games and plays the games by scripted moves.
+Reports the connection setup time (until the menu is received), the response latency of the keystrokes (from
+sending a line until the next prompt), and the memory per session and CPU time per game of the server processes.
+
+Moves are decided by reading the games from redis (REDIS_URL, shared with the server), a move is sent again
+if it's not applied, e.g. when it's rejected by a concurrent modification.
+
+    python -m benchmarks.ssh_load [sessions] [players-per-game] [ssh-workers]
+"""
+import asyncio
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import asyncssh
+
+from avalon import config
+from avalon.game import Game, GamePhase, redis_client
+from avalon_ssh.ssh_game import SshListener
+from benchmarks.ssh_scaling import PORT, start_server
+
+CONNECT_CONCURRENCY = 50
+MAX_STALLED_ROUNDS = 50  # Rounds of moves without any change in the game, before giving up
+
+
+class Session:
+    def __init__(self, index: int):
+        self.key = asyncssh.generate_private_key('ssh-ed25519')
+        # Same as the server, see `handle_client`
+        self.identity = hashlib.md5(self.key.public_data).hexdigest()[:16]
+        self.username = f'bot-{index}'
+        self.cursor = self.username + '> '
+        self.output = ''  # Since the last sent line
+        self.received = asyncio.Event()
+        self.conn = self.process = None
+
+    async def connect(self) -> float:
+        start = time.perf_counter()
+        self.conn = await asyncssh.connect('127.0.0.1', PORT, username=self.username, client_keys=[self.key],
+                                           known_hosts=None)
+        self.process = await self.conn.create_process(term_type='xterm', term_size=(120, 40))
+        asyncio.create_task(self.read())
+        await self.wait_for('Join an existing game')
+        return time.perf_counter() - start
+
+    async def read(self):
+        while chunk := await self.process.stdout.read(1 << 16):
+            self.output += chunk
+            self.received.set()
+
+    async def wait_for(self, text: str, timeout: float = 30, after_last_box=False) -> bool:
+        deadline = time.monotonic() + timeout
+        while text not in (self.output[self.output.rfind('┘'):] if after_last_box else self.output):
+            self.received.clear()
+            try:
+                await asyncio.wait_for(self.received.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def send(self, line: str, stats: Counter, latencies: list[float]):
+        self.output = ''
+        start = time.perf_counter()
+        self.process.stdin.write(line + '\n')
+        if not await self.wait_for(self.cursor):
+            stats['timeouts'] += 1
+        latencies.append(time.perf_counter() - start)
+        if any(error in self.output for error in ('Please Retry', 'changed meanwhile', 'Invalid input')):
+            stats['retries'] += 1
+
+    async def move(self, prompt: str, line: str, stats: Counter, latencies: list[float]):
+        if not await self.wait_for(prompt, timeout=2, after_last_box=True):
+            stats['stale_prompts'] += 1  # The session has not caught up with the game yet
+        await self.send(line, stats, latencies)
+
+    def close(self):
+        self.conn.close()
+
+
+def next_moves(game: Game, sessions: dict[str, Session], creator: Session, rng: random.Random) \
+        -> list[tuple[Session, str, str]]:
+    """:return: (session, expected prompt, line) of the pending moves"""
+    ps = game.participants
+    if game.phase == GamePhase.Joining:
+        joined = {p.identity for p in ps}
+        moves = [(s, '(J)Join', 'j') for identity, s in sessions.items() if identity not in joined]
+        return moves or [(creator, '(J)Join', 'p')]
+    if game.phase == GamePhase.Started:
+        return [(creator, '(P)Play', 'p')]
+    if game.phase == GamePhase.TeamBuilding:
+        king = ps.index(game.king)
+        team = {ps[(king + i) % len(ps)].identity for i in range(game.step[1])}
+        toggles = [str(i + 1) for i, p in enumerate(ps) if (p.identity in team) != (p in game.current_team)]
+        return [(sessions[game.king.identity], 'toggle team', ','.join(toggles) or 'c')]
+    if game.phase == GamePhase.TeamVote:
+        return [(sessions[p.identity], '(A)Approve', 'a' if rng.random() < .7 else 'r')
+                for p in ps if game.get_vote(p) is None]
+    if game.phase == GamePhase.Quest:
+        return [(sessions[p.identity], '(S)success', 'f' if p.role.is_evil and rng.random() < .5 else 's')
+                for p in game.current_team if game.get_quest_action(p) is None]
+    if game.phase == GamePhase.Lady:
+        return [(sessions[game.lady.identity], 'to select next lady', '1')]
+    if game.phase == GamePhase.GuessMerlin:
+        return [(sessions[game.get_assassin().identity], 'to select merlin', '1')]
+    return []
+
+
+async def play_game(players: list[Session], stats: Counter, latencies: list[float]) -> str:
+    """:return: the game_id"""
+    rng = random.Random()
+    creator = players[0]
+    await creator.send('1', stats, latencies)
+    game_id = (await SshListener.load_by_id(creator.identity)).game_id
+    for s in players[1:]:
+        await s.send('2', stats, latencies)
+        await s.send(game_id, stats, latencies)
+    sessions = {s.identity: s for s in players}
+    version, stalled = -1, 0
+    while stalled < MAX_STALLED_ROUNDS:
+        game = await Game.load_by_id(game_id)
+        if game.phase == GamePhase.Finished:
+            stats['games'] += 1
+            return game_id
+        stalled = stalled + 1 if game.version == version else 0
+        version = game.version
+        await asyncio.gather(*(s.move(prompt, line, stats, latencies)
+                               for s, prompt, line in next_moves(game, sessions, creator, rng)))
+    stats['stalled_games'] += 1
+    return game_id
+
+
+def server_usage(pid: int) -> tuple[float, int]:
+    """:return: CPU seconds and resident memory (bytes) of the server processes (children of the supervisor)"""
+    cpu = rss = 0
+    with open(f'/proc/{pid}/task/{pid}/children') as f:
+        children = f.read().split()
+    for child in children:
+        with open(f'/proc/{child}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu += (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime, stime
+        with open(f'/proc/{child}/status') as f:
+            rss += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS'))
+    return cpu, rss
+
+
+def percentile(values: list[float], percent: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def run(session_count: int, players: int, server_pid: int):
+    sessions = [Session(i) for i in range(session_count)]
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(session: Session):
+        async with semaphore:
+            return await session.connect()
+
+    _, rss_before = server_usage(server_pid)
+    setup_times = await asyncio.gather(*(connect(s) for s in sessions))
+    cpu_before, rss_after = server_usage(server_pid)
+
+    stats, latencies = Counter(), []
+    start = time.perf_counter()
+    game_ids = await asyncio.gather(*(play_game(sessions[i:i + players], stats, latencies)
+                                      for i in range(0, session_count - players + 1, players)))
+    elapsed = time.perf_counter() - start
+    cpu_after, _ = server_usage(server_pid)
+
+    for s in sessions:
+        s.close()
+    await redis_client.delete(*(config.REDIS_PREFIX_LISTENER + s.identity for s in sessions),
+                              *(config.REDIS_PREFIX_GAME + game_id for game_id in game_ids),
+                              *(config.REDIS_PREFIX_GAME_HISTORY + game_id for game_id in game_ids))
+
+    print(f'{session_count} sessions: setup p50={statistics.median(setup_times) * 1000:.1f}ms '
+          f'p99={percentile(setup_times, 99) * 1000:.1f}ms, '
+          f'server memory {(rss_after - rss_before) / session_count / 1024:.1f}KiB per session')
+    print(f'{stats["games"]} games ({players} players) in {elapsed:.2f}s, {len(latencies)} keystrokes: '
+          f'latency p50={percentile(latencies, 50) * 1000:.1f}ms p95={percentile(latencies, 95) * 1000:.1f}ms '
+          f'p99={percentile(latencies, 99) * 1000:.1f}ms, '
+          f'server CPU {(cpu_after - cpu_before) / max(stats["games"], 1) * 1000:.1f}ms per game')
+    print(f'{stats["retries"]} retried moves, {stats["stale_prompts"]} stale prompts, '
+          f'{stats["timeouts"]} timeouts, {stats["stalled_games"]} stalled games')
+
+
+def main(session_count, players, workers):
+    with tempfile.TemporaryDirectory() as tmp:
+        host_key_path = os.path.join(tmp, 'host_key')
+        asyncssh.generate_private_key('ssh-ed25519').write_private_key(host_key_path)
+        server = start_server(workers, host_key_path)
+        try:
+            asyncio.run(run(session_count, players, server.pid))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4])) if len(sys.argv) > 3 else main(200, 5, 1)
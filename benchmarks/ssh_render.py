@@ -0,0 +1,106 @@
+"""
+Rendering of the SSH sessions, over the phase messages of simulated 10 player games (in memory): the bytes sent
+per game event by redrawing the whole box against redrawing only the changed lines, and the CPU time per render of
+`avalon_ssh.render.box_lines` against the former implementation (without the width cache and grapheme clusters).
+
+    python -m benchmarks.ssh_render [games]
+"""
+import random
+import re
+import sys
+import time
+import unicodedata
+
+from avalon.game import Game, GamePhase
+from avalon.simulation import AGENTS
+from avalon_ssh.render import Screen, box_lines
+from avalon_ssh.ssh_game import SshParticipant, SshListener
+
+TERM_WIDTH = 124
+NON_VISIBLE_CHARS = re.compile(r'[\u200c\u200e\ufe0f]')
+
+
+def legacy_visible_len(text):
+    return sum((2 if unicodedata.east_asian_width(ch) == 'W' else 1) for ch in re.sub(NON_VISIBLE_CHARS, '', text))
+
+
+def legacy_box(msg, term_width):
+    lines = msg.strip().split('\n')
+    width = min(120, term_width - 4, max(legacy_visible_len(i) for i in lines))
+    out = ['┌─' + '─' * width + '─┐\n']
+    for line in lines:
+        for i in range(0, len(line) or 1, width):
+            part = line[i:i + width]
+            out.append('│ ' + part + ' ' * (width - legacy_visible_len(part)) + ' │\n')
+    out.append('└─' + '─' * width + '─┘\n')
+    return ''.join(out)
+
+
+def game_steps(rng: random.Random):
+    """Plays a game action by action (like `avalon.simulation.play_game`), yields the game after each action"""
+    game = Game(participants=[SshParticipant(f'player{i}', f'{i:016x}') for i in range(10)])
+    game.play()
+    yield game
+    game.proceed_to_game()
+    agents = {p.identity: AGENTS['random'](p, game, rng) for p in game.participants}
+    while game.phase != GamePhase.Finished:
+        yield game
+        if game.phase == GamePhase.TeamBuilding:
+            for p in agents[game.king.identity].select_team(game.step[1]):
+                game.select_for_team(game.king, p.identity)
+                yield game
+            game.confirm_team(game.king)
+        elif game.phase == GamePhase.TeamVote:
+            for p in game.participants:
+                game.vote(p, agents[p.identity].vote())
+                yield game
+            game.process_vote_results()
+        elif game.phase == GamePhase.Quest:
+            for p in game.current_team:
+                game.quest_action(p, agents[p.identity].quest_action())
+                yield game
+            game.process_quest_result()
+        elif game.phase == GamePhase.Lady:
+            game.set_next_lady(game.lady, agents[game.lady.identity].next_lady(game.next_lady_candidates()).identity)
+        elif game.phase == GamePhase.GuessMerlin:
+            assassin = game.get_assassin()
+            game.guess_merlin(assassin, agents[assassin.identity].guess_merlin(game.merlin_candidates()).identity)
+    yield game
+
+
+def main(games: int):
+    rng = random.Random(0)
+    messages, events, full_bytes = [], 0, 0
+    Screen.stats.clear()
+    for _ in range(games):
+        listeners, screens, shown = [], [], []
+        for game in game_steps(rng):
+            if not listeners:
+                listeners = [SshListener(p.identity, game) for p in game.participants]
+                screens = [Screen(TERM_WIDTH) for _ in listeners]
+                shown = [None] * len(listeners)
+            for i, (listener, screen) in enumerate(zip(listeners, screens)):
+                msg = listener.get_current_phase_message()
+                if msg == shown[i]:
+                    continue
+                events += 1
+                messages.append(msg)
+                full_bytes += len(('\n'.join(box_lines(msg, TERM_WIDTH)) + '\n').encode())
+                if screen.update(msg, game.phase) is None:
+                    screen.draw(msg, game.phase)
+                screen.wrote('> ')  # The prompt
+                shown[i] = msg
+    stats = Screen.stats
+    print(f'{events} phase messages of {games} games: {full_bytes / events:.0f} bytes per event by full redraws, '
+          f'{(stats["full_bytes"] + stats["diff_bytes"]) / events:.0f} bytes per event by incremental redraws '
+          f'({stats["diff_draws"]} in place, {stats["full_draws"]} full)')
+
+    for name, render in (('legacy', legacy_box), ('render', box_lines)):
+        start = time.process_time()
+        for msg in messages:
+            render(msg, TERM_WIDTH)
+        print(f'{name:>8}: {(time.process_time() - start) / len(messages) * 1e6:6.1f}us CPU per render')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,100 @@
+"""
+Connection throughput of the SSH frontend with 1, 2, 4... worker processes (`run.py` with SSH_WORKERS), to check
+it scales (near) linearly with the workers, up to the number of cores. A connection is counted when the menu is
+received, it includes the key exchange, authentication and loading the (missing) listener from redis.
+
+    python -m benchmarks.ssh_scaling [max-workers] [connections-per-run]
+"""
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import asyncssh
+
+PORT = 18022
+CLIENT_PROCESSES = max(2, os.cpu_count() // 2)
+CONCURRENCY = 32  # Connections in flight per client process
+
+
+async def connect(client_key):
+    async with asyncssh.connect('127.0.0.1', PORT, username='bench', client_keys=[client_key], known_hosts=None,
+                                term_type='xterm', term_size=(120, 40)) as conn:
+        process = await conn.create_process()
+        await process.stdout.readuntil('Join an existing game')
+        process.close()
+
+
+async def run_client(connections):
+    client_key = asyncssh.generate_private_key('ssh-ed25519')
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def limited():
+        async with semaphore:
+            await connect(client_key)
+
+    await asyncio.gather(*(limited() for _ in range(connections)))
+
+
+def client_process(connections):
+    asyncio.run(run_client(connections))
+
+
+def wait_for_port(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', PORT), 1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise TimeoutError('SSH server is not started')
+
+
+def start_server(workers, host_key_path) -> subprocess.Popen:
+    """Starts `run.py` in the supervisor mode, without the Telegram bot"""
+    env = dict(os.environ, SSH_WORKERS=str(workers), SSH_PORT=str(PORT), SSH_HOST_KEY=host_key_path, BOT_TOKEN='')
+    server = subprocess.Popen([sys.executable, 'run.py'], env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port()
+        time.sleep(workers * 0.5)  # All workers to listen on the port
+    except TimeoutError:
+        server.terminate()
+        raise
+    return server
+
+
+def measure(workers, connections, host_key_path):
+    server = start_server(workers, host_key_path)
+    try:
+        with multiprocessing.get_context('spawn').Pool(CLIENT_PROCESSES) as pool:
+            pool.map(client_process, [CLIENT_PROCESSES] * CLIENT_PROCESSES)  # Warm-up
+            start = time.perf_counter()
+            pool.map(client_process, [connections // CLIENT_PROCESSES] * CLIENT_PROCESSES)
+            elapsed = time.perf_counter() - start
+        return connections // CLIENT_PROCESSES * CLIENT_PROCESSES / elapsed
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main(max_workers, connections):
+    with tempfile.TemporaryDirectory() as tmp:
+        host_key_path = os.path.join(tmp, 'host_key')
+        asyncssh.generate_private_key('ssh-ed25519').write_private_key(host_key_path)
+        workers, baseline = 1, None
+        while workers <= max_workers:
+            throughput = measure(workers, connections, host_key_path)
+            baseline = baseline or throughput
+            print(f'{workers:3} workers: {throughput:8.1f} connections/s, '
+                  f'scaling {throughput / baseline:.2f}x (ideal {workers}x), {os.cpu_count()} cores')
+            workers *= 2
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3])) if len(sys.argv) > 2 else main(4, 400)
@@ -0,0 +1,159 @@
+"""
+End-to-end benchmark of the Telegram path, against the in-process fake Bot API (no Telegram is needed):
+groups of 5-10 players create games by /new and play them to the end by clicking the buttons, through the real
+handlers, listeners and message builders (the games are stored in the redis at REDIS_URL).
+Reports the updates/s, and the latency from pressing a button until the callback query is answered.
+
+    python -m benchmarks.telegram_load [groups] [api-latency-ms] [rate-limit-ratio]
+"""
+import asyncio
+import itertools
+import logging
+import random
+import sys
+import time
+from collections import Counter
+
+from avalon import config
+from avalon.game import GamePhase, redis_client, render_cache
+from avalon_bot import bot
+from avalon_bot.bot import create_application
+from avalon_bot.common import COMMAND_NEW, MSG_JOIN, MSG_PLAY, MSG_PROCEED, MSG_SELECT, MSG_CONFIRM_TEAM, \
+    MSG_APPROVE, MSG_REJECT, MSG_SUCCESS, MSG_FAIL, MSG_NEXT_LADY, MSG_TRUTH, MSG_GUESS_MERLIN, MSG_CONFIRM_MERLIN
+from avalon_bot.telegram_game import TgListener
+from benchmarks.fake_bot_api import FakeBotApi
+
+PORT = 18081
+TOKEN = '123456:fake-token'
+ROUND_TIMEOUT = 60  # Seconds to wait for the answers of a round of clicks
+STALL_DELAY = 0.05  # Seconds to wait when a round of clicks has not changed anything (e.g. rendering is pending)
+MAX_STALL = 60  # Seconds without any change in the game, before giving up
+
+query_ids = itertools.count(1)
+
+
+def user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'player-{user_id}'}
+
+
+def chat(chat_id: int) -> dict:
+    return {'id': chat_id, 'type': 'group', 'title': f'group {chat_id}'}
+
+
+def command_update(chat_id: int, user_id: int, command: str) -> dict:
+    return {'message': {'message_id': 0, 'date': int(time.time()), 'chat': chat(chat_id), 'from': user(user_id),
+                        'text': '/' + command, 'entities': [{'type': 'bot_command', 'offset': 0,
+                                                             'length': len(command) + 1}]}}
+
+
+def callback_update(chat_id: int, user_id: int, message_id: int, data: str) -> dict:
+    return {'callback_query': {'id': f'cb-{next(query_ids)}', 'from': user(user_id), 'chat_instance': str(chat_id),
+                               'data': data, 'message': {'message_id': message_id, 'date': int(time.time()),
+                                                         'chat': chat(chat_id), 'text': ''}}}
+
+
+def next_clicks(listener: TgListener, user_ids: list[int], rng: random.Random) -> list[tuple[int, str]]:
+    """:return: (user_id, callback data) of the pending clicks"""
+    game = listener.game
+    ps = game.participants
+    if game.phase == GamePhase.Joining:
+        joined = {p.identity for p in ps}
+        return [(u, MSG_JOIN) for u in user_ids if str(u) not in joined] or [(user_ids[0], MSG_PLAY)]
+    if game.phase == GamePhase.Started:
+        return [(user_ids[0], MSG_PROCEED)]
+    if game.phase == GamePhase.TeamBuilding:
+        king = ps.index(game.king)
+        team = {ps[(king + i) % len(ps)].identity for i in range(game.step[1])}
+        toggles = [p.identity for p in ps if (p.identity in team) != (p in game.current_team)]
+        # Selection of each member is saved separately, so they are clicked one by one
+        return [(int(game.king.identity), MSG_SELECT + toggles[0] if toggles else MSG_CONFIRM_TEAM)]
+    if game.phase == GamePhase.TeamVote:
+        return [(int(p.identity), MSG_APPROVE if rng.random() < .7 else MSG_REJECT) for p in ps if game.get_vote(p) is None]
+    if game.phase == GamePhase.Quest:
+        return [(int(p.identity), MSG_FAIL if p.role.is_evil and rng.random() < .5 else MSG_SUCCESS)
+                for p in game.current_team if game.get_quest_action(p) is None]
+    if game.phase == GamePhase.Lady:
+        if listener.pending_next_lady:
+            return [(int(game.lady.identity), MSG_TRUTH)]
+        return [(int(game.lady.identity), MSG_NEXT_LADY + game.next_lady_candidates()[0].identity)]
+    if game.phase == GamePhase.GuessMerlin:
+        assassin = game.get_assassin()
+        if listener.pending_merlin:
+            return [(int(assassin.identity), MSG_CONFIRM_MERLIN)]
+        return [(int(assassin.identity), MSG_GUESS_MERLIN + game.merlin_candidates()[0].identity)]
+    return []
+
+
+def progress(listener: TgListener) -> tuple:
+    return (listener.game.version, listener.active_message_id, listener.pending_next_lady and
+            listener.pending_next_lady.identity, listener.pending_merlin and listener.pending_merlin.identity)
+
+
+async def play_group(api: FakeBotApi, chat_id: int, user_ids: list[int], latencies: list[float], stats: Counter) \
+        -> str:
+    """:return: the game_id"""
+    rng = random.Random()
+    api.push_update(command_update(chat_id, user_ids[0], COMMAND_NEW))
+    stats['updates'] += 1
+    while not (listener := await TgListener.load_by_id(str(chat_id))) or not listener.active_message_id:
+        await asyncio.sleep(STALL_DELAY)
+    last_progress, last_change = None, time.monotonic()
+    while listener.game.phase != GamePhase.Finished:
+        if progress(listener) == last_progress:
+            if time.monotonic() - last_change > MAX_STALL:
+                stats['stalled_games'] += 1
+                return listener.game_id
+            stats['stalled_rounds'] += 1
+            await asyncio.sleep(STALL_DELAY)
+        else:
+            last_progress, last_change = progress(listener), time.monotonic()
+        clicks = next_clicks(listener, user_ids, rng)
+        answers = [api.push_update(callback_update(chat_id, user_id, listener.active_message_id, data))
+                   for user_id, data in clicks]
+        stats['updates'] += len(answers)
+        latencies.extend(await asyncio.wait_for(asyncio.gather(*answers), ROUND_TIMEOUT))
+        listener = await TgListener.load_by_id(str(chat_id))
+    stats['games'] += 1
+    return listener.game_id
+
+
+def percentile(values: list[float], percent: float) -> float:
+    return sorted(values)[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+async def main(groups: int, latency_ms: float, rate_limit_ratio: float):
+    logging.getLogger().setLevel(logging.WARNING)
+    api = FakeBotApi(PORT, latency_ms / 1000, rate_limit_ratio)
+    await api.start()
+    app = create_application(TOKEN, api.base_url)
+    await app.initialize()
+    await app.updater.start_polling(poll_interval=0, timeout=1)
+    await app.start()
+
+    rng = random.Random()
+    chats = {-1000 - i: [1000 * i + j for j in range(1, rng.randint(5, 10) + 1)] for i in range(groups)}
+    await redis_client.delete(*(config.REDIS_PREFIX_LISTENER + str(chat_id) for chat_id in chats))
+    stats, latencies = Counter(), []
+    start = time.perf_counter()
+    game_ids = await asyncio.gather(*(play_group(api, chat_id, user_ids, latencies, stats)
+                                      for chat_id, user_ids in chats.items()))
+    elapsed = time.perf_counter() - start
+
+    # The pending renders and API calls are done before the connection pool of the bot is closed
+    await bot.stop_application(app)
+    await api.stop()
+    await redis_client.delete(*(config.REDIS_PREFIX_LISTENER + str(chat_id) for chat_id in chats),
+                              *(config.REDIS_PREFIX_GAME + game_id for game_id in game_ids),
+                              *(config.REDIS_PREFIX_GAME_HISTORY + game_id for game_id in game_ids))
+
+    print(f'{stats["games"]} games of {groups} groups in {elapsed:.2f}s: {stats["updates"] / elapsed:.1f} updates/s, '
+          f'answered p50={percentile(latencies, 50) * 1000:.1f}ms p95={percentile(latencies, 95) * 1000:.1f}ms '
+          f'p99={percentile(latencies, 99) * 1000:.1f}ms')
+    print(f'API calls: {", ".join(f"{k}={v}" for k, v in sorted(api.stats.items()))}')
+    print(f'{stats["stalled_rounds"]} rounds without a change (waiting for rendering), '
+          f'{stats["stalled_games"]} stalled games, render cache hit ratio {render_cache.hit_ratio:.2f}')
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]), float(sys.argv[2]), float(sys.argv[3])) if len(sys.argv) > 3 else
+                main(20, 50, .01))
@@ -0,0 +1,88 @@
+"""
+Throughput and handling latency of the webhook ingestion, fed by a fake-update injector (no Telegram is needed).
+The injector posts callback-query updates over keep-alive connections, the handler simulates the I/O of an action
+(a few round-trips to redis and the bot API) by sleeping.
+
+    python -m benchmarks.webhook_throughput [updates] [handler-ms]
+"""
+import asyncio
+import itertools
+import json
+import sys
+import time
+
+from telegram import Bot
+
+from avalon_bot.webhook import WebhookIngestion, webhook_path
+
+PORT = 18443
+CONNECTIONS = 40  # The default max_connections of Telegram webhooks
+TOKEN = '123456:fake-token'
+
+update_ids = itertools.count(1)
+
+
+def fake_update(chat_id: int, user_id: int) -> bytes:
+    update_id = next(update_ids)
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'player-{user_id}'}
+    return json.dumps({'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user, 'chat_instance': str(chat_id), 'data': 'vote-approve',
+        'message': {'message_id': 1, 'date': int(time.time()), 'text': 'Vote',
+                    'chat': {'id': chat_id, 'type': 'group'}}}}).encode()
+
+
+async def post(reader, writer, path: str, body: bytes) -> bytes:
+    writer.write(f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                 f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    status = await reader.readline()
+    size = 0
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        if line.lower().startswith(b'content-length'):
+            size = int(line.split(b':')[1])
+    await reader.readexactly(size)
+    return status
+
+
+async def inject(path: str, updates: int, response_times: list[float]):
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    for i in range(updates):
+        body = fake_update(-1000 - i % 50, i % 10)
+        while True:
+            start = time.perf_counter()
+            status = await post(reader, writer, path, body)
+            response_times.append(time.perf_counter() - start)
+            if b' 200 ' in status:
+                break
+            await asyncio.sleep(0.05)  # Telegram retries later, when the backlog is full
+    writer.close()
+
+
+async def measure(workers: int, updates: int, handler_ms: float):
+    async def process_update(_update):
+        await asyncio.sleep(handler_ms / 1000)
+
+    path = webhook_path(TOKEN)
+    ingestion = WebhookIngestion(Bot(TOKEN), process_update, path, workers, backlog=1000)
+    await ingestion.start('127.0.0.1', PORT)
+    response_times = []
+    start = time.perf_counter()
+    await asyncio.gather(*(inject(path, updates // CONNECTIONS, response_times) for _ in range(CONNECTIONS)))
+    await ingestion.queue.join()
+    elapsed = time.perf_counter() - start
+    await ingestion.stop()
+    response_times.sort()
+    print(f'{workers:4} workers: {ingestion.stats["processed"] / elapsed:8.1f} updates/s, '
+          f'handling p50={ingestion.latency_percentile(50) * 1000:.1f}ms '
+          f'p99={ingestion.latency_percentile(99) * 1000:.1f}ms, '
+          f'response p99={response_times[int(len(response_times) * .99)] * 1000:.1f}ms, '
+          f'{ingestion.stats["rejected"]} rejected (backlog full)')
+
+
+async def main(updates, handler_ms):
+    for workers in (1, 4, 16, 64):
+        await measure(workers, updates, handler_ms)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]), float(sys.argv[2])) if len(sys.argv) > 2 else main(4000, 5))
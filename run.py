@@ -1,6 +1,11 @@
 import asyncio
 import logging
+import multiprocessing
+import os
+import signal
+import time
 import warnings
+from multiprocessing.connection import wait
 
 warnings.filterwarnings(
     action='ignore',
@@ -8,13 +13,97 @@ warnings.filterwarnings(
     message="Blowfish|SEED|CAST5 has been deprecated",
 )
 
-from avalon_bot.bot import main
-from avalon_ssh.server import start_server
+from avalon import config, log
 
-loop = asyncio.get_event_loop()
-loop.run_until_complete(start_server())
+logger = logging.getLogger('supervisor')
 
-logging.getLogger('telegram').setLevel(logging.INFO)
-logging.getLogger('httpx').setLevel(logging.INFO)
-logging.getLogger('asyncssh').setLevel(logging.WARNING)
-main()
+
+def set_log_levels():
+    logging.getLogger('telegram').setLevel(logging.INFO)
+    logging.getLogger('httpx').setLevel(logging.INFO)
+    logging.getLogger('asyncssh').setLevel(logging.WARNING)
+
+
+def run_all():
+    from avalon_bot.bot import main
+    from avalon_ssh.server import start_server
+
+    log.setup()
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(start_server())
+    set_log_levels()
+    main()
+
+
+def run_ssh_worker():
+    from avalon_ssh import server
+    set_log_levels()
+    server.main()
+
+
+def run_telegram():
+    from avalon_bot.bot import main
+    set_log_levels()
+    main()
+
+
+def supervise(ssh_workers: int):
+    """
+    Runs the SSH server on `ssh_workers` processes (the kernel balances the connections between them, using
+    reuse_port), and the Telegram bot on its own process. Processes are restarted when they exit.
+    Games are shared through redis, so any process can serve any game, the events are published on redis too.
+    """
+    log.setup()
+    os.environ['EVENT_BUS'] = 'redis'
+    targets = {f'ssh-{i}': run_ssh_worker for i in range(ssh_workers)}
+    if config.BOT_TOKEN:
+        targets['telegram'] = run_telegram
+    else:
+        logger.warning('BOT_TOKEN is not set, the Telegram bot is not started')
+    # Each process serves its own metrics
+    metrics_ports = {name: config.METRICS_PORT + i for i, name in enumerate(targets)} if config.METRICS_PORT else {}
+    context = multiprocessing.get_context('spawn')
+    processes: dict[str, multiprocessing.Process] = {}
+    stopping = False
+
+    def start(name):
+        if name in metrics_ports:
+            os.environ['METRICS_PORT'] = str(metrics_ports[name])  # Taken by the spawned process
+        processes[name] = context.Process(target=targets[name], name=name)
+        processes[name].start()
+        logger.info('Started %s, pid %s', name, processes[name].pid)
+
+    def stop(*_args):
+        nonlocal stopping
+        stopping = True
+        for process in processes.values():
+            if process.is_alive():
+                process.terminate()
+
+    def forward(signum, _frame):
+        for process in processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    if config.PROFILING and hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, forward)  # Profiling data is dumped by each process
+    for name in targets:
+        start(name)
+    while not stopping:
+        wait([p.sentinel for p in processes.values()])
+        for name, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                logger.error('%s exited with code %s, restarting', name, process.exitcode)
+                time.sleep(1)
+                start(name)
+    for process in processes.values():
+        process.join()
+
+
+if __name__ == '__main__':
+    if config.SSH_WORKERS:
+        supervise(config.SSH_WORKERS)
+    else:
+        run_all()
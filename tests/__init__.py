@@ -0,0 +1,13 @@
+import asyncio
+
+from avalon import game
+
+
+def run(coro):
+    """Runs the coroutine on a new loop, the connections of the redis client are bound to it"""
+    async def main():
+        try:
+            return await coro
+        finally:
+            await game.redis_client.connection_pool.disconnect()
+    return asyncio.run(main())
@@ -0,0 +1,13 @@
+import aioredis
+import pytest
+
+from avalon import game
+from tests import run
+
+
+@pytest.fixture(scope='session')
+def redis_available():
+    try:
+        run(game.redis_client.ping())
+    except (OSError, aioredis.ConnectionError):
+        pytest.skip('Redis is not reachable')
@@ -0,0 +1,63 @@
+"""Random games, played action by action, for the property tests"""
+import random
+from typing import Iterator
+
+from avalon import codec
+from avalon.game import Game, GamePhase
+from avalon.simulation import AGENTS
+from avalon_ssh.ssh_game import SshParticipant
+
+SEEDS = range(40)
+
+
+def game_steps(seed: int) -> Iterator[Game]:
+    """Plays a game of random agents (with joins, leaves and restarts too), yields the game after each step"""
+    rng = random.Random(seed)
+    random.seed(seed)  # Roles, king and lady are chosen by the game itself
+    game = Game(f'{seed:03d}-{rng.randint(100, 999)}')
+    players = rng.randint(5, 10)
+    for i in range(players + 1):
+        game.add_participant(SshParticipant(f'player{i}', f'{i:016x}'))
+        yield game
+    game.remove_participant(rng.choice(game.participants))
+    yield game
+    game.play()
+    yield game
+    game.proceed_to_game()
+    agents = {p.identity: AGENTS[rng.choice(list(AGENTS))](p, game, rng) for p in game.participants}
+    while game.phase != GamePhase.Finished:
+        yield game
+        if game.phase == GamePhase.TeamBuilding:
+            for p in agents[game.king.identity].select_team(game.step[1]):
+                game.select_for_team(game.king, p.identity)
+                yield game
+            game.confirm_team(game.king)
+        elif game.phase == GamePhase.TeamVote:
+            for p in game.participants:
+                game.vote(p, agents[p.identity].vote())
+                yield game
+            game.process_vote_results()
+        elif game.phase == GamePhase.Quest:
+            for p in game.current_team:
+                game.quest_action(p, agents[p.identity].quest_action())
+                yield game
+            game.process_quest_result()
+        elif game.phase == GamePhase.Lady:
+            game.set_next_lady(game.lady, agents[game.lady.identity].next_lady(game.next_lady_candidates()).identity)
+        elif game.phase == GamePhase.GuessMerlin:
+            assassin = game.get_assassin()
+            game.guess_merlin(assassin, agents[assassin.identity].guess_merlin(game.merlin_candidates()).identity)
+    yield game
+    if rng.random() < .5:
+        game.restart()
+        yield game
+
+
+def snapshot(game: Game) -> list:
+    """
+    The encoded fields of the game, except the times (a replayed restart is created anew) and the ones kept by the
+    saves (last saved phase and history position)
+    """
+    fields = codec._unpack(codec.encode_game(game))
+    del fields[13:15], fields[6], fields[1:3]
+    return fields
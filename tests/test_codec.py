@@ -0,0 +1,54 @@
+import pytest
+
+from avalon import codec
+from avalon.game import GameEvent, QuestCompleted, VotingCompleted, GamePhaseChanged, GameDeleted
+from avalon_bot.telegram_game import TgListener
+from avalon_ssh.ssh_game import SshListener
+from tests.games import SEEDS, game_steps
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_game_round_trip(seed):
+    for game in game_steps(seed):
+        data = codec.encode_game(game)
+        decoded = codec.decode_game(data)
+        assert codec.encode_game(decoded) == data
+        assert decoded.phase == game.phase and decoded.version == game.version
+        assert [(p.identity, p.role, p.username) for p in decoded.participants] == \
+               [(p.identity, p.role, p.username) for p in game.participants]
+        assert [p.identity for p in decoded.current_team] == [p.identity for p in game.current_team]
+        assert [p.identity for p in decoded.past_ladies] == [p.identity for p in game.past_ladies]
+        assert decoded.round_result == game.round_result
+        assert [decoded.votes_cast, decoded.votes_approved, decoded.quest_actions_cast,
+                decoded.quest_actions_succeeded] == \
+               [game.votes_cast, game.votes_approved, game.quest_actions_cast, game.quest_actions_succeeded]
+        for p in (decoded.king, decoded.lady):
+            assert p is None or p in decoded.participants
+
+
+@pytest.mark.parametrize('seed', SEEDS[:5])
+def test_listener_round_trip(seed):
+    game = list(game_steps(seed))[-1]
+    ssh_listener = SshListener(game.participants[0].identity, game)
+    tg_listener = TgListener('-1001', game)
+    tg_listener.active_message_id = 42
+    tg_listener.lady_responses = {7: {'identity': game.participants[1].identity, 'is_evil': True}}
+    for listener in (ssh_listener, tg_listener):
+        decoded = codec.decode_listener(codec.encode_listener(listener))
+        assert type(decoded) is type(listener)
+        assert decoded.game is None
+        assert decoded.__getstate__() == listener.__getstate__()
+
+
+@pytest.mark.parametrize('event', [GamePhaseChanged(), VotingCompleted(True), QuestCompleted(False, 2, 1),
+                                   GameDeleted()])
+def test_event_round_trip(event):
+    event.version = 12
+    game_id, decoded = codec.decode_event(codec.encode_event('123-456', event))
+    assert game_id == '123-456' and type(decoded) is type(event)
+    assert decoded.__dict__ == event.__dict__
+    assert decoded.data is None
+
+    _, decoded = codec.decode_event(codec.encode_event('123-456', event, b'game'))
+    assert decoded.data == b'game'
+    assert set(GameEvent.kinds.values()) >= {type(event)}
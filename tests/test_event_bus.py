@@ -0,0 +1,63 @@
+import asyncio
+
+from avalon import codec, game as game_module
+from avalon.event_bus import InMemoryEventBus, RedisEventBus
+from avalon.game import GamePhaseChanged, VotesChanged, VotingCompleted
+from tests import run
+from tests.games import game_steps
+
+
+class Listener:
+    def __init__(self):
+        self.queue = asyncio.Queue()
+
+
+def test_in_memory_dispatch():
+    async def main():
+        bus, listener, other = InMemoryEventBus(), Listener(), Listener()
+        bus.subscribe('123-456', listener)
+        bus.subscribe('654-321', other)
+        events = [GamePhaseChanged(), VotingCompleted(False)]
+        bus.dispatch('123-456', events)
+        assert [listener.queue.get_nowait() for _ in events] == events
+        assert other.queue.empty()
+
+        bus.unsubscribe('123-456', listener)
+        assert '123-456' not in bus.listeners
+        bus.dispatch('123-456', events)
+        assert listener.queue.empty()
+
+    asyncio.run(main())
+
+
+def test_redis_encode_carries_game_once():
+    game = list(game_steps(0))[-1]
+    data = codec.encode_game(game)
+    events = [GamePhaseChanged(), VotesChanged(), VotingCompleted(True)]
+    decoded = [codec.decode_event(entry) for entry in RedisEventBus(None).encode(game.game_id, events, data)]
+    assert [game_id for game_id, _event in decoded] == [game.game_id] * len(events)
+    assert [type(event) for _game_id, event in decoded] == [type(event) for event in events]
+    assert [event.data for _game_id, event in decoded] == [data, None, None]
+
+
+def test_redis_delivery(redis_available):
+    async def main():
+        bus, listener = RedisEventBus(game_module.redis_client), Listener()
+        bus.subscribe('123-456', listener)
+        try:
+            while bus.last_id == '$':  # The reader starts from the end of the stream
+                await asyncio.sleep(.01)
+            event = VotingCompleted(True)
+            event.version = 3
+            async with game_module.redis_client.pipeline(transaction=True) as pipe:
+                bus.stage(pipe, '654-321', [GamePhaseChanged()])
+                bus.stage(pipe, '123-456', [event])
+                await pipe.execute()
+            received = await asyncio.wait_for(listener.queue.get(), 10)
+            assert type(received) is VotingCompleted and received.__dict__ == event.__dict__
+            assert listener.queue.empty()
+        finally:
+            bus.reader.cancel()
+            await asyncio.gather(bus.reader, return_exceptions=True)
+
+    run(main())
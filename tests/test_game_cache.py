@@ -0,0 +1,40 @@
+from avalon import codec, config, game as game_module
+from avalon.game import Game, game_cache
+from tests import run
+from tests.games import game_steps
+
+
+def test_later_cached_version_is_not_served():
+    old = list(game_steps(1))[-1]
+    game_cache.put(old.game_id, (old.version, codec.encode_game(old)))
+    new = Game(old.game_id)  # Deleted and created again
+    new.version = 3
+    try:
+        assert Game.get_cached_at(old.game_id, new.version) is None
+        data = codec.encode_game(new)
+        game = Game.get_cached_at(old.game_id, new.version, data)
+        assert game.version == 3 and not game.participants and not game.is_changed
+        assert Game.get_cached_at(old.game_id, old.version).version == old.version
+    finally:
+        game_cache.pop(old.game_id)
+
+
+def test_recreated_game_replaces_cached(redis_available):
+    async def main():
+        old = None
+        for old in game_steps(2):
+            await old.save()
+        try:
+            await old.delete()
+            game_cache.put(old.game_id, (old.version, codec.encode_game(old)))  # Cached by another process
+            new = Game(old.game_id)
+            await new.save()
+            loaded = await Game.load_by_id(old.game_id)
+            assert loaded.version == new.version and not loaded.participants
+            assert Game.get_cached_at(old.game_id, new.version).version == new.version
+        finally:
+            game_cache.pop(old.game_id)
+            await game_module.redis_client.delete(config.REDIS_PREFIX_GAME + old.game_id,
+                                                  config.REDIS_PREFIX_GAME_HISTORY + old.game_id)
+
+    run(main())
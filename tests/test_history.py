@@ -0,0 +1,73 @@
+import pytest
+
+from avalon import codec, config, game as game_module
+from avalon.game import Game
+from tests import run
+from tests.games import SEEDS, game_steps, snapshot
+
+KEYFRAME_INTERVAL = 7
+
+
+def replay(records: list[bytes]) -> Game:
+    """Rebuilds the game from the last keyframe of the records, like `Game.load_from_history`"""
+    decoded = [codec.decode_record(r) for r in records]
+    start = max(i for i, record in enumerate(decoded) if isinstance(record, Game))
+    game = decoded[start]
+    for action, args in decoded[start + 1:]:
+        game.apply_action(action, *args)
+    return game
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_replay_matches_snapshots(seed):
+    records, snapshots, keyframe = [], [], None
+    for game in game_steps(seed):
+        records += [codec.encode_action(action, args) for action, args in game._pending_actions]
+        game._pending_actions = []
+        if keyframe is None or len(records) - keyframe >= KEYFRAME_INTERVAL:  # As saved by `Game.save`
+            keyframe = len(records)
+            records.append(codec.encode_keyframe(codec.encode_game(game)))
+        snapshots.append((len(records), snapshot(game)))
+    for size, expected in snapshots:
+        assert snapshot(replay(records[:size])) == expected
+
+
+@pytest.mark.parametrize('seed', SEEDS[:10])
+def test_load_from_history(seed, redis_available, monkeypatch):
+    monkeypatch.setattr(config, 'GAME_HISTORY_KEYFRAME_INTERVAL', KEYFRAME_INTERVAL)
+
+    async def play():
+        snapshots, game = [], None
+        try:
+            for game in game_steps(seed):
+                await game.save()
+                snapshots.append((game.history_size, snapshot(game)))
+            for size, expected in snapshots:
+                rebuilt = await Game.load_from_history(game.game_id, size - 1)
+                assert snapshot(rebuilt) == expected
+            assert await Game.history_length(game.game_id) == game.history_size
+            assert snapshot(await Game.load_by_id(game.game_id)) == snapshots[-1][1]
+        finally:
+            await game_module.redis_client.delete(config.REDIS_PREFIX_GAME + game.game_id,
+                                                  config.REDIS_PREFIX_GAME_HISTORY + game.game_id)
+
+    run(play())
+
+
+@pytest.mark.parametrize('seed', SEEDS[:5])
+def test_expired_history_is_restarted(seed, redis_available):
+    async def play():
+        expire_at, game = sum(1 for _ in game_steps(seed)) // 2, None
+        history_key = config.REDIS_PREFIX_GAME_HISTORY
+        try:
+            for i, game in enumerate(game_steps(seed)):
+                if i == expire_at:
+                    await game_module.redis_client.delete(history_key + game.game_id)  # Expired
+                await game.save()
+                rebuilt = await Game.load_from_history(game.game_id)
+                assert rebuilt and snapshot(rebuilt) == snapshot(game)
+                assert await Game.history_length(game.game_id) == game.history_size
+        finally:
+            await game_module.redis_client.delete(config.REDIS_PREFIX_GAME + game.game_id, history_key + game.game_id)
+
+    run(play())
@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from avalon import codec
+from avalon.exceptions import InvalidParticipant
+from avalon.game import EVIL_INFO, MERLIN_INFO, PERCIVAL_INFO, Game, GamePhase, Role
+from avalon_ssh.ssh_game import SshParticipant
+from tests.games import SEEDS, game_steps
+
+
+def get_participant_by_id(game: Game, identity: str):
+    for p in game.participants:
+        if p.identity == identity:
+            return p
+    raise InvalidParticipant
+
+
+def get_assassin(game: Game):
+    for p in game.participants:
+        if p.role is Role.Assassin:
+            return p
+    for p in game.participants:
+        if p.role.is_evil:
+            return p
+
+
+def check_lookups(game: Game):
+    """Checks the lookups of the game against the linear scans which they have replaced"""
+    ps = game.participants
+    for p in ps:
+        assert game.get_participant_by_id(p.identity) is get_participant_by_id(game, p.identity)
+        assert game.in_team(p) == (p in game.current_team)
+    with pytest.raises(InvalidParticipant):
+        game.get_participant_by_id('not-joined')
+    if game.lady:
+        assert game.next_lady_candidates() == [p for p in ps if p != game.lady and p not in game.past_ladies]
+    if all(p.role is not None for p in ps):
+        assert game.merlin_candidates() == [p for p in ps if not p.role.is_evil]
+        assert game.get_assassin() is get_assassin(game)
+        assert game.index.merlin_info == [p for p in ps if p.role in MERLIN_INFO]
+        assert game.index.percival_info == [p for p in ps if p.role in PERCIVAL_INFO]
+        assert game.index.evil_info == [p for p in ps if p.role in EVIL_INFO]
+        for role in Role:
+            assert game.index.by_role.get(role, []) == [p for p in ps if p.role is role]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_lookups_match_scans(seed):
+    rng = random.Random(seed)
+    for game in game_steps(seed):
+        check_lookups(game)  # Builds the lookups, to be kept up to date by the next steps
+        check_lookups(codec.decode_game(codec.encode_game(game)))
+    if game.phase == GamePhase.Joining:  # Restarted
+        game.remove_participant(rng.choice(game.participants))
+        check_lookups(game)
+        game.add_participant(SshParticipant('late', 'late-joiner'))
+        check_lookups(game)
@@ -0,0 +1,37 @@
+from avalon import config, game as game_module
+from avalon.game import EventListener, Game
+from avalon_bot.telegram_game import TgListener
+from avalon_ssh.ssh_game import SshListener
+from tests import run
+from tests.games import game_steps
+
+
+def test_load_all_mixed_kinds(redis_available, monkeypatch):
+    async def main():
+        game = list(game_steps(0))[-1]
+        await game.save()
+        listeners = [TgListener('-990001', game), SshListener('test-ssh-listener', game), TgListener('-990002', game)]
+        broken = config.REDIS_PREFIX_LISTENER + 'test-broken-listener'
+        try:
+            for listener in listeners:
+                await listener.save()
+            await game_module.redis_client.hset(broken, mapping={'game_id': game.game_id, 'data': b'AV\x04\xc1'})
+
+            async def load_all(cls):
+                return {listener.id: listener async for batch in cls.load_all(2) for listener in batch
+                        if listener.game_id == game.game_id}
+
+            assert sorted(await load_all(TgListener)) == ['-990001', '-990002']
+            assert sorted(await load_all(EventListener)) == ['-990001', '-990002', 'test-ssh-listener']
+            loaded = await load_all(TgListener)
+            assert all(isinstance(listener.game, Game) for listener in loaded.values())
+
+            # A process which doesn't import the SSH listeners (e.g. the bot of the supervisor mode)
+            monkeypatch.delitem(EventListener.kinds, SshListener.codec_kind)
+            assert sorted(await load_all(TgListener)) == ['-990001', '-990002']
+        finally:
+            await game_module.redis_client.delete(
+                broken, config.REDIS_PREFIX_GAME + game.game_id, config.REDIS_PREFIX_GAME_HISTORY + game.game_id,
+                *(config.REDIS_PREFIX_LISTENER + listener.id for listener in listeners))
+
+    run(main())